@@ -6,26 +6,211 @@
 所有操作都在用户的存储目录内进行：/storage/{user_uuid}/
 """
 
+import asyncio
+import errno
 import logging
+import os
 import shutil
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
+from typing import Callable, Dict, Optional
 
 from fastapi import APIRouter, HTTPException, status, Query, Request
 from fastapi.responses import JSONResponse
 
 from config import STORAGE_DIR, get_user_storage_dir
 from api.utils.path_utils import validate_user_path, _is_safe_operation
+from api.utils.hash_index import hash_index
+from api.file_operations.browse import invalidate_storage_stats
 
 logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:
+    # Windows没有fcntl，复制时直接走shutil.copy2
+    fcntl = None
+
+# linux/fs.h里的FICLONE ioctl：_IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+
+def _fast_copy2(src, dst):
+    """复制单个文件，行为和shutil.copy2一致（内容+元数据）
+    
+    btrfs/xfs这类支持reflink的文件系统上先尝试FICLONE写时复制克隆，
+    只改元数据不拷数据，GB级文件也是瞬间完成
+    不支持的文件系统（ext4等）ioctl会失败，退回shutil.copy2（Linux上内部走sendfile）
+    """
+    if fcntl is not None and sys.platform.startswith("linux"):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            pass
+        else:
+            shutil.copystat(src, dst)
+            return dst
+    return shutil.copy2(src, dst)
+
+
+def _replace_path(src: Path, dst: Path) -> None:
+    """把src移动/重命名到dst（dst是完整的目标路径，不是目标目录）
+    
+    存储都在同一个文件系统上，os.replace就是一次rename系统调用，原子的；
+    shutil.move每次都要先做一堆stat判断。Windows上Path.rename目标存在会失败，os.replace不会
+    只有跨文件系统（EXDEV，比如回收站被单独挂载了）才退回shutil.move的复制+删除
+    调用方负责先检查dst是否已存在
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
+
+
+def _copy_path(source: Path, new_location: Path, is_dir: bool, task: Optional[Dict] = None) -> None:
+    """复制文件或目录（同步版本，在线程里跑），目标已存在时先删掉再复制
+    
+    Args:
+        source: 源路径
+        new_location: 目标完整路径
+        is_dir: 源是否是目录
+        task: 后台任务记录，传了就把已复制的文件数写到task["processed"]
+    """
+    if is_dir:
+        if new_location.exists():
+            shutil.rmtree(new_location)
+        
+        def copy_function(src, dst):
+            result = _fast_copy2(src, dst)
+            if task is not None:
+                task["processed"] += 1
+            return result
+        
+        # shutil.copytree接受Path对象，不需要转换为字符串
+        shutil.copytree(source, new_location, copy_function=copy_function)
+    else:
+        if new_location.exists():
+            new_location.unlink()
+        _fast_copy2(source, new_location)
+        # 内容一样，源文件的哈希索引记录直接复制给新文件，按哈希找文件时不用重新算
+        source_stat = source.stat()
+        file_hash = hash_index.get(source, source_stat)
+        if file_hash is not None:
+            hash_index.record(new_location, file_hash, new_location.stat())
+
+
+def _delete_path(target_path: Path, is_dir: bool) -> None:
+    """永久删除文件或目录（同步版本，在线程里跑），顺便清掉哈希索引里的记录"""
+    if is_dir:
+        shutil.rmtree(target_path)
+    else:
+        target_path.unlink()
+    hash_index.remove(target_path)
+
+
+# 后台任务：大目录的复制/永久删除可能要跑好几分钟，
+# 请求带background=true时放到这个线程池里跑，接口立即返回202和任务ID，客户端用 /files/tasks/{task_id} 轮询
+# 任务记录只放内存里，进程重启就没了；超过上限时先淘汰最早的已结束任务
+_BG_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="file-task")
+_TASKS_MAX = 1000
+_tasks: "OrderedDict[str, Dict]" = OrderedDict()
+_tasks_lock = threading.Lock()
+
+
+def _submit_task(user_uuid: str, operation: str, user_dir: Path, fn: Callable[[Dict], None]) -> Dict:
+    """提交一个后台文件任务
+    
+    Args:
+        user_uuid: 发起任务的用户，查询任务状态时只有本人能看到
+        operation: 操作说明（比如"copy directory"）
+        user_dir: 用户的存储目录，任务结束后让存储统计缓存失效
+        fn: 实际干活的函数，参数是任务记录（可以往里写进度）
+        
+    Returns:
+        Dict: 任务记录
+    """
+    task = {
+        "task_id": uuid.uuid4().hex,
+        "user_uuid": user_uuid,
+        "operation": operation,
+        "status": "pending",
+        "processed": 0,
+        "error": None,
+        "created_at": datetime.now().isoformat(),
+        "finished_at": None,
+    }
+    
+    with _tasks_lock:
+        _tasks[task["task_id"]] = task
+        if len(_tasks) > _TASKS_MAX:
+            for task_id in [k for k, t in _tasks.items() if t["finished_at"] is not None]:
+                if len(_tasks) <= _TASKS_MAX:
+                    break
+                del _tasks[task_id]
+    
+    def run() -> None:
+        task["status"] = "running"
+        try:
+            fn(task)
+            task["status"] = "completed"
+        except Exception as e:
+            logger.error(f"后台任务失败: task={task['task_id']}, operation={operation}, error={e}")
+            task["status"] = "failed"
+            task["error"] = str(e)
+        finally:
+            invalidate_storage_stats(user_dir)
+            task["finished_at"] = datetime.now().isoformat()
+    
+    _BG_POOL.submit(run)
+    return task
+
 router = APIRouter(prefix="/files", tags=["files"])
 
 
+@router.get("/tasks/{task_id}")
+async def get_task_status(request: Request, task_id: str) -> JSONResponse:
+    """查询后台文件任务的状态
+    
+    Args:
+        request: FastAPI请求对象，用于获取用户UUID
+        task_id: 提交任务时返回的任务ID
+        
+    Returns:
+        JSONResponse: 任务状态（pending/running/completed/failed）和已处理的文件数
+    """
+    user_uuid = getattr(request.state, 'user_uuid', None)
+    if not user_uuid:
+        logger.error("查询任务状态时无法获取用户UUID")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User authentication missing"
+        )
+    
+    task = _tasks.get(task_id)
+    # 别人的任务当作不存在
+    if task is None or task["user_uuid"] != user_uuid:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Task not found"
+        )
+    
+    return JSONResponse(status_code=status.HTTP_200_OK, content=dict(task))
+
+
 @router.delete("/{path:path}")
 async def delete_file_or_directory(
     request: Request,
     path: str,
     permanent: bool = Query(False, description="是否永久删除（不走回收站）"),
+    background: bool = Query(False, description="永久删除目录时放到后台执行，立即返回202和任务ID"),
 ) -> JSONResponse:
     """删除文件或目录（重构版，支持用户隔离存储）
     
@@ -36,6 +221,7 @@ async def delete_file_or_directory(
         request: FastAPI请求对象，用于获取用户UUID
         path: 要删除的文件/目录路径（相对于用户存储目录）
         permanent: 是否永久删除
+        background: 永久删除目录时是否后台执行
         
     Returns:
         JSONResponse: 操作结果
@@ -78,14 +264,33 @@ async def delete_file_or_directory(
         item_name = target_path.name
         item_path = str(target_path.relative_to(user_dir))
         
+        if permanent and is_dir and background:
+            # 大目录rmtree可能很久，交给后台线程池，客户端轮询任务状态
+            task = _submit_task(
+                user_uuid, "delete directory", user_dir,
+                lambda task: _delete_path(target_path, True),
+            )
+            logger.warning(f"后台永久删除: user={user_uuid}, path={item_path}, task={task['task_id']}")
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={
+                    "success": True,
+                    "task_id": task["task_id"],
+                    "path": item_path,
+                    "name": item_name,
+                    "is_directory": True,
+                    "operation": "delete directory",
+                    "permanent": True,
+                    "user_uuid": user_uuid,
+                    "message": "Directory deletion started"
+                }
+            )
+        
         if permanent:
-            # 永久删除
-            if is_dir:
-                shutil.rmtree(target_path)
-                operation = "permanently deleted directory"
-            else:
-                target_path.unlink()
-                operation = "permanently deleted file"
+            # 永久删除（rmtree在线程池里跑，不阻塞事件循环）
+            await asyncio.to_thread(_delete_path, target_path, is_dir)
+            operation = "permanently deleted directory" if is_dir else "permanently deleted file"
+            invalidate_storage_stats(user_dir)
             logger.warning(f"永久删除: user={user_uuid}, path={item_path}")
         else:
             # 移动到回收站
@@ -97,8 +302,9 @@ async def delete_file_or_directory(
             trash_path = user_trash_dir / trash_item_name
             
             # 移动文件/目录到回收站
-            # shutil.move接受Path对象，不需要转换为字符串
-            shutil.move(target_path, trash_path)
+            _replace_path(target_path, trash_path)
+            hash_index.move(target_path, trash_path)
+            invalidate_storage_stats(user_dir)
             
             operation = "moved to trash"
             logger.info(f"移动到回收站: user={user_uuid}, {item_path} -> {trash_item_name}")
@@ -195,10 +401,12 @@ async def rename_file_or_directory(
             )
         
         # 执行重命名（原子操作）
-        source.rename(new_path)
+        _replace_path(source, new_path)
+        hash_index.move(source, new_path)
         
         # 获取用户的存储目录，用于计算相对路径
         user_dir = get_user_storage_dir(user_uuid)
+        invalidate_storage_stats(user_dir)
         
         logger.info(f"重命名: user={user_uuid}, {source_path} -> {new_name}")
         
@@ -290,11 +498,12 @@ async def move_file_or_directory(
             )
         
         # 执行移动（原子操作）
-        # shutil.move接受Path对象，不需要转换为字符串
-        shutil.move(source, dest)
+        _replace_path(source, new_location)
+        hash_index.move(source, new_location)
         
         # 获取用户的存储目录，用于计算相对路径
         user_dir = get_user_storage_dir(user_uuid)
+        invalidate_storage_stats(user_dir)
         
         logger.info(f"移动: user={user_uuid}, {source_path} -> {dest_path}")
         
@@ -332,6 +541,7 @@ async def copy_file_or_directory(
     source_path: str = Query(..., description="原路径（相对于用户存储目录）"),
     dest_path: str = Query(..., description="目标目录路径（相对于用户存储目录）"),
     overwrite: bool = Query(False, description="是否覆盖已存在的文件"),
+    background: bool = Query(False, description="复制目录时放到后台执行，立即返回202和任务ID"),
 ) -> JSONResponse:
     """复制文件或目录（重构版，支持用户隔离存储）
     
@@ -343,6 +553,7 @@ async def copy_file_or_directory(
         source_path: 原路径
         dest_path: 目标目录路径
         overwrite: 是否覆盖
+        background: 复制目录时是否后台执行
         
     Returns:
         JSONResponse: 操作结果
@@ -385,23 +596,33 @@ async def copy_file_or_directory(
                 detail="A file or directory with the same name already exists in the destination. Use overwrite=true to replace it."
             )
         
-        # 执行复制
-        is_dir = source.is_dir()
-        if is_dir:
-            # 复制目录
-            if new_location.exists() and overwrite:
-                shutil.rmtree(new_location)
-            # shutil.copytree接受Path对象，不需要转换为字符串
-            shutil.copytree(source, new_location)
-        else:
-            # 复制文件
-            if new_location.exists() and overwrite:
-                new_location.unlink()
-            # shutil.copy2接受Path对象，不需要转换为字符串
-            shutil.copy2(source, new_location)
-        
         # 获取用户的存储目录，用于计算相对路径
         user_dir = get_user_storage_dir(user_uuid)
+        is_dir = source.is_dir()
+        
+        if is_dir and background:
+            # 大目录复制交给后台线程池，客户端轮询任务状态（processed是已复制的文件数）
+            task = _submit_task(
+                user_uuid, "copy directory", user_dir,
+                lambda task: _copy_path(source, new_location, True, task),
+            )
+            logger.info(f"后台复制: user={user_uuid}, {source_path} -> {dest_path}/{source.name}, task={task['task_id']}")
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={
+                    "success": True,
+                    "task_id": task["task_id"],
+                    "source_path": str(source.relative_to(user_dir)),
+                    "dest_path": str(new_location.relative_to(user_dir)),
+                    "is_directory": True,
+                    "user_uuid": user_uuid,
+                    "message": "Directory copy started"
+                }
+            )
+        
+        # 执行复制（在线程池里跑，不阻塞事件循环）
+        await asyncio.to_thread(_copy_path, source, new_location, is_dir)
+        invalidate_storage_stats(user_dir)
         
         logger.info(f"复制: user={user_uuid}, {source_path} -> {dest_path}/{source.name}")
         
@@ -467,26 +688,19 @@ async def create_directory(
         user_dir = get_user_storage_dir(user_uuid)
         
         # 确定目标目录
-        if path:
-            target_path = (user_dir / path).resolve()
-            # 安全检查：确保目标路径在用户目录内（使用is_relative_to，跨平台兼容）
-            try:
-                target_path.relative_to(user_dir.resolve())
-            except ValueError:
+        # 和其他接口一样走validate_user_path：用户目录的真实路径是缓存好的，
+        # 不用每次请求都对整条路径做一遍resolve()，顺带检查了路径是否存在
+        try:
+            target_path = validate_user_path(user_uuid, path)
+        except HTTPException as e:
+            if e.status_code == status.HTTP_404_NOT_FOUND:
                 raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Path traversal is not allowed"
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Parent directory not found"
                 )
-        else:
-            target_path = user_dir
-        
-        # 检查路径是否存在且是目录
-        if not target_path.exists():
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Parent directory not found"
-            )
+            raise
         
+        # 检查路径是否是目录
         if not target_path.is_dir():
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -525,6 +739,7 @@ async def create_directory(
         
         # 创建目录
         new_dir_path.mkdir(parents=False, exist_ok=False)  # 不创建父目录（父目录应已存在）
+        invalidate_storage_stats(user_dir)
         
         logger.info(f"创建目录成功: user={user_uuid}, {new_dir_path.relative_to(user_dir)}")
         
@@ -3,34 +3,106 @@
 提供文件搜索、ZIP打包下载等高级功能
 """
 
+import asyncio
+import hashlib
 import logging
+import os
 import re
-import io
+import stat as stat_lib
+import time
 import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
 
 from fastapi import APIRouter, HTTPException, status, Query, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 
 from config import get_user_storage_dir
 from api.utils.path_utils import validate_user_path
-from api.file_operations.browse import get_file_info
+from api.utils.responses import FastJSONResponse
+from api.utils.search_index import search_index
+from api.file_operations.browse import get_file_info, storage_version, _attach_hashes, _iso_time, _relative_path_str, _trash_dir_str
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/files", tags=["files"])
 
 
+# 搜索结果缓存：(搜索根目录, 搜索词, 是否区分大小写, 是否含回收站) -> (存储版本号, 计算时的monotonic时间, 计算时间戳ns, 排好序的全部匹配)
+# 翻页、重复搜索直接用缓存，只对缓存里的结果切片
+# 本服务内的写操作会让存储版本号变化，缓存随之失效；外部直接改文件的情况靠TTL兜底
+_SEARCH_CACHE_MAX = 256
+_SEARCH_CACHE_TTL = 30.0
+_search_cache: "OrderedDict[Tuple[str, str, bool, bool], Tuple[int, float, int, List[Tuple[str, str, bool]]]]" = OrderedDict()
+
+
+@lru_cache(maxsize=256)
+def _compile_search_pattern(q: str, case_sensitive: bool) -> "re.Pattern":
+    """把通配符搜索词编译成正则，按(搜索词, 是否区分大小写)缓存
+    
+    简单的通配符支持：* -> .*, ? -> .，其他字符按字面匹配，匹配文件名的任意位置
+    """
+    pattern = re.escape(q)
+    pattern = pattern.replace(r'\*', '.*').replace(r'\?', '.')
+    return re.compile(pattern, 0 if case_sensitive else re.IGNORECASE)
+
+
+def _search_page_info(
+    page_found: List[Tuple[str, str, bool]],
+    user_dir: Path,
+) -> List[Dict]:
+    """给当前页的搜索结果构造信息字典，文件会补上sha256
+    
+    索引里没有stat信息，只给这一页的条目stat；已经不存在的条目跳过
+    
+    Args:
+        page_found: 搜索结果中当前页的部分，(名称, 完整路径, 是否目录)
+        user_dir: 用户的存储目录
+        
+    Returns:
+        List[Dict]: 搜索结果条目
+    """
+    paged_matches = []
+    for name, item_path, is_dir in page_found:
+        try:
+            item_stat = os.stat(item_path)
+        except OSError as e:
+            logger.warning(f"获取文件信息失败，跳过: {item_path}, error={e}")
+            continue
+        if not is_dir:
+            info = get_file_info(item_path, user_dir, stat_result=item_stat)
+        else:
+            info = {
+                "name": name,
+                "path": _relative_path_str(item_path, user_dir),
+                "size": 0,
+                "sha256": None,
+                "mime_type": "inode/directory",
+                "encoding": None,
+                "created_at": _iso_time(item_stat.st_ctime),
+                "modified_at": _iso_time(item_stat.st_mtime),
+                "accessed_at": _iso_time(item_stat.st_atime),
+                "is_file": False,
+                "is_dir": True,
+            }
+        paged_matches.append(info)
+    _attach_hashes(paged_matches, user_dir)
+    return paged_matches
+
+
 @router.get("/search")
 async def search_files(
     request: Request,
     q: str = Query(..., description="搜索关键词，支持*和?通配符"),
     path: Optional[str] = Query(None, description="搜索的根目录（为空时搜索用户的整个存储目录）"),
     case_sensitive: bool = Query(False, description="是否区分大小写"),
+    include_trash: bool = Query(False, description="是否搜索回收站里的文件"),
     page: int = Query(1, ge=1, description="页码，从1开始"),
     limit: int = Query(100, ge=1, le=100, description="每页数量，最大100"),
-) -> JSONResponse:
+) -> FastJSONResponse:
     """搜索文件/目录（重构版，支持用户隔离存储）
     
     按名称搜索文件和目录，支持通配符
@@ -41,11 +113,12 @@ async def search_files(
         q: 搜索关键词
         path: 搜索根目录（相对于用户存储目录）
         case_sensitive: 是否区分大小写
+        include_trash: 是否包含回收站（默认不包含）
         page: 页码
         limit: 每页数量
         
     Returns:
-        JSONResponse: 搜索结果
+        FastJSONResponse: 搜索结果
     """
     try:
         # 从请求状态获取用户UUID
@@ -71,55 +144,53 @@ async def search_files(
         else:
             search_root = user_dir
         
-        # 将通配符模式转换为正则表达式
-        # 简单的通配符支持：* -> .*, ? -> .
-        pattern = re.escape(q)
-        pattern = pattern.replace(r'\*', '.*').replace(r'\?', '.')
-        
-        if not case_sensitive:
-            regex = re.compile(pattern, re.IGNORECASE)
+        # 同样的搜索、存储内容没变过（版本号一致且没超过TTL）就直接用缓存的结果
+        cache_key = (str(search_root), q, case_sensitive, include_trash)
+        version = storage_version(user_dir)
+        cached = _search_cache.get(cache_key)
+        if cached is not None and cached[0] == version and time.monotonic() - cached[1] < _SEARCH_CACHE_TTL:
+            _search_cache.move_to_end(cache_key)
+            _, _, computed_ns, found = cached
         else:
-            regex = re.compile(pattern)
-        
-        # 递归搜索
-        matches = []
-        for item in search_root.rglob("*"):
-            if regex.search(item.name):
-                try:
-                    if item.is_file():
-                        info = get_file_info(item, user_dir)
-                    else:
-                        info = {
-                            "name": item.name,
-                            "path": str(item.relative_to(user_dir)),
-                            "size": 0,
-                            "sha256": None,
-                            "mime_type": "inode/directory",
-                            "encoding": None,
-                            "created_at": datetime.fromtimestamp(item.stat().st_ctime).isoformat(),
-                            "modified_at": datetime.fromtimestamp(item.stat().st_mtime).isoformat(),
-                            "accessed_at": datetime.fromtimestamp(item.stat().st_atime).isoformat(),
-                            "is_file": False,
-                            "is_dir": True,
-                        }
-                    matches.append(info)
-                except Exception as e:
-                    logger.warning(f"获取文件信息失败，跳过: {item}, error={e}")
-                    continue
+            # 将通配符模式转换为正则表达式（按搜索词缓存编译结果）
+            regex = _compile_search_pattern(q, case_sensitive)
+            
+            # 查文件名trigram索引，只对候选做正则确认，不用遍历目录（索引过期时才在线程池里重建）
+            # 回收站默认不要，回收站可能很大
+            computed_at = time.monotonic()
+            computed_ns = time.time_ns()
+            skip_dir = None if include_trash else _trash_dir_str(user_dir)
+            found = await asyncio.to_thread(
+                search_index.search, user_dir, version, q, regex, search_root, skip_dir
+            )
+            
+            # 按名称排序（同名的再按路径排，保证翻页时顺序稳定）
+            found.sort(key=lambda x: (x[0].lower(), x[1]))
+            
+            _search_cache[cache_key] = (version, computed_at, computed_ns, found)
+            _search_cache.move_to_end(cache_key)
+            while len(_search_cache) > _SEARCH_CACHE_MAX:
+                _search_cache.popitem(last=False)
         
-        # 按名称排序
-        matches.sort(key=lambda x: x["name"].lower())
+        # ETag由这份结果（缓存项）和分页参数决定，结果没重新算过就不变
+        etag = '"' + hashlib.md5(
+            f"{cache_key}:{version}:{computed_ns}:{page}:{limit}".encode()
+        ).hexdigest() + '"'
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
         
         # 分页处理
-        total_matches = len(matches)
+        total_matches = len(found)
         total_pages = (total_matches + limit - 1) // limit  # 向上取整
         start_idx = (page - 1) * limit
         end_idx = start_idx + limit
-        paged_matches = matches[start_idx:end_idx]
+        
+        # 只给当前页构造结果（哈希也只给这一页算）
+        paged_matches = await asyncio.to_thread(_search_page_info, found[start_idx:end_idx], user_dir)
         
         logger.info(f"搜索: user={user_uuid}, q={q}, 找到 {total_matches} 个结果")
         
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=status.HTTP_200_OK,
             content={
                 "user_uuid": user_uuid,
@@ -133,7 +204,8 @@ async def search_files(
                 "has_next": page < total_pages,
                 "has_prev": page > 1,
                 "matches": paged_matches,
-            }
+            },
+            headers={"ETag": etag},
         )
         
     except HTTPException:
@@ -146,12 +218,244 @@ async def search_files(
         )
 
 
+# 流式打包时每次从源文件读多少
+ZIP_READ_CHUNK_SIZE = 1024 * 1024
+# DEFLATE压缩级别：1比默认的6快好几倍，文本类文件压缩率差得不多
+ZIP_COMPRESS_LEVEL = 1
+# 这些格式本身已经压缩过了，打包时用压缩级别0（DEFLATE的不压缩块，基本只是拷贝）
+# 不用STORED：流式输出时每个文件后面都有data descriptor，很多流式解压工具
+# （比如Java的ZipInputStream）不接受STORED+data descriptor的条目
+ZIP_PRECOMPRESSED_LEVEL = 0
+ZIP_PRECOMPRESSED_SUFFIXES = frozenset({
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.heic',
+    '.mp4', '.mkv', '.mov', '.webm', '.mp3', '.aac', '.flac', '.ogg',
+    '.zip', '.7z', '.rar', '.gz', '.bz2', '.xz', '.zst',
+    '.pdf', '.docx', '.xlsx', '.pptx',
+})
+
+
+# 不超过这个大小的文件由预读线程池整个读进内存，更大的还是边读边压缩
+ZIP_PREFETCH_MAX_SIZE = 4 * 1024 * 1024
+# 每个打包请求最多提前读多少个文件
+ZIP_PREFETCH_DEPTH = 16
+# 预读用的线程池，所有打包请求共用
+_ZIP_READ_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="zip-read")
+
+
+class _ZipChunkSink:
+    """给zipfile用的只进输出流：写进来的数据先攒着，由生成器取走发给客户端
+    
+    没有seek/tell，zipfile会自动按不可seek的流处理（每个文件后面写data descriptor），
+    所以整个ZIP不用在内存或磁盘上先完整生成一遍
+    """
+    
+    def __init__(self):
+        self._chunks: List[bytes] = []
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self) -> None:
+        pass
+    
+    def drain(self) -> bytes:
+        """取走目前攒下的数据"""
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _zip_members(validated_paths: List[Path], user_dir: Path) -> Iterator[Tuple[str, str, os.stat_result]]:
+    """列出要打包的文件：(文件路径, ZIP里的相对路径, stat结果)，目录递归展开
+    
+    目录用os.scandir手动递归，代替rglob("*") + is_file() + relative_to()，
+    类型判断用目录项自带的信息，每个文件只stat一次，路径全程用字符串，
+    ZIP里的相对路径每个选中项只算一次前缀，下面的文件直接切片拼接
+    符号链接目录不进入（和rglob行为一致）
+    """
+    for item_path in validated_paths:
+        try:
+            item_stat = os.stat(item_path)
+        except OSError as e:
+            logger.warning(f"打包时跳过无法访问的路径: {item_path}, error={e}")
+            continue
+        
+        # 计算在ZIP中的相对路径（相对于用户目录）
+        item_str = str(item_path)
+        item_arcname = _relative_path_str(item_str, user_dir)
+        if stat_lib.S_ISREG(item_stat.st_mode):
+            yield item_str, item_arcname, item_stat
+            continue
+        
+        # 目录下的文件：相对路径 = 目录的相对路径 + 去掉目录前缀的剩余部分，直接切字符串
+        # 打包整个用户目录时前缀是空的
+        item_prefix_len = len(item_str) + 1
+        arc_prefix = "" if item_arcname == "." else item_arcname + os.sep
+        stack = [item_str]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    for dir_entry in it:
+                        if dir_entry.is_file():
+                            entry_path = dir_entry.path
+                            yield entry_path, arc_prefix + entry_path[item_prefix_len:], dir_entry.stat()
+                        elif dir_entry.is_dir() and not dir_entry.is_symlink():
+                            stack.append(dir_entry.path)
+            except OSError as e:
+                logger.warning(f"打包时跳过无法访问的目录: {current}, error={e}")
+
+
+def _zip_info(arcname: str, st: os.stat_result) -> zipfile.ZipInfo:
+    """用已有的stat结果构造ZipInfo，和ZipInfo.from_file一样，只是不用再stat一次
+    
+    1980年以前的时间戳ZIP格式存不下，按1980-01-01处理（from_file会直接报错）
+    所有文件都用DEFLATE，已经压缩过的格式（图片、视频、压缩包等）用级别0不再压缩，其他的用低压缩级别
+    """
+    date_time = time.localtime(st.st_mtime)[:6]
+    if date_time[0] < 1980:
+        date_time = (1980, 1, 1, 0, 0, 0)
+    zinfo = zipfile.ZipInfo(arcname, date_time)
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    zinfo.file_size = st.st_size
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    # 传ZipInfo给ZipFile.open时不会套用ZipFile的compresslevel，只能设在ZipInfo上
+    if os.path.splitext(arcname)[1].lower() in ZIP_PRECOMPRESSED_SUFFIXES:
+        # 本身已经压缩过的格式，再压缩也小不了多少，只分块存
+        zinfo._compresslevel = ZIP_PRECOMPRESSED_LEVEL
+    else:
+        zinfo._compresslevel = ZIP_COMPRESS_LEVEL
+    return zinfo
+
+
+def _read_small_file(file_path: str) -> Optional[bytes]:
+    """把整个小文件读进内存（在预读线程池里跑），读不了返回None"""
+    try:
+        with open(file_path, "rb") as f:
+            return f.read()
+    except OSError as e:
+        logger.warning(f"打包时跳过无法读取的文件: {file_path}, error={e}")
+        return None
+
+
+def _prefetch_zip_members(
+    members: List[Tuple[str, str, os.stat_result]],
+) -> Iterator[Tuple[str, str, os.stat_result, Optional[bytes]]]:
+    """按原顺序产出要打包的文件，小文件提前在线程池里并发读好
+    
+    压缩只能一个文件一个文件地做，但读盘可以并发（SSD上队列深度越大越快），
+    这样读后面文件的同时前面的文件在压缩，磁盘IO和压缩CPU重叠起来
+    最多提前读ZIP_PREFETCH_DEPTH个文件，内存占用有上限
+    大文件不预读（content为None），还是由调用方分块流式读
+    读失败的小文件直接跳过
+    
+    Args:
+        members: _zip_members产出的 (文件路径, ZIP里的相对路径, stat结果)
+        
+    Yields:
+        Tuple[str, str, os.stat_result, Optional[bytes]]: (文件路径, ZIP里的相对路径, stat结果, 预读的内容)
+    """
+    pending = deque()
+    
+    def take_ready():
+        file_path, arcname, file_stat, future = pending.popleft()
+        if future is None:
+            return file_path, arcname, file_stat, None
+        content = future.result()
+        if content is None:
+            return None
+        return file_path, arcname, file_stat, content
+    
+    for file_path, arcname, file_stat in members:
+        if file_stat.st_size <= ZIP_PREFETCH_MAX_SIZE:
+            future = _ZIP_READ_POOL.submit(_read_small_file, file_path)
+        else:
+            future = None
+        pending.append((file_path, arcname, file_stat, future))
+        
+        while len(pending) > ZIP_PREFETCH_DEPTH:
+            item = take_ready()
+            if item is not None:
+                yield item
+    
+    while pending:
+        item = take_ready()
+        if item is not None:
+            yield item
+
+
+def _zip_etag(members: List[Tuple[str, str, os.stat_result]]) -> str:
+    """由要打包的文件列表算ZIP下载的弱ETag
+    
+    只看(ZIP里的相对路径, 修改时间, 大小)，不读文件内容，所以是弱ETag
+    
+    Args:
+        members: _zip_members产出的 (文件路径, ZIP里的相对路径, stat结果) 列表
+        
+    Returns:
+        str: 弱ETag（带W/前缀和引号）
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for _, arcname, file_stat in members:
+        digest.update(f"{arcname}\0{file_stat.st_mtime_ns}\0{file_stat.st_size}\n".encode("utf-8", "surrogateescape"))
+    return f'W/"{digest.hexdigest()}"'
+
+
+def _stream_zip(members: List[Tuple[str, str, os.stat_result]]) -> Iterator[bytes]:
+    """边压缩边输出ZIP数据（同步生成器，StreamingResponse会放到线程池里迭代）
+    
+    以前是整个ZIP先写进BytesIO再getvalue()一次发出去，内存里同时有两份完整归档，
+    大目录直接OOM，而且全部压缩完之前客户端一个字节都收不到
+    现在每读一块源文件就把压缩出来的数据发出去，内存占用只和块大小有关
+    
+    Args:
+        members: _zip_members产出的 (文件路径, ZIP里的相对路径, stat结果) 列表
+        
+    Yields:
+        bytes: ZIP数据块
+    """
+    sink = _ZipChunkSink()
+    # allowZip64默认就是True，这里写明：总大小或文件数超过ZIP格式上限时中央目录要用ZIP64
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file:
+        for file_path, arcname, file_stat, content in _prefetch_zip_members(members):
+            zinfo = _zip_info(arcname, file_stat)
+            
+            if content is not None:
+                # 小文件已经在线程池里读好了，直接压缩
+                with zip_file.open(zinfo, "w") as dest:
+                    dest.write(content)
+            else:
+                try:
+                    src = open(file_path, "rb")
+                except OSError as e:
+                    logger.warning(f"打包时跳过无法读取的文件: {file_path}, error={e}")
+                    continue
+                
+                # 不可seek的流没法事后回填大小，超过4GB的文件要提前声明用ZIP64
+                with src, zip_file.open(zinfo, "w", force_zip64=zinfo.file_size > zipfile.ZIP64_LIMIT) as dest:
+                    while chunk := src.read(ZIP_READ_CHUNK_SIZE):
+                        dest.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            
+            data = sink.drain()
+            if data:
+                yield data
+    
+    # 中央目录在关闭ZipFile时写出
+    data = sink.drain()
+    if data:
+        yield data
+
+
 @router.get("/download/zip")
 async def download_as_zip(
     request: Request,
     paths: str = Query(..., description="要打包的路径列表，用逗号分隔（相对于用户存储目录）"),
     filename: Optional[str] = Query(None, description="自定义ZIP文件名（不含.zip扩展名）"),
-) -> StreamingResponse:
+) -> Response:
     """打包下载多个文件/目录为ZIP（重构版，支持用户隔离存储）
     
     支持选择多个文件和目录进行打包下载
@@ -163,7 +467,7 @@ async def download_as_zip(
         filename: 自定义ZIP文件名
         
     Returns:
-        StreamingResponse: ZIP文件流
+        Response: ZIP文件流；If-None-Match命中时是304
     """
     try:
         # 从请求状态获取用户UUID
@@ -202,40 +506,29 @@ async def download_as_zip(
                 detail="所有指定的路径都不存在"
             )
         
-        # 创建内存ZIP文件
-        zip_buffer = io.BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for item_path in validated_paths:
-                # 计算在ZIP中的相对路径（相对于用户目录）
-                rel_path = item_path.relative_to(user_dir)
-                
-                if item_path.is_file():
-                    # 添加单个文件
-                    zip_file.write(str(item_path), str(rel_path))
-                else:
-                    # 递归添加目录
-                    for file_path in item_path.rglob("*"):
-                        if file_path.is_file():
-                            file_rel_path = file_path.relative_to(user_dir)
-                            zip_file.write(str(file_path), str(file_rel_path))
+        # 先列出所有要打包的文件（反正打包时也要遍历），用它们的路径、修改时间、大小算ETag
+        # 客户端带着同样的ETag来，说明内容没变，直接304，不用再压缩一遍
+        members = await asyncio.to_thread(lambda: list(_zip_members(validated_paths, user_dir)))
+        etag = _zip_etag(members)
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
         
         # 设置ZIP文件名
         zip_filename = filename or f"download_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         if not zip_filename.endswith('.zip'):
             zip_filename += '.zip'
         
-        # 将缓冲区指针重置到开头
-        zip_buffer.seek(0)
-        
         logger.info(f"打包下载: user={user_uuid}, {len(validated_paths)} 个路径 -> {zip_filename}")
         
+        # 边压缩边发送，总大小事先不知道，不带Content-Length（走chunked）
+        # _stream_zip是同步生成器，StreamingResponse会在线程池里迭代它，不阻塞事件循环
         return StreamingResponse(
-            iter([zip_buffer.getvalue()]),
+            _stream_zip(members),
             media_type="application/zip",
             headers={
                 "Content-Disposition": f"attachment; filename={zip_filename}",
-                "Content-Type": "application/zip"
+                "Content-Type": "application/zip",
+                "ETag": etag,
             }
         )
         
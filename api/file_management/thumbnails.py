@@ -6,17 +6,34 @@
 如果没有安装Pillow，缩略图功能将不可用
 """
 
-import logging
+import asyncio
 import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 import io
 
 from fastapi import APIRouter, HTTPException, status, Query, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, Response
 
-from config import get_user_storage_dir
+try:
+    from PIL import Image
+except ImportError:
+    # 没装Pillow时缩略图接口返回错误，其他功能不受影响
+    Image = None
+
+from config import THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, get_user_storage_dir
 from api.utils.path_utils import validate_user_path
+from api.utils.hash_index import hash_index
+from api.utils.name_index import name_index
+from api.file_operations.browse import _file_sha256
 
 logger = logging.getLogger(__name__)
 
@@ -26,12 +43,175 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/files/thumb", tags=["files-thumbnails"])
 
+# 文件ID就是小写十六进制的SHA256，长得不像的就不用去按哈希找了
+_SHA256_HEX_RE = re.compile(r"[0-9a-f]{64}")
+
+# 支持的图像扩展名
+_IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'})
+# 没有扩展名的文件读这么多字节来判断格式
+_SNIFF_BYTES = 32
+# 上面这些格式的文件头魔数（WebP是RIFF容器，单独判断）
+_IMAGE_MAGIC = (
+    b"\xff\xd8\xff",         # JPEG
+    b"\x89PNG\r\n\x1a\n",    # PNG
+    b"GIF87a", b"GIF89a",   # GIF
+    b"BM",                  # BMP
+    b"II*\x00", b"MM\x00*", # TIFF
+)
+
+# 缩略图内容只由(原图内容, 参数)决定，可以让浏览器缓存久一点
+THUMBNAIL_CACHE_CONTROL = "public, max-age=86400"
+# 写入新缓存后，距离上次清理超过这么久才检查一次总大小
+_SWEEP_INTERVAL = 60.0
+_last_sweep = 0.0
+_sweep_lock = threading.Lock()
+
+# 解码+缩放是CPU密集的，放到专门的线程池里跑，不阻塞事件循环（Pillow处理图像时会释放GIL）
+# 线程数和CPU核数一样，同时生成缩略图的请求再多也不会把机器压垮
+_THUMB_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="thumbnail")
+
+# 允许处理的最大像素数（约1亿像素），超过的图片Pillow会拒绝打开，防止解压炸弹
+THUMBNAIL_MAX_IMAGE_PIXELS = 100_000_000
+if Image is not None:
+    Image.MAX_IMAGE_PIXELS = THUMBNAIL_MAX_IMAGE_PIXELS
+
+# 缩略图输出格式：Pillow格式名 -> (MIME类型, 缓存文件扩展名)，按优先级排列
+# 同样的画质AVIF/WebP比JPEG小25%~50%，客户端的Accept里声明支持就优先用
+_THUMB_FORMATS = {
+    "AVIF": ("image/avif", "avif"),
+    "WEBP": ("image/webp", "webp"),
+    "JPEG": ("image/jpeg", "jpg"),
+}
+
+
+@lru_cache(maxsize=None)
+def _encoder_available(fmt: str) -> bool:
+    """当前装的Pillow能不能编码这种格式（结果缓存，只检查一次）
+
+    AVIF要Pillow 11.2以上，老版本Pillow装了pillow-avif-plugin也行
+    """
+    if Image is None:
+        return False
+    if fmt == "AVIF":
+        try:
+            import pillow_avif  # noqa: F401  导入时会把AVIF注册进Pillow
+        except ImportError:
+            pass
+    Image.init()
+    return fmt in Image.SAVE
+
+
+def _negotiate_format(accept: str) -> str:
+    """按Accept请求头挑缩略图格式：AVIF > WebP > JPEG（JPEG总是可用）"""
+    for fmt, (mime_type, _ext) in _THUMB_FORMATS.items():
+        if fmt == "JPEG" or (mime_type in accept and _encoder_available(fmt)):
+            return fmt
+    return "JPEG"
+
+
+def _thumbnail_cache_key(file_hash: str, width: int, height: int, quality: int, fmt: str = "JPEG") -> str:
+    """缩略图缓存的key，同时用作ETag"""
+    return hashlib.blake2b(f"{file_hash}:{width}:{height}:{quality}:{fmt}".encode(), digest_size=16).hexdigest()
+
+
+def _thumbnail_cache_path(key: str, fmt: str = "JPEG") -> Path:
+    """缓存文件路径：按key前两位分子目录，避免单个目录文件太多"""
+    return THUMBNAIL_CACHE_DIR / key[:2] / f"{key}.{_THUMB_FORMATS[fmt][1]}"
+
+
+def _store_thumbnail(cache_path: Path, data: bytes) -> None:
+    """把生成好的缩略图写进缓存
+
+    先写临时文件再os.replace，并发请求同一张图时不会读到写了一半的文件
+    写缓存失败不影响这次请求，记个日志就行
+    """
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"写入缩略图缓存失败: {cache_path}, error={e}")
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+
+
+def _sweep_thumbnail_cache() -> None:
+    """缓存总大小超过上限时，按最近访问时间(atime)从旧到新删，删到上限的八成为止
+
+    只在写入新缓存时顺便触发，而且距离上次检查不到_SWEEP_INTERVAL秒就跳过
+    （noatime挂载的话atime就是创建时间，相当于按创建先后淘汰，也能接受）
+    """
+    global _last_sweep
+    now = time.monotonic()
+    with _sweep_lock:
+        if now - _last_sweep < _SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+    
+    entries = []
+    total = 0
+    try:
+        with os.scandir(THUMBNAIL_CACHE_DIR) as buckets:
+            for bucket in buckets:
+                if not bucket.is_dir():
+                    continue
+                with os.scandir(bucket.path) as it:
+                    for dir_entry in it:
+                        if dir_entry.is_file():
+                            st = dir_entry.stat()
+                            entries.append((st.st_atime, st.st_size, dir_entry.path))
+                            total += st.st_size
+    except OSError as e:
+        logger.warning(f"扫描缩略图缓存失败: error={e}")
+        return
+    
+    if total <= THUMBNAIL_CACHE_MAX_BYTES:
+        return
+    
+    target = THUMBNAIL_CACHE_MAX_BYTES * 8 // 10
+    entries.sort()
+    removed = 0
+    for _atime, size, path_str in entries:
+        if total <= target:
+            break
+        try:
+            os.unlink(path_str)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    logger.info(f"清理缩略图缓存: 删除 {removed} 个文件, 剩余 {total} 字节")
+
+
+def _sniff_image_header(file_path: Path) -> bool:
+    """读文件开头几个字节，按魔数判断是不是支持的图像格式
+    
+    Args:
+        file_path: 文件路径
+        
+    Returns:
+        bool: 文件头是不是支持的图像格式（读不了也算不是）
+    """
+    try:
+        with open(file_path, "rb") as f:
+            header = f.read(_SNIFF_BYTES)
+    except OSError:
+        return False
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return True
+    return header.startswith(_IMAGE_MAGIC)
+
 
 def _is_image_file(file_path: Path) -> bool:
     """检查文件是否是支持的图像格式
     
     目前支持常见的图片格式，不过我感觉列表可能不够全
     比如有些相机用的RAW格式就没包含，不过那些格式用缩略图意义也不大？
+    有扩展名的只看扩展名；没有扩展名的读文件头按魔数判断
     
     Args:
         file_path: 文件路径
@@ -39,69 +219,66 @@ def _is_image_file(file_path: Path) -> bool:
     Returns:
         bool: 是否是支持的图像文件
     """
-    # 支持的图像扩展名
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp'}
-    # TODO: 也许应该通过文件魔数（magic number）来判断更准确？
-    # 不过扩展名判断简单快捷，先这样吧
-    return file_path.suffix.lower() in image_extensions
+    suffix = file_path.suffix
+    if not suffix:
+        return _sniff_image_header(file_path)
+    return suffix.lower() in _IMAGE_EXTENSIONS
 
 
 def _generate_thumbnail(
     image_path: Path,
     width: int = 200,
     height: int = 200,
-    quality: int = 85
+    quality: int = 85,
+    fmt: str = "JPEG",
 ) -> Optional[bytes]:
     """生成缩略图
     
-    注意：这里需要Pillow库，但我不想在顶部无条件导入
-    因为不是所有环境都安装了Pillow，所以动态导入
+    注意：这里需要Pillow库，模块导入时已经尝试导入过了
     如果Pillow没安装，就返回None
     
     Args:
         image_path: 图像文件路径
         width: 缩略图宽度
         height: 缩略图高度
-        quality: JPEG质量 (1-100)
+        quality: 编码质量 (1-100)
+        fmt: 输出格式（JPEG/WEBP/AVIF）
         
     Returns:
         Optional[bytes]: 缩略图字节数据，失败返回None
     """
+    if Image is None:
+        logger.warning("Pillow库未安装，无法生成缩略图")
+        # 其实这里可以给用户更明确的提示，或者提供安装指引
+        return None
+    
     try:
-        # 动态导入Pillow，避免在没有安装时导致导入错误
-        # 这里我有点犹豫，动态导入会影响性能吗？不过缩略图生成本来就不频繁，应该还好
-        from PIL import Image
-        
         # 打开图像
         with Image.open(image_path) as img:
+            # JPEG可以让libjpeg解码时直接按1/2、1/4、1/8缩小，大照片解码快好几倍
+            # 留两倍余量，后面再用LANCZOS缩到目标尺寸，画质不受影响；其他格式上这是空操作
+            img.draft('RGB', (width * 2, height * 2))
+            
             # 转换模式（如果是RGBA/P等）
             # 之前遇到过PNG带透明通道，直接转JPEG会丢失透明度，不过缩略图好像问题不大？
             if img.mode not in ('RGB', 'L'):
                 img = img.convert('RGB')
             
-            # 计算新的尺寸，保持宽高比
-            img_width, img_height = img.size
-            # 这里用min来保持宽高比，避免图片变形
-            ratio = min(width / img_width, height / img_height)
-            new_width = int(img_width * ratio)
-            new_height = int(img_height * ratio)
-            
-            # 调整大小
+            # 原地缩放到不超过width x height，保持宽高比（比原图小的不会放大）
             # LANCZOS据说质量最好，不过处理速度慢一点
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            img.thumbnail((width, height), Image.Resampling.LANCZOS)
             
             # 保存到内存
             thumbnail_buffer = io.BytesIO()
-            # 统一保存为JPEG格式，虽然可能不是最佳选择（比如PNG会更适合带透明通道的图片）
-            # 不过JPEG压缩率高，文件小，适合网络传输
-            img.save(thumbnail_buffer, format='JPEG', quality=quality)
+            # 默认保存为JPEG格式，客户端支持的话用WebP/AVIF，同样画质文件更小
+            if fmt == 'WEBP':
+                # method是编码速度和压缩率的折中（0最快，6最好），4是常用的默认
+                img.save(thumbnail_buffer, format='WEBP', quality=quality, method=4)
+            else:
+                img.save(thumbnail_buffer, format=fmt, quality=quality)
             
             return thumbnail_buffer.getvalue()
             
-    except ImportError:
-        logger.warning("Pillow库未安装，无法生成缩略图")
-        # 其实这里可以给用户更明确的提示，或者提供安装指引
-        return None
     except Exception as e:
         logger.error(f"生成缩略图失败: {image_path}, error={e}")
         # 这里应该记录更详细的错误信息，方便调试
@@ -115,22 +292,25 @@ async def get_thumbnail(
     file_id_or_path: str,
     width: int = Query(200, ge=50, le=800, description="缩略图宽度"),
     height: int = Query(200, ge=50, le=800, description="缩略图高度"),
-    quality: int = Query(85, ge=1, le=100, description="JPEG质量 (1-100)"),
-) -> StreamingResponse:
+    quality: int = Query(85, ge=1, le=100, description="编码质量 (1-100)"),
+) -> Response:
     """获取文件缩略图（重构版，支持用户隔离存储）
     
     为图像文件生成缩略图，支持调整尺寸和质量
     如果不是图像文件或Pillow未安装，返回错误
+    输出格式按Accept请求头协商：支持AVIF/WebP的客户端拿到更小的图，否则是JPEG
+    生成结果按(文件SHA256, 宽, 高, 质量, 格式)缓存在磁盘上，ETag就是缓存key，
+    客户端带If-None-Match且没变的话直接返回304
     
     Args:
         request: FastAPI请求对象，用于获取用户UUID
         file_id_or_path: 文件ID（SHA256）或相对路径（相对于用户存储目录）
         width: 缩略图宽度
         height: 缩略图高度
-        quality: JPEG质量
+        quality: 编码质量
         
     Returns:
-        StreamingResponse: 缩略图图像流
+        Response: 缩略图图像（命中缓存时是FileResponse）
     """
     try:
         # 从请求状态获取用户UUID
@@ -150,21 +330,16 @@ async def get_thumbnail(
         try:
             file_path = validate_user_path(user_uuid, file_id_or_path)
         except HTTPException:
-            # 如果不是有效路径，尝试作为文件ID查找
-            for potential_file in user_dir.rglob("*"):
-                if potential_file.is_file():
-                    # 计算文件哈希
-                    sha256_hash = hashlib.sha256()
-                    try:
-                        with open(potential_file, "rb") as f:
-                            for chunk in iter(lambda: f.read(4096), b""):
-                                sha256_hash.update(chunk)
-                        file_hash = sha256_hash.hexdigest()
-                        if file_hash == file_id_or_path:
-                            file_path = potential_file
-                            break
-                    except Exception:
-                        continue
+            is_file_id = _SHA256_HEX_RE.fullmatch(file_id_or_path) is not None
+            if not is_file_id:
+                # 不是哈希，当作裸文件名在用户目录里找（走内存索引，不用遍历目录）
+                file_path = name_index.lookup(user_dir, file_id_or_path)
+            else:
+                # 作为文件ID查找：只查哈希索引（索引会校验inode/mtime/大小，过期记录自动清掉）
+                # 以前索引没命中时会遍历整个用户目录、把没索引过的文件全部哈希一遍，
+                # 一次未命中就是O(用户总数据量)的读盘，现在直接当作找不到
+                # 索引在上传完成、复制文件、以及任何算过哈希的地方（列表/文件信息/目录摘要）都会写入
+                file_path = hash_index.lookup(file_id_or_path, user_dir)
         
         if not file_path or not file_path.exists():
             raise HTTPException(
@@ -185,8 +360,41 @@ async def get_thumbnail(
                 detail="File is not a supported image format. Supported formats: JPG, JPEG, PNG, GIF, BMP, TIFF, WEBP"
             )
         
-        # 生成缩略图
-        thumbnail_data = _generate_thumbnail(file_path, width, height, quality)
+        # 按文件内容哈希查缩略图缓存（哈希走内存缓存/哈希索引，文件没变过不用重新读）
+        file_hash = await asyncio.to_thread(_file_sha256, file_path, file_path.stat())
+        if file_hash is None:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to read image file"
+            )
+        
+        fmt = _negotiate_format(request.headers.get("accept", ""))
+        media_type = _THUMB_FORMATS[fmt][0]
+        cache_key = _thumbnail_cache_key(file_hash, width, height, quality, fmt)
+        etag = f'"{cache_key}"'
+        headers = {
+            "Cache-Control": THUMBNAIL_CACHE_CONTROL,
+            "ETag": etag,
+            "Vary": "Accept",  # 不同Accept会拿到不同格式，中间缓存要区分开
+            "X-User-UUID": user_uuid  # 添加用户UUID到响应头，方便调试
+        }
+        
+        if etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        
+        cache_path = _thumbnail_cache_path(cache_key, fmt)
+        try:
+            cache_stat = os.stat(cache_path)
+        except OSError:
+            cache_stat = None
+        if cache_stat is not None:
+            # 命中缓存，直接发文件（FileResponse自己会设置Content-Length/Last-Modified）
+            return FileResponse(cache_path, media_type=media_type, headers=headers, stat_result=cache_stat)
+        
+        # 生成缩略图（在缩略图线程池里跑）
+        thumbnail_data = await asyncio.get_running_loop().run_in_executor(
+            _THUMB_POOL, _generate_thumbnail, file_path, width, height, quality, fmt
+        )
         
         if thumbnail_data is None:
             raise HTTPException(
@@ -194,16 +402,15 @@ async def get_thumbnail(
                 detail="Failed to generate thumbnail. Pillow library may not be installed."
             )
         
-        logger.info(f"生成缩略图: user={user_uuid}, file={file_path.name}, size={width}x{height}")
+        await asyncio.to_thread(_store_thumbnail, cache_path, thumbnail_data)
+        asyncio.get_running_loop().run_in_executor(None, _sweep_thumbnail_cache)
+        
+        logger.info(f"生成缩略图: user={user_uuid}, file={file_path.name}, size={width}x{height}, format={fmt}")
         
-        return StreamingResponse(
-            iter([thumbnail_data]),
-            media_type="image/jpeg",
-            headers={
-                "Content-Type": "image/jpeg",
-                "Cache-Control": "public, max-age=3600",
-                "X-User-UUID": user_uuid  # 添加用户UUID到响应头，方便调试
-            }
+        return Response(
+            content=thumbnail_data,
+            media_type=media_type,
+            headers=headers,
         )
         
     except HTTPException:
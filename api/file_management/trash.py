@@ -4,18 +4,25 @@
 
 现在每个用户有自己的回收站目录：/storage/{user_uuid}/.trash/
 """
+import asyncio
+import heapq
 import logging
-import shutil
+import os
+import re
+import stat as stat_lib
 from pathlib import Path
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List, Optional, Set, Tuple
 
-from fastapi import APIRouter, HTTPException, status, Query, Request
+from fastapi import APIRouter, Body, HTTPException, status, Query, Request
 from fastapi.responses import JSONResponse
 
 from config import get_user_storage_dir
 from api.utils.path_utils import validate_user_path
-from api.file_operations.browse import get_file_info
+from api.utils.responses import FastJSONResponse
+from api.file_operations.browse import get_file_info, invalidate_storage_stats, _attach_hashes, _human_readable_size, _iso_time, _relative_path_str
+from api.utils.hash_index import hash_index
+from api.file_management.operations import _replace_path
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/files", tags=["files"])
@@ -42,6 +49,151 @@ def _ensure_trash_dir(user_uuid: str) -> Path:
     return user_trash_dir
 
 
+# 回收站项目名的时间戳前缀：YYYYMMDD_HHMMSS_原始名称
+_TRASH_TS_RE = re.compile(r"([0-9]{8}_[0-9]{6})_")
+
+# 批量移入回收站时同时进行的移动操作数量上限（避免占用太多文件描述符和线程）
+TRASH_BATCH_CONCURRENCY = 16
+
+
+def _unique_trash_name(user_trash_dir: Path, trash_item_name: str, taken: Set[str]) -> str:
+    """回收站里已有同名项目（或者本批次已经用了这个名字）时，在名字后面加序号
+    
+    Args:
+        user_trash_dir: 用户的回收站目录
+        trash_item_name: 想用的回收站项目名
+        taken: 本批次已经分配出去的名字
+        
+    Returns:
+        str: 不冲突的回收站项目名
+    """
+    candidate = trash_item_name
+    stem, suffix = os.path.splitext(trash_item_name)
+    n = 1
+    while candidate in taken or os.path.lexists(user_trash_dir / candidate):
+        candidate = f"{stem} ({n}){suffix}"
+        n += 1
+    taken.add(candidate)
+    return candidate
+
+
+def _move_item_to_trash(target_path: Path, trash_path: Path) -> bool:
+    """把一个项目移进回收站并同步哈希索引（同步版本，供线程池调用）
+    
+    Args:
+        target_path: 要移入回收站的路径
+        trash_path: 回收站中的目标路径
+        
+    Returns:
+        bool: 是否是目录（移动之前判断的，移动之后原路径就不存在了）
+    """
+    is_dir = target_path.is_dir()
+    _replace_path(target_path, trash_path)
+    hash_index.move(target_path, trash_path)
+    return is_dir
+
+
+@router.post("/trash/batch")
+async def move_to_trash_batch(
+    request: Request,
+    paths: List[str] = Body(..., description="要移入回收站的路径列表（相对于用户存储目录）"),
+) -> JSONResponse:
+    """批量将文件/目录移入回收站
+    
+    一次请求处理多个路径，省掉逐个调用的往返开销
+    先校验所有路径，再并发移动（最多TRASH_BATCH_CONCURRENCY个同时进行）
+    每个项目单独报告结果，某一项失败不影响其他项
+    回收站项目名总是带时间戳前缀，重名时自动加序号
+    
+    Args:
+        request: FastAPI请求对象，用于获取用户UUID
+        paths: 路径列表（JSON数组）
+        
+    Returns:
+        JSONResponse: 每个路径的处理结果
+    """
+    # 从请求状态获取用户UUID
+    user_uuid = getattr(request.state, 'user_uuid', None)
+    if not user_uuid:
+        logger.error("批量移入回收站时无法获取用户UUID")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User authentication missing"
+        )
+    
+    if not paths:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="至少需要一个路径"
+        )
+    
+    # 获取用户的存储目录和回收站目录
+    user_dir = get_user_storage_dir(user_uuid)
+    user_trash_dir = _ensure_trash_dir(user_uuid)
+    
+    # 先校验所有路径并分配回收站名称
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    taken_names: Set[str] = set()
+    results: List[Dict] = []
+    pending = []
+    for path in paths:
+        result = {"path": path, "success": False}
+        results.append(result)
+        try:
+            target_path = validate_user_path(user_uuid, path)
+        except HTTPException as e:
+            result["error"] = e.detail
+            continue
+        
+        if target_path == user_dir:
+            result["error"] = "Cannot move user root directory to trash"
+        elif target_path == user_trash_dir:
+            result["error"] = "Cannot move trash directory to itself"
+        elif not os.path.lexists(target_path):
+            result["error"] = "Path not found"
+        else:
+            trash_item_name = _unique_trash_name(user_trash_dir, f"{timestamp}_{target_path.name}", taken_names)
+            pending.append((result, target_path, trash_item_name))
+    
+    # 并发移动，用信号量限制同时进行的数量
+    semaphore = asyncio.Semaphore(TRASH_BATCH_CONCURRENCY)
+    
+    async def move_one(result: Dict, target_path: Path, trash_item_name: str) -> None:
+        trash_path = user_trash_dir / trash_item_name
+        async with semaphore:
+            try:
+                is_dir = await asyncio.to_thread(_move_item_to_trash, target_path, trash_path)
+            except Exception as e:
+                logger.error(f"批量移入回收站失败: {target_path}, error={e}")
+                result["error"] = str(e)
+                return
+        result.update({
+            "success": True,
+            "trash_name": trash_item_name,
+            "trash_path": str(trash_path.relative_to(user_dir)),
+            "is_directory": is_dir,
+        })
+    
+    await asyncio.gather(*(move_one(*item) for item in pending))
+    
+    succeeded = sum(1 for r in results if r["success"])
+    if succeeded:
+        invalidate_storage_stats(user_dir)
+    
+    logger.info(f"批量移入回收站: user={user_uuid}, 成功 {succeeded}/{len(results)}")
+    
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "success": succeeded == len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "results": results,
+            "user_uuid": user_uuid,
+        }
+    )
+
+
 @router.post("/trash/{path:path}")
 async def move_to_trash(
     request: Request,
@@ -110,8 +262,9 @@ async def move_to_trash(
                 detail="An item with the same name already exists in trash. Use rename=true to avoid conflict."
             )
         
-        # 移动到回收站
-        shutil.move(str(target_path), str(trash_path))
+        # 移动到回收站（同一文件系统上就是一次rename，和文件大小无关）
+        is_dir = await asyncio.to_thread(_move_item_to_trash, target_path, trash_path)
+        invalidate_storage_stats(user_dir)
         
         logger.info(f"移入回收站: user={user_uuid}, {path} -> {trash_item_name}")
         
@@ -123,7 +276,7 @@ async def move_to_trash(
                 "original_name": item_name,
                 "trash_name": trash_item_name,
                 "trash_path": str(trash_path.relative_to(user_dir)),
-                "is_directory": target_path.is_dir(),
+                "is_directory": is_dir,
                 "renamed": rename,
                 "user_uuid": user_uuid,
                 "message": "Item moved to trash successfully"
@@ -146,12 +299,97 @@ async def move_to_trash(
         )
 
 
+def _parse_trash_name(item_name: str) -> Tuple[Optional[str], str]:
+    """解析回收站项目名里的时间戳前缀（格式：YYYYMMDD_HHMMSS_原始名称）
+    
+    Args:
+        item_name: 回收站中的项目名
+        
+    Returns:
+        Tuple[Optional[str], str]: (时间戳，没有就是None, 原始名称)
+    """
+    # 正则已经保证了是数字，不用再strptime校验（strptime很慢，大回收站里每项都调一次）
+    m = _TRASH_TS_RE.match(item_name)
+    if m:
+        return m.group(1), item_name[m.end():]
+    return None, item_name
+
+
+def _collect_trash_items(user_trash_dir: Path) -> List[Tuple[str, str, str, os.stat_result]]:
+    """扫描回收站里的所有项目（同步版本，供线程池调用）
+    
+    只收集排序和统计要用的轻量信息，完整的项目信息等分页之后只给这一页构造
+    
+    Args:
+        user_trash_dir: 用户的回收站目录
+        
+    Returns:
+        List[Tuple[str, str, str, os.stat_result]]: (时间戳或空串, 项目名, 完整路径, stat结果) 列表，未排序
+    """
+    # 用scandir遍历，每个项目只stat一次，结果给类型判断、时间字段、get_file_info共用
+    trash_entries = []
+    with os.scandir(user_trash_dir) as it:
+        for item in it:
+            try:
+                timestamp, _ = _parse_trash_name(item.name)
+                trash_entries.append((timestamp or "", item.name, item.path, item.stat()))
+            except OSError as e:
+                logger.warning(f"处理回收站项目失败，跳过: {item.path}, error={e}")
+    
+    return trash_entries
+
+
+def _trash_page_info(page_entries: List[Tuple[str, str, str, os.stat_result]], user_dir: Path) -> List[Dict]:
+    """给回收站当前页的项目构造完整信息（同步版本，供线程池调用）
+    
+    Args:
+        page_entries: 当前页的 (时间戳或空串, 项目名, 完整路径, stat结果) 列表
+        user_dir: 用户的存储目录
+        
+    Returns:
+        List[Dict]: 回收站项目信息列表（不含哈希）
+    """
+    trash_items = []
+    for _, item_name, item_path, item_stat in page_entries:
+        try:
+            timestamp, original_name = _parse_trash_name(item_name)
+            
+            # 获取项目信息
+            if stat_lib.S_ISDIR(item_stat.st_mode):
+                info = {
+                    "name": item_name,
+                    "original_name": original_name,
+                    "path": _relative_path_str(item_path, user_dir),
+                    "size": 0,
+                    "sha256": None,
+                    "mime_type": "inode/directory",
+                    "encoding": None,
+                    "created_at": _iso_time(item_stat.st_ctime),
+                    "modified_at": _iso_time(item_stat.st_mtime),
+                    "is_file": False,
+                    "is_dir": True,
+                }
+            else:
+                info = get_file_info(item_path, user_dir, stat_result=item_stat)
+                info["original_name"] = original_name
+            
+            info["timestamp"] = timestamp
+            info["deleted_at"] = timestamp  # 向后兼容
+            
+            trash_items.append(info)
+        except Exception as e:
+            logger.warning(f"处理回收站项目失败，跳过: {item_path}, error={e}")
+            continue
+    
+    return trash_items
+
+
 @router.get("/trash")
 async def list_trash_contents(
     request: Request,
     page: int = Query(1, ge=1, description="页码，从1开始"),
     limit: int = Query(100, ge=1, le=100, description="每页数量，最大100"),
-) -> JSONResponse:
+) -> FastJSONResponse:
     """列出回收站中的文件/目录（重构版，支持用户隔离存储）
     
     显示回收站中的内容，包含原始路径信息和时间戳
@@ -163,7 +401,7 @@ async def list_trash_contents(
         limit: 每页数量
         
     Returns:
-        JSONResponse: 回收站内容
+        FastJSONResponse: 回收站内容
     """
     try:
         # 从请求状态获取用户UUID
@@ -179,84 +417,28 @@ async def list_trash_contents(
         user_dir = get_user_storage_dir(user_uuid)
         user_trash_dir = _ensure_trash_dir(user_uuid)
         
-        # 获取回收站中所有项目
-        trash_items = []
-        for item in user_trash_dir.iterdir():
-            try:
-                # 解析文件名以提取原始名称和时间戳
-                item_name = item.name
-                is_dir = item.is_dir()
-                
-                # 尝试解析时间戳前缀（格式：YYYYMMDD_HHMMSS_原始名称）
-                original_name = item_name
-                timestamp = None
-                
-                if "_" in item_name:
-                    parts = item_name.split("_", 2)
-                    if len(parts) >= 3 and len(parts[0]) == 8 and len(parts[1]) == 6:
-                        # 看起来像时间戳格式：YYYYMMDD_HHMMSS_原始名称
-                        try:
-                            datetime.strptime(f"{parts[0]}_{parts[1]}", "%Y%m%d_%H%M%S")
-                            timestamp = f"{parts[0]}_{parts[1]}"
-                            original_name = "_".join(parts[2:]) if len(parts) > 2 else item_name
-                        except ValueError:
-                            pass
-                
-                # 获取项目信息
-                if is_dir:
-                    info = {
-                        "name": item_name,
-                        "original_name": original_name,
-                        "path": str(item.relative_to(user_dir)),
-                        "size": 0,
-                        "sha256": None,
-                        "mime_type": "inode/directory",
-                        "encoding": None,
-                        "created_at": datetime.fromtimestamp(item.stat().st_ctime).isoformat(),
-                        "modified_at": datetime.fromtimestamp(item.stat().st_mtime).isoformat(),
-                        "is_file": False,
-                        "is_dir": True,
-                    }
-                else:
-                    info = get_file_info(item, user_dir)
-                    info["original_name"] = original_name
-                
-                info["timestamp"] = timestamp
-                info["deleted_at"] = timestamp  # 向后兼容
-                
-                trash_items.append(info)
-            except Exception as e:
-                logger.warning(f"处理回收站项目失败，跳过: {item}, error={e}")
-                continue
-        
-        # 按删除时间倒序排序（最近删除的在前）
-        trash_items.sort(key=lambda x: x.get("timestamp") or "", reverse=True)
+        # 扫描回收站（遍历+stat在线程池里跑，不阻塞事件循环）
+        trash_entries = await asyncio.to_thread(_collect_trash_items, user_trash_dir)
         
         # 分页处理
-        total_items = len(trash_items)
+        total_items = len(trash_entries)
         total_pages = (total_items + limit - 1) // limit
         start_idx = (page - 1) * limit
         end_idx = start_idx + limit
-        paged_items = trash_items[start_idx:end_idx]
         
-        # 计算回收站统计
-        total_size = sum(item.get("size", 0) for item in trash_items)
+        # 按删除时间倒序（最近删除的在前），只挑出前end_idx个，不给整个回收站排序
+        # nlargest和稳定排序一样，时间戳相同的保持扫描顺序
+        top_entries = heapq.nlargest(end_idx, trash_entries, key=lambda x: x[0])
+        paged_items = await asyncio.to_thread(_trash_page_info, top_entries[start_idx:], user_dir)
+        await asyncio.to_thread(_attach_hashes, paged_items, user_dir)
         
-        # 人类可读大小转换函数
-        def _human_readable_size(size_bytes: int) -> str:
-            if size_bytes == 0:
-                return "0 B"
-            
-            units = ["B", "KB", "MB", "GB", "TB"]
-            unit_index = 0
-            
-            while size_bytes >= 1024 and unit_index < len(units) - 1:
-                size_bytes /= 1024.0
-                unit_index += 1
-            
-            return f"{size_bytes:.2f} {units[unit_index]}"
+        # 计算回收站统计（目录大小按0算，和以前一样）
+        total_size = sum(
+            entry[3].st_size for entry in trash_entries
+            if not stat_lib.S_ISDIR(entry[3].st_mode)
+        )
         
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=status.HTTP_200_OK,
             content={
                 "user_uuid": user_uuid,
@@ -3,72 +3,577 @@
 提供文件信息查询、目录浏览、存储统计等API
 """
 
+import asyncio
 import logging
 import mimetypes
 import hashlib
+import math
+import mmap
 import shutil
 import os
+import stat as stat_lib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Literal, Optional, Tuple, Union
 from datetime import datetime
 
 from fastapi import APIRouter, HTTPException, status, Query, Request
-from fastapi.responses import JSONResponse
 
-from config import STORAGE_DIR, get_user_storage_dir
+from config import HASH_WORKERS, STORAGE_DIR, get_user_storage_dir
 from api.utils.path_utils import validate_user_path
+from api.utils.hash_index import hash_index
+from api.utils.responses import FastJSONResponse
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/files", tags=["files"])
 
+# 目录遍历/哈希都是阻塞操作，放到线程池里跑
+# 同时最多跑4个重的遍历，免得并发请求把磁盘打满
+_scan_sem = asyncio.Semaphore(4)
 
-def get_file_info(file_path: Path, user_dir: Path) -> Dict:
-    """获取文件的详细信息
+# 一个目录里的多个文件并发算哈希用的线程池（hashlib计算时会释放GIL）
+# 线程数见config.HASH_WORKERS，机械硬盘上可以调小避免磁头来回跳
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="file-hash")
+
+# 非递归目录列表的缓存：(目录路径, 是否含哈希, 是否ISO时间) -> (目录mtime_ns, 条目签名, 目录信息)
+# 目录里增删改名都会更新目录的mtime，对不上就重新扫
+# 文件原地改写（覆盖写、追加）不会更新目录的mtime，所以还要记下每个条目的(路径, inode, mtime_ns, size)，
+# 命中时逐个stat核对，有一个对不上也重新扫（和哈希索引判断记录过期的方式一样）
+# 递归列表不缓存：子目录里的变化不会反映到顶层目录的mtime上
+_LISTING_CACHE_MAX = 1024
+_listing_cache: "OrderedDict[Tuple[str, bool, bool], Tuple[int, List[Tuple[str, int, int, int]], Dict]]" = OrderedDict()
+# 刚修改过的目录先不缓存，防止粗粒度时间戳的文件系统上同一个时间单位内的修改看不出来
+_LISTING_CACHE_MIN_AGE_NS = 2 * 1_000_000_000
+
+
+# 存储统计（整棵树遍历）的缓存：用户目录 -> (计算时的monotonic时间, (总字节数, 文件数, 目录数))
+# 前端面板会反复轮询统计接口，短时间内直接返回上次的结果
+# 本服务内的上传、删除、移动、复制、重命名、建目录会主动让它失效，只有外部改动才需要等TTL过期
+_STATS_CACHE_TTL = 30.0
+_stats_cache: Dict[str, Tuple[float, Tuple[int, int, int]]] = {}
+
+# 每个用户存储内容的版本号，每次invalidate_storage_stats都会加一
+# 目录mtime只反映直接子项的变化，深层目录里的改动要靠这个版本号让搜索缓存这类结果失效
+_storage_versions: Dict[str, int] = {}
+
+
+def invalidate_storage_stats(user_dir: Path) -> None:
+    """用户目录里的内容变了，丢掉缓存的存储统计，并让版本号加一"""
+    key = str(user_dir)
+    _stats_cache.pop(key, None)
+    _storage_versions[key] = _storage_versions.get(key, 0) + 1
+
+
+def storage_version(user_dir: Path) -> int:
+    """用户存储内容的当前版本号（本服务内的写操作都会让它变化）"""
+    return _storage_versions.get(str(user_dir), 0)
+
+
+# 内存里的文件哈希缓存：(路径, inode, mtime_ns, 大小) -> sha256
+# 文件一改key就变了，不需要在增删改名时主动失效；旧key由LRU挤出去
+# 后面还有sqlite哈希索引兜底（进程重启后也有效），这一层省的是每个文件一次加锁的sqlite查询
+_SHA256_CACHE_MAX = 65536
+_sha256_cache: "OrderedDict[Tuple[str, int, int, int], str]" = OrderedDict()
+_sha256_cache_lock = threading.Lock()
+
+
+# 超过这个大小的文件不整个mmap，改用大缓冲区分块读，免得占用太多地址空间/RSS
+HASH_MMAP_MAX_SIZE = 256 * 1024 * 1024
+HASH_READ_BUFFER_SIZE = 4 * 1024 * 1024
+# hashlib.file_digest是Python 3.11加的
+_HAS_FILE_DIGEST = hasattr(hashlib, "file_digest")
+
+
+def _compute_sha256(file_path: Path, size: int) -> str:
+    """计算文件的SHA256
+    
+    小文件直接mmap整个喂给hashlib，一次update搞定，没有Python循环
+    （OpenSSL编译了SHA扩展指令的话hashlib会自动用上）
+    大文件用hashlib.file_digest（Python 3.11+），读+算的循环都在C里跑；
+    老版本Python退回到4MB缓冲区分块读
     
     Args:
         file_path: 文件路径
+        size: 文件大小（调用方已经stat过了）
+        
+    Returns:
+        str: 十六进制哈希
+    """
+    with open(file_path, "rb") as f:
+        if size > HASH_MMAP_MAX_SIZE and _HAS_FILE_DIGEST:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        
+        sha256_hash = hashlib.sha256()
+        if size == 0:
+            # 空文件没法mmap
+            pass
+        elif size <= HASH_MMAP_MAX_SIZE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                sha256_hash.update(mm)
+        else:
+            for chunk in iter(lambda: f.read(HASH_READ_BUFFER_SIZE), b""):
+                sha256_hash.update(chunk)
+    return sha256_hash.hexdigest()
+
+
+def _relative_path_str(path: Union[str, Path], user_dir: Path) -> str:
+    """path相对于user_dir的路径字符串，等价于str(path.relative_to(user_dir))
+    
+    列表里每个条目都要算一次，路径本来就在用户目录下，直接切掉前缀字符串，
+    不用走Path.relative_to的逐段比较再重新拼Path
+    path可以直接传字符串（比如scandir的DirEntry.path），不用先包装成Path
+    """
+    path_str = os.fspath(path)
+    prefix = str(user_dir) + os.sep
+    if path_str.startswith(prefix):
+        return path_str[len(prefix):]
+    return str(Path(path_str).relative_to(user_dir))
+
+
+@lru_cache(maxsize=1024)
+def _guess_type_by_suffix(suffix: str) -> Tuple[Optional[str], Optional[str]]:
+    """按扩展名缓存mimetypes.guess_type的结果 (MIME类型, 编码)
+    
+    列目录时每个文件都要猜一次，而一个目录里的扩展名就那么几种
+    suffix是文件名第一个点之后的全部后缀（比如".tar.gz"，编码要靠它猜出gzip），
+    和download.py里的_guess_mime_by_suffix一样，结果和对完整文件名调用guess_type一致
+    """
+    return mimetypes.guess_type("f" + suffix)
+
+
+def _guess_type(name: str) -> Tuple[Optional[str], Optional[str]]:
+    """猜测文件的 (MIME类型, 编码)"""
+    dot = name.find(".", 1)  # 跳过开头的点（.bashrc这种没有扩展名）
+    return _guess_type_by_suffix(name[dot:] if dot != -1 else "")
+
+
+@lru_cache(maxsize=4096)
+def _iso_seconds(seconds: int) -> str:
+    """整秒时间戳的ISO字符串（本地时间，不带小数部分），按秒缓存
+    
+    同一个目录里的文件时间戳往往集中在少数几个秒上，缓存命中率很高
+    """
+    return datetime.fromtimestamp(seconds).isoformat()
+
+
+def _iso_time(ts: float) -> str:
+    """等价于datetime.fromtimestamp(ts).isoformat()，但整秒部分走缓存
+    
+    微秒的取整方式和datetime.fromtimestamp一致（四舍六入五成双），
+    有微秒时追加".ffffff"，正好是整秒时不带小数，输出和原来逐字节相同
+    """
+    frac, seconds = math.modf(ts)
+    micros = round(frac * 1e6)
+    if micros >= 1000000:
+        seconds += 1
+        micros -= 1000000
+    elif micros < 0:
+        seconds -= 1
+        micros += 1000000
+    base = _iso_seconds(int(seconds))
+    return f"{base}.{micros:06d}" if micros else base
+
+
+def _time_fields(st: os.stat_result, iso_times: bool = True) -> Dict:
+    """生成时间字段（创建/修改/访问时间）
+    
+    iso_times=False时直接返回时间戳浮点数，客户端自己格式化就行
+    ISO格式走_iso_time，整秒部分有缓存
+    """
+    if not iso_times:
+        return {
+            "created_at": st.st_ctime,
+            "modified_at": st.st_mtime,
+            "accessed_at": st.st_atime,
+        }
+    return {
+        "created_at": _iso_time(st.st_ctime),
+        "modified_at": _iso_time(st.st_mtime),
+        "accessed_at": _iso_time(st.st_atime),
+    }
+
+
+def _cached_sha256(file_path: Path, stat: os.stat_result) -> Optional[str]:
+    """只查内存哈希缓存，没有返回None（不读文件、不查索引）"""
+    key = (str(file_path), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _sha256_cache_lock:
+        file_hash = _sha256_cache.get(key)
+        if file_hash is not None:
+            _sha256_cache.move_to_end(key)
+    return file_hash
+
+
+def _file_sha256(file_path: Path, stat: os.stat_result) -> Optional[str]:
+    """取文件的SHA256，算失败返回None
+    
+    依次查内存缓存、sqlite哈希索引，文件没变过就不用重新读
+    """
+    file_hash = _cached_sha256(file_path, stat)
+    if file_hash is not None:
+        return file_hash
+    
+    file_hash = hash_index.get(file_path, stat)
+    if file_hash is None:
+        try:
+            file_hash = _compute_sha256(file_path, stat.st_size)
+            hash_index.record(file_path, file_hash, stat)
+        except Exception as e:
+            logger.warning(f"计算文件哈希失败: {file_path}, error={e}")
+            return None
+    
+    key = (str(file_path), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _sha256_cache_lock:
+        _sha256_cache[key] = file_hash
+        _sha256_cache.move_to_end(key)
+        while len(_sha256_cache) > _SHA256_CACHE_MAX:
+            _sha256_cache.popitem(last=False)
+    return file_hash
+
+
+def get_file_info(
+    file_path: Union[str, Path],
+    user_dir: Path,
+    include_hash: bool = False,
+    stat_result: Optional[os.stat_result] = None,
+    iso_times: bool = True,
+) -> Dict:
+    """获取文件的详细信息
+    
+    哈希要把整个文件读一遍，列目录时每个文件都算太慢了，所以默认不算
+    需要的时候传include_hash=True
+    
+    Args:
+        file_path: 文件路径（str或Path都行，热路径上直接传字符串，省掉构造Path）
         user_dir: 用户的存储目录
+        include_hash: 是否计算SHA256（默认不算，sha256字段为None）
+        stat_result: 调用方已有的stat结果（比如scandir的DirEntry.stat()），传了就不再stat
+        iso_times: 时间字段是否格式化成ISO字符串（False时返回时间戳）
         
     Returns:
         Dict: 文件信息字典
     """
-    stat = file_path.stat()
+    path_str = os.fspath(file_path)
+    name = os.path.basename(path_str)
+    stat = stat_result if stat_result is not None else os.stat(path_str)
     
     # 计算文件哈希（SHA256）作为唯一ID
-    sha256_hash = hashlib.sha256()
-    try:
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(chunk)
-        file_hash = sha256_hash.hexdigest()
-    except Exception as e:
-        logger.warning(f"计算文件哈希失败: {file_path}, error={e}")
-        file_hash = None
+    file_hash = _file_sha256(path_str, stat) if include_hash else None
     
     # 猜测MIME类型
-    mime_type, encoding = mimetypes.guess_type(file_path.name)
+    mime_type, encoding = _guess_type(name)
     
     return {
-        "name": file_path.name,
-        "path": str(file_path.relative_to(user_dir)),
+        "name": name,
+        "path": _relative_path_str(path_str, user_dir),
         "size": stat.st_size,
         "sha256": file_hash,
         "mime_type": mime_type or "application/octet-stream",
         "encoding": encoding,
-        "created_at": datetime.fromtimestamp(stat.st_ctime).isoformat(),
-        "modified_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-        "accessed_at": datetime.fromtimestamp(stat.st_atime).isoformat(),
+        **_time_fields(stat, iso_times),
         "is_file": True,
         "is_dir": False,
     }
 
 
-def get_directory_info(dir_path: Path, user_dir: Path) -> Dict:
+def _dir_entry_info(
+    dir_path: Union[str, Path],
+    user_dir: Path,
+    dir_stat: os.stat_result,
+    iso_times: bool = True,
+) -> Dict:
+    """构造目录条目的信息字典（列表里的子目录项），dir_path可以直接传字符串"""
+    return {
+        "name": os.path.basename(os.fspath(dir_path)),
+        "path": _relative_path_str(dir_path, user_dir),
+        "size": 0,  # 目录大小需要递归计算，这里简单设为0
+        "sha256": None,
+        "mime_type": "inode/directory",
+        "encoding": None,
+        **_time_fields(dir_stat, iso_times),
+        "is_file": False,
+        "is_dir": True,
+    }
+
+
+def _trash_dir_str(user_dir: Path) -> str:
+    """用户回收站目录（/storage/{user_uuid}/.trash）的路径字符串，遍历时用来剪枝"""
+    return str(user_dir) + os.sep + ".trash"
+
+
+def _scan_tree_stats(root: Path, skip_dir: Optional[str] = None) -> Tuple[int, int, int]:
+    """一次遍历统计目录树的总大小、文件数、目录数（不含root自身）
+    
+    用os.scandir手动递归：类型判断不需要额外的系统调用，
+    只有文件需要stat一次拿大小。符号链接目录计数但不进入（和rglob行为一致）
+    
+    Args:
+        root: 要统计的根目录
+        skip_dir: 整个跳过（不计数也不进入）的目录路径，一般是回收站
+        
+    Returns:
+        Tuple[int, int, int]: (总字节数, 文件数, 目录数)
+    """
+    total_size = 0
+    total_files = 0
+    total_dirs = 0
+    
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for dir_entry in it:
+                    if dir_entry.is_file():
+                        total_size += dir_entry.stat().st_size
+                        total_files += 1
+                    elif dir_entry.is_dir():
+                        if dir_entry.path == skip_dir:
+                            continue
+                        total_dirs += 1
+                        if not dir_entry.is_symlink():
+                            stack.append(dir_entry.path)
+        except OSError as e:
+            logger.warning(f"统计目录时跳过无法访问的目录: {current}, error={e}")
+    
+    return total_size, total_files, total_dirs
+
+
+def _scan_tree_files(root: Path, skip_dir: Optional[str] = None) -> List[Tuple[str, os.stat_result]]:
+    """遍历目录树，收集所有文件的(路径, stat结果)
+    
+    和_scan_tree_stats一样用os.scandir手动递归，代替rglob("*") + is_file() + stat()
+    （那样每个条目至少两次stat）。符号链接目录不进入（和rglob行为一致）
+    路径直接用DirEntry.path字符串，大目录树不用给每个文件都构造一个Path
+    
+    Args:
+        root: 要遍历的根目录
+        skip_dir: 不进入的目录路径，一般是回收站
+        
+    Returns:
+        List[Tuple[str, os.stat_result]]: (文件路径字符串, stat结果) 列表，未排序
+    """
+    files = []
+    
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for dir_entry in it:
+                    if dir_entry.is_file():
+                        files.append((dir_entry.path, dir_entry.stat()))
+                    elif dir_entry.is_dir() and not dir_entry.is_symlink() and dir_entry.path != skip_dir:
+                        stack.append(dir_entry.path)
+        except OSError as e:
+            logger.warning(f"遍历目录时跳过无法访问的目录: {current}, error={e}")
+    
+    return files
+
+
+def _entry_signatures(entry_stats: List[Tuple[str, os.stat_result]]) -> List[Tuple[str, int, int, int]]:
+    """把目录条目的stat结果转成缓存校验用的(路径, inode, mtime_ns, size)"""
+    return [(path_str, st.st_ino, st.st_mtime_ns, st.st_size) for path_str, st in entry_stats]
+
+
+def _entries_unchanged(signatures: List[Tuple[str, int, int, int]]) -> bool:
+    """逐个stat核对目录条目，全都没变过才返回True"""
+    for path_str, inode, mtime_ns, size in signatures:
+        try:
+            st = os.stat(path_str)
+        except OSError:
+            return False
+        if (st.st_ino, st.st_mtime_ns, st.st_size) != (inode, mtime_ns, size):
+            return False
+    return True
+
+
+async def _get_directory_info_cached(
+    dir_path: Path,
+    user_dir: Path,
+    include_hash: bool = False,
+    iso_times: bool = True,
+    dir_stat: Optional[os.stat_result] = None,
+) -> Dict:
+    """带mtime校验缓存的get_directory_info（在线程池里遍历）
+    
+    返回的字典是缓存里共享的，调用方修改前要先复制一份
+    调用方已经stat过目录的话把结果传进来（dir_stat），不用再stat一次
+    命中缓存时还要核对每个条目的stat（文件原地改写不会更新目录mtime），核对在线程池里做
+    """
+    key = (str(dir_path), include_hash, iso_times)
+    mtime_ns = (dir_stat if dir_stat is not None else os.stat(dir_path)).st_mtime_ns
+    
+    cached = _listing_cache.get(key)
+    if cached is not None and cached[0] == mtime_ns:
+        if not cached[1] or await asyncio.to_thread(_entries_unchanged, cached[1]):
+            _listing_cache.move_to_end(key)
+            return cached[2]
+        _listing_cache.pop(key, None)
+    
+    # mtime在扫描之前取，扫描期间有变化的话下次请求就会发现mtime对不上
+    entry_stats: List[Tuple[str, os.stat_result]] = []
+    async with _scan_sem:
+        dir_info = await asyncio.to_thread(
+            get_directory_info, dir_path, user_dir, include_hash, iso_times, entry_stats
+        )
+    signatures = _entry_signatures(entry_stats)
+    
+    # 目录和条目里最近一次修改离现在太近的都先不缓存（粗粒度时间戳下同一时间单位内的再次修改看不出来）
+    newest_ns = max([mtime_ns] + [sig[2] for sig in signatures])
+    if time.time_ns() - newest_ns >= _LISTING_CACHE_MIN_AGE_NS:
+        _listing_cache[key] = (mtime_ns, signatures, dir_info)
+        _listing_cache.move_to_end(key)
+        while len(_listing_cache) > _LISTING_CACHE_MAX:
+            _listing_cache.popitem(last=False)
+    
+    return dir_info
+
+
+def _batch_file_info(
+    files: List[Tuple[Union[str, Path], os.stat_result]],
+    user_dir: Path,
+    include_hash: bool = False,
+    iso_times: bool = True,
+) -> List[Dict]:
+    """批量获取一组文件的信息
+    
+    要算哈希时把整批文件丢给线程池并发读+算（hashlib计算时会释放GIL），
+    总耗时接近最慢的那个文件而不是全部相加；不算哈希就直接串行构造
+    
+    Args:
+        files: (文件路径, stat结果) 列表
+        user_dir: 用户的存储目录
+        include_hash: 是否计算文件哈希
+        iso_times: 时间字段是否格式化成ISO字符串
+        
+    Returns:
+        List[Dict]: 文件信息列表，顺序和files一致
+    """
+    if include_hash and len(files) > 1:
+        return list(_hash_executor.map(
+            lambda f: get_file_info(f[0], user_dir, True, f[1], iso_times), files
+        ))
+    return [get_file_info(f, user_dir, include_hash, st, iso_times) for f, st in files]
+
+
+def _attach_hashes(entries: List[Dict], user_dir: Path) -> None:
+    """给（已经分好页的）条目补上文件的sha256，原地修改
+    
+    搜索、回收站这类接口先不带哈希收集全部结果，排序分页之后再只给这一页算哈希，
+    而不是每个匹配的文件都读一遍
+    
+    Args:
+        entries: get_file_info生成的条目（目录条目会跳过）
+        user_dir: 用户的存储目录，条目里的path相对于它
+    """
+    targets = [e for e in entries if e.get("is_file") and e.get("sha256") is None]
+    
+    def fill(entry: Dict) -> None:
+        file_path = user_dir / entry["path"]
+        try:
+            stat = file_path.stat()
+        except OSError as e:
+            logger.warning(f"获取文件状态失败: {file_path}, error={e}")
+            return
+        entry["sha256"] = _file_sha256(file_path, stat)
+    
+    if len(targets) > 1:
+        list(_hash_executor.map(fill, targets))
+    else:
+        for entry in targets:
+            fill(entry)
+
+
+def directory_digest(dir_path: Path, skip_dir: Optional[str] = None) -> Tuple[str, int, int]:
+    """计算整个目录树的内容摘要（同步版本，供线程池调用）
+    
+    每个文件的SHA256并发算（走哈希缓存，没变过的文件不会重读），
+    再按相对路径排序，把"相对路径\0文件哈希\n"依次喂给一个SHA256得到目录摘要
+    内容和结构完全相同的两个目录摘要相同，和目录本身放在哪无关
+    
+    Args:
+        dir_path: 要计算的目录
+        skip_dir: 不计入摘要的目录（一般是回收站），和其他遍历一样整棵子树跳过
+        
+    Returns:
+        Tuple[str, int, int]: (十六进制摘要, 文件数, 总字节数)
+    """
+    files = _scan_tree_files(dir_path, skip_dir)
+    files.sort(key=lambda f: f[0])
+    
+    file_hashes = list(_hash_executor.map(lambda f: _file_sha256(f[0], f[1]), files))
+    
+    digest = hashlib.sha256()
+    total_size = 0
+    for (file_path, file_stat), file_hash in zip(files, file_hashes):
+        if file_hash is None:
+            raise OSError(f"无法读取文件: {file_path}")
+        digest.update(_relative_path_str(file_path, dir_path).encode("utf-8", "surrogateescape"))
+        digest.update(b"\0")
+        digest.update(file_hash.encode("ascii"))
+        digest.update(b"\n")
+        total_size += file_stat.st_size
+    
+    return digest.hexdigest(), len(files), total_size
+
+
+def _list_files_recursive(
+    target_path: Path,
+    user_dir: Path,
+    include_hash: bool = False,
+    iso_times: bool = True,
+    start_idx: int = 0,
+    end_idx: Optional[int] = None,
+    include_trash: bool = False,
+) -> Tuple[List[Dict], int, int]:
+    """递归列出目录下的所有文件（同步版本，供线程池调用）
+    
+    遍历时只收集(路径, stat)，排序后只给[start_idx:end_idx]这一页生成文件信息
+    以前是给整棵树每个文件都建字典（开了include_hash还要每个都算哈希）再分页，
+    文件一多内存和耗时都是O(总文件数)，而实际只返回一页
+    
+    Args:
+        target_path: 要列出的目录
+        user_dir: 用户的存储目录
+        include_hash: 是否计算文件哈希
+        iso_times: 时间字段是否格式化成ISO字符串
+        start_idx: 分页起始下标
+        end_idx: 分页结束下标（不含），None表示到最后
+        include_trash: 是否包含回收站里的文件（默认在遍历时直接跳过整个回收站）
+        
+    Returns:
+        Tuple[List[Dict], int, int]: (按路径排序后这一页的文件信息, 文件总数, 总字节数)
+    """
+    files = _scan_tree_files(target_path, None if include_trash else _trash_dir_str(user_dir))
+    total_size = sum(st.st_size for _, st in files)
+    
+    # 按路径排序（都在user_dir下，按完整路径排和按相对路径排顺序一样）
+    files.sort(key=lambda f: f[0])
+    
+    page_files = _batch_file_info(files[start_idx:end_idx], user_dir, include_hash, iso_times)
+    
+    return page_files, len(files), total_size
+
+
+def get_directory_info(
+    dir_path: Path,
+    user_dir: Path,
+    include_hash: bool = False,
+    iso_times: bool = True,
+    entry_stats: Optional[List[Tuple[str, os.stat_result]]] = None,
+) -> Dict:
     """获取目录信息
     
     Args:
         dir_path: 目录路径
         user_dir: 用户的存储目录
+        include_hash: 是否计算目录下每个文件的SHA256
+        iso_times: 时间字段是否格式化成ISO字符串（False时返回时间戳）
+        entry_stats: 传了列表的话，把每个条目的(路径, stat结果)追加进去（列表缓存校验用）
         
     Returns:
         Dict: 目录信息字典
@@ -80,27 +585,25 @@ def get_directory_info(dir_path: Path, user_dir: Path) -> Dict:
         file_count = 0
         dir_count = 0
         
-        for entry in dir_path.iterdir():
-            if entry.is_file():
-                entries.append(get_file_info(entry, user_dir))
-                total_size += entry.stat().st_size
-                file_count += 1
-            elif entry.is_dir():
-                dir_stat = entry.stat()
-                entries.append({
-                    "name": entry.name,
-                    "path": str(entry.relative_to(user_dir)),
-                    "size": 0,  # 目录大小需要递归计算，这里简单设为0
-                    "sha256": None,
-                    "mime_type": "inode/directory",
-                    "encoding": None,
-                    "created_at": datetime.fromtimestamp(dir_stat.st_ctime).isoformat(),
-                    "modified_at": datetime.fromtimestamp(dir_stat.st_mtime).isoformat(),
-                    "accessed_at": datetime.fromtimestamp(dir_stat.st_atime).isoformat(),
-                    "is_file": False,
-                    "is_dir": True,
-                })
-                dir_count += 1
+        # 用scandir遍历，类型判断用目录项自带的信息，stat结果DirEntry会缓存
+        # 每个条目只需要一次stat（以前is_file/stat/get_file_info里的stat要好几次）
+        files = []
+        with os.scandir(dir_path) as it:
+            for dir_entry in it:
+                if dir_entry.is_file():
+                    entry_stat = dir_entry.stat()
+                    files.append((dir_entry.path, entry_stat))
+                    total_size += entry_stat.st_size
+                    file_count += 1
+                elif dir_entry.is_dir():
+                    entries.append(_dir_entry_info(dir_entry.path, user_dir, dir_entry.stat(), iso_times))
+                    dir_count += 1
+                else:
+                    continue
+                if entry_stats is not None:
+                    entry_stats.append((dir_entry.path, dir_entry.stat()))
+        
+        entries.extend(_batch_file_info(files, user_dir, include_hash, iso_times))
         
         # 按名称排序
         entries.sort(key=lambda x: (not x["is_dir"], x["name"].lower()))
@@ -114,8 +617,8 @@ def get_directory_info(dir_path: Path, user_dir: Path) -> Dict:
             "file_count": file_count,
             "dir_count": dir_count,
             "total_size": total_size,
-            "created_at": datetime.fromtimestamp(dir_stat.st_ctime).isoformat(),
-            "modified_at": datetime.fromtimestamp(dir_stat.st_mtime).isoformat(),
+            "created_at": _iso_time(dir_stat.st_ctime) if iso_times else dir_stat.st_ctime,
+            "modified_at": _iso_time(dir_stat.st_mtime) if iso_times else dir_stat.st_mtime,
             "entries": entries,
         }
         
@@ -138,9 +641,12 @@ async def list_files(
     request: Request,
     path: Optional[str] = Query(None, description="相对路径，为空时列出用户根目录"),
     recursive: bool = Query(False, description="是否递归列出所有文件"),
+    include_trash: bool = Query(False, description="递归列出时是否包含回收站里的文件"),
+    include_hash: bool = Query(False, description="是否计算文件SHA256（要读整个文件，较慢，默认关闭）"),
+    time_format: Literal["iso", "epoch"] = Query("iso", alias="format", description="时间字段格式：iso字符串或epoch时间戳（更快）"),
     page: int = Query(1, ge=1, description="页码，从1开始"),
     limit: int = Query(100, ge=1, le=100, description="每页数量，最大100"),
-) -> JSONResponse:
+) -> FastJSONResponse:
     """列出文件/目录（重构版，支持用户隔离存储）
     
     列出指定目录下的文件和子目录
@@ -151,11 +657,14 @@ async def list_files(
         request: FastAPI请求对象，用于获取用户UUID
         path: 相对路径（相对于用户存储目录）
         recursive: 是否递归列出
+        include_trash: 递归列出时是否包含回收站（默认不包含）
+        include_hash: 是否计算文件哈希
+        time_format: 时间字段格式（iso/epoch）
         page: 页码，从1开始
         limit: 每页数量，最大100
         
     Returns:
-        JSONResponse: 目录信息
+        FastJSONResponse: 目录信息
     """
     try:
         # 从请求状态获取用户UUID
@@ -169,6 +678,7 @@ async def list_files(
         
         # 获取用户的存储目录
         user_dir = get_user_storage_dir(user_uuid)
+        iso_times = time_format == "iso"
         
         # 验证路径（相对于用户存储目录）
         if path:
@@ -176,11 +686,12 @@ async def list_files(
         else:
             target_path = user_dir
         
-        # 检查是否是目录
-        if not target_path.is_dir():
-            # 如果是文件，返回文件信息
-            file_info = get_file_info(target_path, user_dir)
-            return JSONResponse(
+        # 检查是否是目录（stat一次，结果接着给文件信息/目录缓存校验用）
+        target_stat = os.stat(target_path)
+        if not stat_lib.S_ISDIR(target_stat.st_mode):
+            # 如果是文件，返回文件信息（要算哈希，放到线程池里跑，不阻塞事件循环）
+            file_info = await asyncio.to_thread(get_file_info, target_path, user_dir, include_hash, target_stat, iso_times)
+            return FastJSONResponse(
                 status_code=status.HTTP_200_OK,
                 content={
                     "is_file": True,
@@ -192,28 +703,18 @@ async def list_files(
             )
         
         if recursive:
-            # 递归列出所有文件（简化版本）
-            all_files = []
-            total_size = 0
-            file_count = 0
-            
-            for file_path in target_path.rglob("*"):
-                if file_path.is_file():
-                    file_info = get_file_info(file_path, user_dir)
-                    all_files.append(file_info)
-                    total_size += file_path.stat().st_size
-                    file_count += 1
-            
-            # 按路径排序
-            all_files.sort(key=lambda x: x["path"])
+            # 递归列出所有文件（简化版本），在线程池里遍历，只给当前页生成文件信息
+            start_idx = (page - 1) * limit
+            end_idx = start_idx + limit
+            async with _scan_sem:
+                paged_files, file_count, total_size = await asyncio.to_thread(
+                    _list_files_recursive, target_path, user_dir, include_hash, iso_times, start_idx, end_idx, include_trash
+                )
             
             # 分页处理
             total_pages = (file_count + limit - 1) // limit  # 向上取整
-            start_idx = (page - 1) * limit
-            end_idx = start_idx + limit
-            paged_files = all_files[start_idx:end_idx]
             
-            return JSONResponse(
+            return FastJSONResponse(
                 status_code=status.HTTP_200_OK,
                 content={
                     "path": str(target_path.relative_to(user_dir)),
@@ -230,8 +731,9 @@ async def list_files(
                 }
             )
         else:
-            # 非递归，列出目录内容
-            dir_info = get_directory_info(target_path, user_dir)
+            # 非递归，列出目录内容（目录没变过就直接用缓存）
+            # 缓存里的字典是共享的，复制一份再往里加分页信息
+            dir_info = dict(await _get_directory_info_cached(target_path, user_dir, include_hash, iso_times, target_stat))
             
             # 分页处理（对目录条目进行分页）
             all_entries = dir_info.get("entries", [])
@@ -252,7 +754,7 @@ async def list_files(
                 "user_uuid": user_uuid,
             })
             
-            return JSONResponse(
+            return FastJSONResponse(
                 status_code=status.HTTP_200_OK,
                 content=dir_info
             )
@@ -272,7 +774,7 @@ async def get_file_info_by_path(
     request: Request,
     file_path: str,
     include_content_hash: bool = Query(False, description="是否包含文件内容哈希（计算较慢，默认关闭）"),
-) -> JSONResponse:
+) -> FastJSONResponse:
     """获取文件详细信息（仅使用路径，不支持哈希查找）
     
     通过相对路径获取文件详细信息
@@ -283,7 +785,7 @@ async def get_file_info_by_path(
         include_content_hash: 是否计算文件哈希
         
     Returns:
-        JSONResponse: 文件详细信息
+        FastJSONResponse: 文件详细信息
     """
     try:
         # 从请求状态获取用户UUID
@@ -298,13 +800,16 @@ async def get_file_info_by_path(
         # 验证路径并获取文件
         target_path = validate_user_path(user_uuid, file_path)
         
-        if not target_path.exists():
+        # 只stat一次：存在性、是否文件、后面的文件信息都用这一个结果
+        try:
+            file_stat = os.stat(target_path)
+        except FileNotFoundError:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="File not found"
             )
         
-        if not target_path.is_file():
+        if not stat_lib.S_ISREG(file_stat.st_mode):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Path is not a file"
@@ -313,21 +818,26 @@ async def get_file_info_by_path(
         # 获取用户的存储目录
         user_dir = get_user_storage_dir(user_uuid)
         
-        # 获取文件信息
-        file_info = get_file_info(target_path, user_dir)
-        
-        # 如果不要求计算哈希，移除哈希字段以加快响应
-        if not include_content_hash:
-            file_info["sha256"] = None
+        # 获取文件信息（可能要算哈希，放到线程池里跑，不阻塞事件循环）
+        # 不要求哈希时直接不算，以前是算完再丢掉
+        headers = None
+        if include_content_hash:
+            # 方便观察哈希缓存效果：内存缓存里已经有这个文件版本的哈希就是hit
+            cache_hit = _cached_sha256(target_path, file_stat) is not None
+            headers = {"X-Cache": "hit" if cache_hit else "miss"}
+        file_info = await asyncio.to_thread(
+            get_file_info, target_path, user_dir, include_content_hash, file_stat
+        )
         
         # 添加用户UUID
         file_info["user_uuid"] = user_uuid
         
         logger.info(f"获取文件信息: user={user_uuid}, file={target_path.name}, size={file_info['size']}")
         
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=status.HTTP_200_OK,
-            content=file_info
+            content=file_info,
+            headers=headers,
         )
         
     except HTTPException:
@@ -340,8 +850,72 @@ async def get_file_info_by_path(
         )
 
 
+@router.get("/digest")
+async def get_directory_digest(
+    request: Request,
+    path: Optional[str] = Query(None, description="目录相对路径，为空时计算用户根目录"),
+) -> FastJSONResponse:
+    """计算目录树的内容摘要
+    
+    可以用来快速判断两个目录（或同一目录的两个时刻）内容是否完全一致
+    
+    Args:
+        request: FastAPI请求对象，用于获取用户UUID
+        path: 目录相对路径（相对于用户存储目录）
+        
+    Returns:
+        FastJSONResponse: 目录摘要
+    """
+    try:
+        # 从请求状态获取用户UUID
+        user_uuid = getattr(request.state, 'user_uuid', None)
+        if not user_uuid:
+            logger.error("计算目录摘要时无法获取用户UUID")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User authentication missing"
+            )
+        
+        user_dir = get_user_storage_dir(user_uuid)
+        target_path = validate_user_path(user_uuid, path) if path else user_dir
+        
+        if not target_path.is_dir():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Path is not a directory"
+            )
+        
+        # 要读目录下的所有文件，放到线程池里跑，并且和其他重遍历共用并发限制
+        async with _scan_sem:
+            # 回收站不算在内，只有回收站变了的话摘要不变
+            digest, file_count, total_size = await asyncio.to_thread(
+                directory_digest, target_path, _trash_dir_str(user_dir)
+            )
+        
+        return FastJSONResponse(
+            status_code=status.HTTP_200_OK,
+            content={
+                "path": _relative_path_str(target_path, user_dir) if target_path != user_dir else ".",
+                "user_uuid": user_uuid,
+                "algorithm": "sha256",
+                "digest": digest,
+                "file_count": file_count,
+                "total_size": total_size,
+            }
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"计算目录摘要失败: path={path}, error={e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to compute directory digest: {str(e)}"
+        )
+
+
 @router.get("/stats")
-async def get_storage_stats(request: Request) -> JSONResponse:
+async def get_storage_stats(request: Request) -> FastJSONResponse:
     """获取存储统计信息（重构版，支持用户隔离存储）
     
     返回用户存储目录的整体统计信息
@@ -350,7 +924,7 @@ async def get_storage_stats(request: Request) -> JSONResponse:
         request: FastAPI请求对象，用于获取用户UUID
         
     Returns:
-        JSONResponse: 存储统计信息
+        FastJSONResponse: 存储统计信息
     """
     try:
         # 从请求状态获取用户UUID
@@ -365,25 +939,28 @@ async def get_storage_stats(request: Request) -> JSONResponse:
         # 获取用户的存储目录
         user_dir = get_user_storage_dir(user_uuid)
         
-        total_size = 0
-        total_files = 0
-        total_dirs = 0
-        
-        # 遍历用户存储目录计算统计
-        for entry in user_dir.rglob("*"):
-            if entry.is_file():
-                total_size += entry.stat().st_size
-                total_files += 1
-            elif entry.is_dir():
-                total_dirs += 1
-        
-        # 计算根目录统计（排除根目录自身）
-        total_dirs = max(0, total_dirs - 1)  # 减去用户根目录自身
+        # 遍历用户存储目录计算统计（一次scandir遍历，每个文件一次stat）
+        # rglob("*")本来就不包含根目录自身，以前再减1是多减了
+        # 回收站不计入（回收站列表接口有自己的统计），遍历时整个跳过
+        # 缓存没过期就直接用
+        key = str(user_dir)
+        cached = _stats_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < _STATS_CACHE_TTL:
+            total_size, total_files, total_dirs = cached[1]
+        else:
+            computed_at = time.monotonic()
+            version = storage_version(user_dir)
+            async with _scan_sem:
+                tree_stats = await asyncio.to_thread(_scan_tree_stats, user_dir, _trash_dir_str(user_dir))
+            # 遍历期间有写操作的话（invalidate_storage_stats已经执行过了），结果可能是写之前的，不缓存
+            if storage_version(user_dir) == version:
+                _stats_cache[key] = (computed_at, tree_stats)
+            total_size, total_files, total_dirs = tree_stats
         
         # 获取存储目录信息
         storage_stat = user_dir.stat()
         
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=status.HTTP_200_OK,
             content={
                 "user_uuid": user_uuid,
@@ -393,7 +970,7 @@ async def get_storage_stats(request: Request) -> JSONResponse:
                 "total_files": total_files,
                 "total_directories": total_dirs,
                 "created_at": datetime.fromtimestamp(storage_stat.st_ctime).isoformat(),
-                "available_space": _get_available_space(user_dir),
+                "available_space": await asyncio.to_thread(_get_available_space, user_dir),
                 "message": "User storage statistics",
             }
         )
@@ -406,23 +983,23 @@ async def get_storage_stats(request: Request) -> JSONResponse:
         )
 
 
+# 大小单位，每级是前一级的1024倍（2^10）
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+
+
 def _human_readable_size(size_bytes: int) -> str:
     """将字节数转换为人类可读的格式
     
-    这里用这个简单的方案，不搞太复杂的分级转换了
-    TODO: 考虑是否需要更精细的单位转换
+    用bit_length直接算出单位下标（每10位一级），不再循环除1024
+    结果和原来的循环写法一致，超过TB的还是按TB显示
     """
-    if size_bytes == 0:
+    if size_bytes <= 0:
         return "0 B"
     
-    units = ["B", "KB", "MB", "GB", "TB"]
-    unit_index = 0
-    
-    while size_bytes >= 1024 and unit_index < len(units) - 1:
-        size_bytes /= 1024.0
-        unit_index += 1
-    
-    return f"{size_bytes:.2f} {units[unit_index]}"
+    unit_index = min((int(size_bytes).bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
+    if unit_index == 0:
+        return f"{size_bytes:.2f} B"
+    return f"{size_bytes / (1 << (unit_index * 10)):.2f} {_SIZE_UNITS[unit_index]}"
 
 
 def _get_available_space(path: Path) -> Dict:
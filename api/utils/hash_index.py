@@ -0,0 +1,198 @@
+"""
+文件哈希索引
+维护 sha256 -> 文件路径 的持久化索引（sqlite），按哈希找文件时不用再把整个存储目录哈希一遍
+
+每条记录都带上(inode, mtime_ns, size)，查出来的记录和磁盘上对不上就当作过期删掉
+索引读写失败不影响其他功能，只是按哈希找文件会找不到
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+from config import STORAGE_DIR
+
+logger = logging.getLogger(__name__)
+
+# 索引数据库放在storage目录下，和users.json一起备份
+HASH_INDEX_FILE = STORAGE_DIR / "hashes.db"
+
+# 索引操作要兜住的异常：除了sqlite本身的错误，文件名不是合法UTF-8时（surrogateescape解码出来的）
+# 绑定参数会抛UnicodeEncodeError（ValueError的子类），这种文件只是进不了索引，不能让调用方跟着失败
+_INDEX_ERRORS = (sqlite3.Error, ValueError)
+
+
+class HashIndex:
+    """sha256 -> 路径 的sqlite索引
+
+    连接在第一次使用时才打开（导入模块时storage目录可能还没创建）
+    sqlite连接不是线程安全的，这里用一把锁串行化，查询都很快，问题不大
+    """
+
+    def __init__(self, db_path: Path):
+        self._db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """打开（必要时创建）索引数据库，调用方需持有锁"""
+        if self._conn is None:
+            self._db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self._db_path), check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_hashes ("
+                " path TEXT PRIMARY KEY,"
+                " sha256 TEXT NOT NULL,"
+                " inode INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " size INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_file_hashes_sha256 ON file_hashes (sha256)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def record(self, file_path: Path, sha256: str, stat_result: os.stat_result) -> None:
+        """记录（或更新）一个文件的哈希
+
+        Args:
+            file_path: 文件路径
+            sha256: 文件的十六进制SHA256
+            stat_result: 计算哈希时文件的stat结果
+        """
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO file_hashes (path, sha256, inode, mtime_ns, size) VALUES (?, ?, ?, ?, ?)",
+                    (str(file_path), sha256, stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size),
+                )
+                conn.commit()
+        except _INDEX_ERRORS as e:
+            logger.warning(f"写入哈希索引失败: {file_path}, error={e}")
+
+    def get(self, file_path: Path, stat_result: os.stat_result) -> Optional[str]:
+        """查询文件已知的哈希，文件没变过才返回
+
+        Args:
+            file_path: 文件路径
+            stat_result: 文件当前的stat结果
+
+        Returns:
+            Optional[str]: 哈希值，没有记录或记录过期返回None
+        """
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT sha256, inode, mtime_ns, size FROM file_hashes WHERE path = ?",
+                    (str(file_path),),
+                ).fetchone()
+        except _INDEX_ERRORS as e:
+            logger.warning(f"读取哈希索引失败: {file_path}, error={e}")
+            return None
+
+        if row is None:
+            return None
+        sha256, inode, mtime_ns, size = row
+        if (inode, mtime_ns, size) != (stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size):
+            return None
+        return sha256
+
+    def lookup(self, sha256: str, under_dir: Path) -> Optional[Path]:
+        """按哈希查找文件，只返回under_dir目录下、且内容没变过的文件
+
+        顺手把已经过期（文件被删/被改）的记录清掉
+
+        Args:
+            sha256: 十六进制SHA256
+            under_dir: 只在这个目录下找（用户隔离）
+
+        Returns:
+            Optional[Path]: 找到的文件路径，没找到返回None
+        """
+        prefix = str(under_dir) + os.sep
+        try:
+            with self._lock:
+                rows = self._connect().execute(
+                    "SELECT path, inode, mtime_ns, size FROM file_hashes WHERE sha256 = ?",
+                    (sha256,),
+                ).fetchall()
+        except _INDEX_ERRORS as e:
+            logger.warning(f"查询哈希索引失败: sha256={sha256}, error={e}")
+            return None
+
+        found = None
+        stale = []
+        for path_str, inode, mtime_ns, size in rows:
+            if not path_str.startswith(prefix):
+                continue
+            try:
+                st = os.stat(path_str)
+            except OSError:
+                stale.append(path_str)
+                continue
+            if (st.st_ino, st.st_mtime_ns, st.st_size) != (inode, mtime_ns, size):
+                stale.append(path_str)
+                continue
+            found = Path(path_str)
+            break
+
+        if stale:
+            try:
+                with self._lock:
+                    conn = self._connect()
+                    conn.executemany("DELETE FROM file_hashes WHERE path = ?", [(p,) for p in stale])
+                    conn.commit()
+            except _INDEX_ERRORS as e:
+                logger.warning(f"清理过期哈希索引失败: error={e}")
+
+        return found
+
+    def move(self, old_path: Path, new_path: Path) -> None:
+        """文件/目录被重命名或移动后，把记录的路径一起改掉
+
+        目录的话下面所有文件的记录都跟着改，重命名不改inode和mtime，记录仍然有效
+
+        Args:
+            old_path: 原路径
+            new_path: 新路径
+        """
+        old_str = str(old_path)
+        prefix = old_str + os.sep
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "UPDATE OR REPLACE file_hashes SET path = ? || substr(path, ?)"
+                    " WHERE path = ? OR substr(path, 1, ?) = ?",
+                    (str(new_path), len(old_str) + 1, old_str, len(prefix), prefix),
+                )
+                conn.commit()
+        except _INDEX_ERRORS as e:
+            logger.warning(f"更新哈希索引路径失败: {old_path} -> {new_path}, error={e}")
+
+    def remove(self, file_path: Path) -> None:
+        """删除文件/目录（目录下所有文件）的记录
+
+        Args:
+            file_path: 被删除的路径
+        """
+        path_str = str(file_path)
+        prefix = path_str + os.sep
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "DELETE FROM file_hashes WHERE path = ? OR substr(path, 1, ?) = ?",
+                    (path_str, len(prefix), prefix),
+                )
+                conn.commit()
+        except _INDEX_ERRORS as e:
+            logger.warning(f"删除哈希索引记录失败: {file_path}, error={e}")
+
+
+# 全局索引实例
+hash_index = HashIndex(HASH_INDEX_FILE)
@@ -0,0 +1,97 @@
+"""
+文件名索引
+维护 用户目录 -> {文件名: [路径, ...]} 的内存索引，按裸文件名找文件时不用每次都遍历整个用户目录
+
+索引第一次用到时才建（os.walk一遍），之后：
+- 上传完成时直接把新文件加进去
+- 查询时会检查候选路径是否还存在，已经不在的就跳过
+- 一个候选都没有时重建一次再查，这样别的途径（移动、重命名等）新增的文件也能找到
+索引只是加速用的，进程重启后重新建就行，不需要持久化
+"""
+
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class NameIndex:
+    """文件名 -> 路径列表 的内存索引，按用户目录分开存"""
+
+    def __init__(self):
+        self._indexes: Dict[str, Dict[str, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _build(user_dir: Path) -> Dict[str, List[str]]:
+        """遍历用户目录，建立该用户的文件名索引"""
+        index: Dict[str, List[str]] = {}
+        for root, _dirs, files in os.walk(user_dir):
+            for name in files:
+                index.setdefault(name, []).append(os.path.join(root, name))
+        return index
+
+    def add(self, user_dir: Path, file_path: Path) -> None:
+        """把新文件加进索引（索引还没建过就什么都不做，第一次查询时会一起建）
+
+        Args:
+            user_dir: 用户存储目录
+            file_path: 新文件路径
+        """
+        with self._lock:
+            index = self._indexes.get(str(user_dir))
+            if index is not None:
+                paths = index.setdefault(file_path.name, [])
+                if str(file_path) not in paths:
+                    paths.append(str(file_path))
+
+    def lookup(self, user_dir: Path, filename: str) -> Optional[Path]:
+        """按文件名查找用户目录下的文件
+
+        同名文件有多个时返回路径排序后的第一个，保证结果稳定
+
+        Args:
+            user_dir: 用户存储目录
+            filename: 文件名（不含目录）
+
+        Returns:
+            Optional[Path]: 找到的文件路径，没找到返回None
+        """
+        key = str(user_dir)
+        with self._lock:
+            index = self._indexes.get(key)
+
+        fresh = index is None
+        if fresh:
+            index = self._rebuild(user_dir)
+
+        found = self._first_existing(index, filename)
+        if found is None and not fresh:
+            # 索引里的候选都失效了（或者文件是后来别的途径加进来的），重建一次再查
+            found = self._first_existing(self._rebuild(user_dir), filename)
+
+        if found is None:
+            logger.debug(f"文件名索引未找到: {filename}")
+        return found
+
+    def _rebuild(self, user_dir: Path) -> Dict[str, List[str]]:
+        """重建并替换某个用户的索引"""
+        index = self._build(user_dir)
+        with self._lock:
+            self._indexes[str(user_dir)] = index
+        return index
+
+    @staticmethod
+    def _first_existing(index: Dict[str, List[str]], filename: str) -> Optional[Path]:
+        """返回索引里该文件名下第一个仍然存在的文件"""
+        for path_str in sorted(index.get(filename, ())):
+            if os.path.isfile(path_str):
+                return Path(path_str)
+        return None
+
+
+# 全局索引实例
+name_index = NameIndex()
@@ -6,11 +6,14 @@
 新的路径验证应该基于用户的存储目录：/storage/{user_uuid}/
 """
 
+import os
+import stat as stat_lib
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 from fastapi import HTTPException, status
 
-from config import STORAGE_DIR, get_user_storage_dir
+from config import STORAGE_DIR, STORAGE_ROOT_STR, get_user_storage_dir
 
 
 def _validate_path(user_path: str) -> Path:
@@ -20,29 +23,79 @@ def _validate_path(user_path: str) -> Path:
     但先留着，可能其他地方还用到了
     """
     if not user_path or user_path == ".":
-        target_path = STORAGE_DIR
-    else:
-        target_path = (STORAGE_DIR / user_path).resolve()
+        return STORAGE_DIR
     
     # 安全检查：确保路径在STORAGE_DIR内
-    # 使用is_relative_to代替字符串比较，跨平台兼容
-    try:
-        target_path.relative_to(STORAGE_DIR.resolve())
-    except ValueError:
-        # 路径不在STORAGE_DIR内
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Path traversal is not allowed"
-        )
+    # 和validate_user_path一样基于导入时解析好的STORAGE_ROOT做字符串检查，
+    # 前缀带结尾分隔符，/storage_evil 这种不会被当成 /storage 下的路径
+    target = _resolve_user_path(STORAGE_ROOT_STR, user_path)
     
     # 检查路径是否存在
-    if not target_path.exists():
+    if target is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Path not found"
         )
     
-    return target_path
+    return Path(target)
+
+
+@lru_cache(maxsize=4096)
+def _real_dir_str(dir_str: str) -> str:
+    """目录的真实路径（解析过符号链接），按目录缓存
+
+    用户存储目录创建后不会再变，没必要每个请求都resolve()一遍
+    """
+    return os.path.realpath(dir_str)
+
+
+def _resolve_user_path(base_real: str, user_path: str) -> Optional[str]:
+    """在已解析的用户目录下解析相对路径
+
+    先用normpath在字符串层面折叠掉 . 和 ..（纯用户态，不碰文件系统），
+    再从用户目录往下逐级lstat，确认路径存在、且中间没有符号链接
+    只有真碰到符号链接时才退回到realpath完整解析
+    和以前的Path.resolve()相比，用户目录本身那几级不用再每次解析
+
+    Args:
+        base_real: 用户存储目录的真实路径
+        user_path: 用户提供的相对路径
+
+    Returns:
+        Optional[str]: 解析后的绝对路径，路径不存在返回None
+
+    Raises:
+        HTTPException: 路径越出用户目录(400)
+    """
+    prefix = base_real + os.sep
+    candidate = os.path.normpath(os.path.join(base_real, user_path))
+    if candidate != base_real and not candidate.startswith(prefix):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Path traversal is not allowed (user isolation)"
+        )
+
+    if candidate == base_real:
+        return candidate
+
+    current = base_real
+    for part in candidate[len(prefix):].split(os.sep):
+        current = current + os.sep + part
+        try:
+            st = os.lstat(current)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if stat_lib.S_ISLNK(st.st_mode):
+            # 有符号链接，按真实路径再检查一次，防止链接指到用户目录外面
+            candidate = os.path.realpath(candidate)
+            if candidate != base_real and not candidate.startswith(prefix):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Path traversal is not allowed (user isolation)"
+                )
+            return candidate if os.path.exists(candidate) else None
+
+    return candidate
 
 
 def validate_user_path(user_uuid: str, user_path: str = "") -> Path:
@@ -65,39 +118,25 @@ def validate_user_path(user_uuid: str, user_path: str = "") -> Path:
     user_dir = get_user_storage_dir(user_uuid)
     
     if not user_path or user_path == ".":
-        target_path = user_dir
-    else:
-        # 注意：这里不能用resolve()，因为如果路径不存在resolve会出问题
-        # 先用绝对路径计算，然后检查安全性
-        try:
-            # 构建目标路径
-            target_path = (user_dir / user_path).resolve()
-        except Exception as e:
-            # 路径格式无效
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Invalid path: {str(e)}"
-            )
+        return user_dir
     
-    # 安全检查：确保路径在用户的存储目录内
-    # 使用is_relative_to代替字符串比较，跨平台兼容
+    # 安全检查：确保路径在用户的存储目录内，同时检查路径是否存在
     try:
-        target_path.relative_to(user_dir.resolve())
-    except ValueError:
-        # 路径不在用户目录内
+        resolved = _resolve_user_path(_real_dir_str(str(user_dir)), user_path)
+    except (ValueError, OSError) as e:
+        # 路径格式无效（比如包含空字符）
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Path traversal is not allowed (user isolation)"
+            detail=f"Invalid path: {str(e)}"
         )
     
-    # 检查路径是否存在
-    if not target_path.exists():
+    if resolved is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Path not found"
         )
     
-    return target_path
+    return Path(resolved)
 
 
 def _is_safe_operation(source: Path, destination: Path) -> bool:
@@ -0,0 +1,57 @@
+"""
+Redis客户端
+用户数据、上传会话这些需要在多个worker进程间共享的状态可以放到Redis里
+
+没配置地址时调用方用本地存储；配置了地址就一定用Redis（redis库这时是必需的，没装直接报错），
+不会因为某次连不上就悄悄退回本地存储，否则多个worker进程会各用各的数据
+"""
+
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# URL -> (解码的客户端, 不解码的客户端)，同一个地址共用客户端（自带连接池）
+_clients: Dict[str, Tuple["redis.Redis", "redis.Redis"]] = {}
+_clients_lock = threading.Lock()
+
+
+def get_redis(url: Optional[str], decode_responses: bool = True) -> Optional["redis.Redis"]:
+    """取指定地址的Redis客户端
+    
+    客户端是懒连接的：创建时不连，执行命令时才连，连不上时那条命令抛异常（调用方处理），
+    之后的命令会自动重连；所以Redis短暂不可用时只影响那段时间的请求，恢复后自动接上
+    解码和不解码的两个客户端一起创建，要么都有要么都没有
+    
+    Args:
+        url: Redis地址，例如 redis://localhost:6379/0，None或空串表示不用Redis
+        decode_responses: 返回值是否解码成字符串，要读位图这类二进制值时传False
+        
+    Returns:
+        Optional[redis.Redis]: 客户端，没配置地址时为None
+        
+    Raises:
+        RuntimeError: 配置了地址但没有安装redis库
+    """
+    if not url:
+        return None
+    clients = _clients.get(url)
+    if clients is None:
+        with _clients_lock:
+            clients = _clients.get(url)
+            if clients is None:
+                if redis is None:
+                    raise RuntimeError(f"配置了Redis地址但没有安装redis库（pip install redis）: {url}")
+                clients = (
+                    redis.Redis.from_url(url, decode_responses=True),
+                    redis.Redis.from_url(url, decode_responses=False),
+                )
+                _clients[url] = clients
+                logger.info(f"使用Redis: {url}")
+    return clients[0] if decode_responses else clients[1]
@@ -0,0 +1,27 @@
+"""
+响应相关的工具
+目录列表、统计这类大JSON响应用orjson序列化，比标准库json快很多
+
+orjson是可选依赖，没装的话自动退回到FastAPI默认的JSONResponse
+"""
+
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """优先用orjson序列化的JSONResponse
+
+    输出和JSONResponse一致（UTF-8、紧凑格式），只是序列化更快
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content)
@@ -0,0 +1,164 @@
+"""
+文件名搜索索引
+维护 用户目录 -> (所有条目, 三元组倒排表) 的内存索引，按名称搜索时不用每次都遍历整个用户目录
+
+- 条目：(名称, 完整路径, 是否目录)，文件和目录都有（回收站也在里面，查询时再按需过滤）
+- 倒排表：名称小写后的每个连续3字符片段(trigram) -> 含有它的条目编号集合
+查询时从搜索词里取出所有trigram，求倒排表交集得到候选，再用正则逐个确认
+搜索词太短（没有长度>=3的字面片段）时没法用倒排表，就在内存里把所有名称过一遍，也不碰磁盘
+
+索引第一次用到时才建（遍历一遍目录），之后：
+- 用户存储版本号变了（本服务内有写操作）就重建
+- 超过TTL也重建，外部直接改文件的情况靠这个兜底
+索引只是加速用的，进程重启后重新建就行，不需要持久化
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 索引建好后最多用这么久就重建（外部改动的兜底）
+SEARCH_INDEX_TTL = 30.0
+
+# 通配符把搜索词切成若干字面片段，片段内部才能取trigram
+_WILDCARD_RE = re.compile(r"[*?]")
+
+
+def _trigrams(text: str) -> Set[str]:
+    """text里所有连续3字符片段"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class _UserSearchIndex:
+    """一个用户目录的搜索索引（建好后只读）"""
+
+    __slots__ = ("version", "built_at", "entries", "postings")
+
+    def __init__(self, version: int, built_at: float,
+                 entries: List[Tuple[str, str, bool]], postings: Dict[str, Set[int]]):
+        self.version = version
+        self.built_at = built_at
+        self.entries = entries
+        self.postings = postings
+
+
+class SearchIndex:
+    """文件名 trigram 倒排索引，按用户目录分开存"""
+
+    def __init__(self):
+        self._indexes: Dict[str, _UserSearchIndex] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _build(user_dir: Path, version: int) -> _UserSearchIndex:
+        """遍历用户目录，建立该用户的搜索索引
+
+        和以前的搜索一样用os.scandir手动递归，符号链接目录会收录但不进入
+        """
+        built_at = time.monotonic()
+        entries: List[Tuple[str, str, bool]] = []
+        postings: Dict[str, Set[int]] = {}
+
+        stack = [str(user_dir)]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    for dir_entry in it:
+                        is_dir = dir_entry.is_dir()
+                        if is_dir and not dir_entry.is_symlink():
+                            stack.append(dir_entry.path)
+                        entry_id = len(entries)
+                        entries.append((dir_entry.name, dir_entry.path, is_dir))
+                        for gram in _trigrams(dir_entry.name.lower()):
+                            postings.setdefault(gram, set()).add(entry_id)
+            except OSError as e:
+                logger.warning(f"建立搜索索引时跳过无法访问的目录: {current}, error={e}")
+
+        return _UserSearchIndex(version, built_at, entries, postings)
+
+    def _get(self, user_dir: Path, version: int) -> _UserSearchIndex:
+        """取用户的索引，没有、版本不对或者过期了就重建"""
+        key = str(user_dir)
+        with self._lock:
+            index = self._indexes.get(key)
+
+        if (index is None or index.version != version
+                or time.monotonic() - index.built_at >= SEARCH_INDEX_TTL):
+            index = self._build(user_dir, version)
+            with self._lock:
+                self._indexes[key] = index
+        return index
+
+    def search(
+        self,
+        user_dir: Path,
+        version: int,
+        q: str,
+        regex: "re.Pattern",
+        search_root: Path,
+        skip_dir: Optional[str] = None,
+    ) -> List[Tuple[str, str, bool]]:
+        """按名称搜索用户目录下的文件和目录
+
+        Args:
+            user_dir: 用户存储目录
+            version: 用户存储的当前版本号，和索引建立时不一样就重建
+            q: 原始搜索词（用来取trigram）
+            regex: 编译好的名称匹配正则（用来确认候选）
+            search_root: 只返回这个目录下面的条目
+            skip_dir: 这个目录（一般是回收站）及其下面的条目都不要
+
+        Returns:
+            List[Tuple[str, str, bool]]: (名称, 完整路径, 是否目录) 列表，未排序
+        """
+        index = self._get(user_dir, version)
+
+        # 每个字面片段的trigram都必须出现在名称里（不区分大小写，区分大小写的由正则再确认）
+        grams: Set[str] = set()
+        for part in _WILDCARD_RE.split(q.lower()):
+            grams |= _trigrams(part)
+
+        if grams:
+            posting_lists = []
+            for gram in grams:
+                ids = index.postings.get(gram)
+                if not ids:
+                    return []
+                posting_lists.append(ids)
+            # 从最短的倒排表开始求交集
+            posting_lists.sort(key=len)
+            candidate_ids = set(posting_lists[0])
+            for ids in posting_lists[1:]:
+                candidate_ids &= ids
+                if not candidate_ids:
+                    return []
+            candidates = (index.entries[i] for i in candidate_ids)
+        else:
+            candidates = iter(index.entries)
+
+        root_prefix = None if search_root == user_dir else str(search_root) + os.sep
+        skip_prefix = None if skip_dir is None else skip_dir + os.sep
+        if root_prefix is not None and skip_prefix is not None and root_prefix.startswith(skip_prefix):
+            # 本来就是在回收站里面搜，不用跳过
+            skip_dir = None
+
+        found = []
+        for name, path_str, is_dir in candidates:
+            if root_prefix is not None and not path_str.startswith(root_prefix):
+                continue
+            if skip_dir is not None and (path_str == skip_dir or path_str.startswith(skip_prefix)):
+                continue
+            if regex.search(name):
+                found.append((name, path_str, is_dir))
+        return found
+
+
+# 全局索引实例
+search_index = SearchIndex()
@@ -22,21 +22,53 @@ You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import asyncio
 import logging
 import json
+import time
+from functools import lru_cache
 from typing import Optional, Tuple
-from fastapi import Request
-from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
 from starlette.types import ASGIApp, Scope, Receive, Send
 
 # 导入用户认证模块
 # 注意：这里直接导入，因为user_auth.py在同一目录下
 # 如果导入失败，说明路径有问题，需要检查项目结构
-from user_auth import verify_totp
+from user_auth import verify_totp, users_generation, users_use_redis
 
 logger = logging.getLogger(__name__)
 
+# TOTP的时间步长（秒），和utotp.generate_totp默认值保持一致
+TOTP_TIME_STEP = 30
 
+# 需要鉴权的路径前缀，str.startswith接受元组，一次调用搞定
+AUTH_PATH_PREFIXES = ("/upload", "/download", "/files")
+
+# 401响应内容是固定的，导入时序列化一次，之后直接发原始字节
+_401_BODY = b'{"detail":"Unauthorized"}'
+_401_HEADERS = [
+    (b"content-type", b"application/json"),
+    (b"content-length", str(len(_401_BODY)).encode()),
+]
+
+
+@lru_cache(maxsize=8192)
+def _verify_cached(uuid_str: str, totp_code: str, step: int, generation: int) -> bool:
+    """带缓存的TOTP验证
+    
+    客户端并发分片下载时，同一个(uuid, totp)会在30秒内重复发几十次
+    verify_totp在同一个时间步内结果是确定的，所以按时间步缓存就行
+    step变了key就变了，旧结果自然失效，LRU负责把它们挤出去
+    generation是用户数据的版本号，用户被删除或者换了密钥时会变，旧的验证结果同样跟着失效
+    
+    注意：verify_totp本身已经接受前后各一个窗口的码，这里不需要再查step-1
+    """
+    return verify_totp(uuid_str, totp_code)
+
+
+def _verify_request(uuid_str: str, totp_code: str, step: int) -> bool:
+    """验证一个请求的(uuid, totp)，同一时间步、同一用户数据版本内走缓存"""
+    return _verify_cached(uuid_str, totp_code, step, users_generation())
 
 
 class AuthMiddleware:
@@ -50,26 +82,19 @@ class AuthMiddleware:
         self.app = app
         
     async def __call__(self, scope: Scope, receive: Receive, send: Send):
-        # 只处理HTTP请求
-        if scope["type"] != "http":
+        # 只处理HTTP请求，跳过 OPTIONS 请求（CORS 预检）
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
             await self.app(scope, receive, send)
             return
-
-        # 跳过 OPTIONS 请求（CORS 预检）
-        if scope["method"] == "OPTIONS":
-            await self.app(scope, receive, send)
-            return
-            
-        request = Request(scope, receive)
-        path = request.url.path
+        
+        # 直接从scope取路径，不构造Request/URL对象（每个请求都要走这里）
+        path = scope["path"]
         
         # 仅对特定路径启用鉴权
-        if (path.startswith("/upload") or 
-            path.startswith("/download") or 
-            path.startswith("/files")):
+        if path.startswith(AUTH_PATH_PREFIXES):
             
             # 从请求头提取UUID和TOTP码
-            auth_result = self._extract_auth_info(request)
+            auth_result = self._extract_auth_info(Headers(scope=scope))
             
             if not auth_result:
                 # 提取认证信息失败
@@ -79,8 +104,14 @@ class AuthMiddleware:
             
             uuid_str, totp_code = auth_result
             
-            # 验证TOTP码
-            if not verify_totp(uuid_str, totp_code):
+            # 验证TOTP码（同一时间步内的重复请求直接走缓存）
+            step = int(time.time()) // TOTP_TIME_STEP
+            if users_use_redis():
+                # 用户数据在Redis里时验证要走网络（同步的redis客户端），放到线程池里，不卡事件循环
+                is_valid = await asyncio.to_thread(_verify_request, uuid_str, totp_code, step)
+            else:
+                is_valid = _verify_request(uuid_str, totp_code, step)
+            if not is_valid:
                 await self._unauthorized_response(scope, receive, send)
                 logger.warning(f"TOTP验证失败: {path}, uuid={uuid_str}")
                 return
@@ -94,7 +125,7 @@ class AuthMiddleware:
         
         await self.app(scope, receive, send)
     
-    def _extract_auth_info(self, request: Request) -> Optional[Tuple[str, str]]:
+    def _extract_auth_info(self, headers: Headers) -> Optional[Tuple[str, str]]:
         """从请求头提取UUID和TOTP码
         
         支持的格式：
@@ -102,14 +133,14 @@ class AuthMiddleware:
         2. JSON格式的Authorization头：{"Id": uuid, "Totp": totp}
         """
         # 首选：直接读取自定义头（更简洁）
-        uuid_str = request.headers.get("Id")
-        totp_code = request.headers.get("Totp")
+        uuid_str = headers.get("Id")
+        totp_code = headers.get("Totp")
         
         if uuid_str and totp_code:
             return str(uuid_str), str(totp_code)
         
         # 备选：尝试从Authorization头提取JSON格式
-        auth_header = request.headers.get("Authorization")
+        auth_header = headers.get("Authorization")
         if auth_header:
             try:
                 # 去掉可能的Bearer前缀
@@ -118,6 +149,13 @@ class AuthMiddleware:
                 else:
                     auth_json_str = auth_header
                 
+                # 先看第一个非空白字符，不是'{'就肯定不是JSON对象
+                # 普通Bearer Token很常见，没必要让json.loads抛异常再捕获
+                auth_json_str = auth_json_str.lstrip()
+                if not auth_json_str.startswith("{"):
+                    logger.debug("Authorization头不是JSON格式")
+                    return None
+                
                 auth_data = json.loads(auth_json_str)
                 uuid_str = auth_data.get("Id")
                 totp_code = auth_data.get("Totp")
@@ -134,12 +172,12 @@ class AuthMiddleware:
         return None
     
     async def _unauthorized_response(self, scope: Scope, receive: Receive, send: Send):
-        """返回401未授权响应"""
-        response = JSONResponse(
-            status_code=401,
-            content={"detail": "Unauthorized"}
-        )
-        await response(scope, receive, send)
+        """返回401未授权响应
+        
+        直接发送预先序列化好的响应，不再每次构造JSONResponse
+        """
+        await send({"type": "http.response.start", "status": 401, "headers": _401_HEADERS})
+        await send({"type": "http.response.body", "body": _401_BODY})
 
 
 def add_auth_middleware(app):
@@ -26,8 +26,9 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import logging
+import os
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 
 # 基础配置
 BASE_DIR = Path(__file__).parent.absolute()  # 项目根目录
@@ -37,6 +38,40 @@ UPLOAD_DIR = BASE_DIR / "uploads"            # 临时上传分片目录
 STORAGE_DIR = BASE_DIR / "storage"           # 最终文件存储目录
 CHUNK_SIZE = 4 * 1024 * 1024                 # 分片大小，4MB（与前端协商一致）
 
+# 批量算文件哈希的并发线程数（hashlib计算时释放GIL，多核能并行跑）
+# 默认和ThreadPoolExecutor的默认值一样：CPU核数+4，最多32
+# 存储是机械硬盘的话建议调小（比如2），并发随机读反而更慢
+HASH_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# 缩略图磁盘缓存：按(文件SHA256, 宽, 高, 质量)缓存生成好的JPEG，同一张图同样参数只生成一次
+# 总大小超过上限时按最近访问时间淘汰
+THUMBNAIL_CACHE_DIR = STORAGE_DIR / ".thumbnails"
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# 用户认证数据（uuid -> TOTP密钥）存到Redis里，多个worker进程共享，读写都是原子的
+# 设置了环境变量才启用（需要 pip install redis），例如 redis://localhost:6379/0
+# 没设置、没装redis库、或者启动时连不上Redis，都继续用storage/users.json
+USERS_REDIS_URL = os.environ.get("CAMFC_USERS_REDIS_URL")
+# 用户数据在Redis里存成一个hash：HSET <key> <uuid> <totp_key>
+USERS_REDIS_KEY = "camfc:users"
+
+# 分片上传的会话状态（已上传哪些分片等）也可以放到Redis里，
+# 这样 uvicorn --workers N 时 /init、/chunk、/finish 落到不同进程也能找到同一个会话
+# 没单独设置就和用户数据用同一个Redis；都没设置就存在进程内存里（只能单进程）
+UPLOAD_REDIS_URL = os.environ.get("CAMFC_UPLOAD_REDIS_URL") or USERS_REDIS_URL
+# 上传会话在Redis里的过期时间（秒），超时没完成的上传自动清掉状态
+UPLOAD_SESSION_TTL = 24 * 3600
+
+# 预先算好的字符串形式（带结尾分隔符），热路径上直接拼接字符串
+# 避免每次 STORAGE_DIR / xxx 都走一遍 Path.__truediv__ 重新解析
+BASE_DIR_STR = str(BASE_DIR) + os.sep
+UPLOAD_DIR_STR = str(UPLOAD_DIR) + os.sep
+STORAGE_DIR_STR = str(STORAGE_DIR) + os.sep
+
+# 存储目录的真实路径（解析过符号链接），路径安全检查要用，导入时算一次
+STORAGE_ROOT = STORAGE_DIR.resolve()
+STORAGE_ROOT_STR = str(STORAGE_ROOT)
+
 # 日志配置
 LOG_LEVEL = logging.INFO
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -50,25 +85,38 @@ def ensure_dirs() -> None:
         dir_path.mkdir(exist_ok=True)
         logging.debug(f"确保目录存在: {dir_path}")
 
-def get_file_path(file_id: str) -> Optional[Path]:
+def get_file_path(file_id: str) -> Optional[Tuple[Path, os.stat_result]]:
     """根据文件ID获取存储路径
     
     文件ID可以是SHA256哈希或UUID，对应storage目录下的文件名
     为简化，我们直接按文件名查找（不含子目录）
     
+    顺便把stat结果一起返回，调用方就不用再stat一次了
+    （以前是exists()一次、调用方stat()又一次）
+    
     【注意】重构后这个函数可能不太适用了，因为存储变成了用户隔离
     但先留着，后面再改或者废弃
     """
     # 简单实现：在storage目录下查找同名文件
-    file_path = STORAGE_DIR / file_id
-    if file_path.exists():
-        return file_path
+    # os.stat直接接受str，只有找到了才包装成Path返回
+    path_str = STORAGE_DIR_STR + file_id
+    try:
+        return Path(path_str), os.stat(path_str)
+    except FileNotFoundError:
+        pass
     
     # v2: 可考虑建立索引数据库或按哈希前缀分目录存储
     logging.warning(f"文件未找到: {file_id}")
     return None
 
 
+# 已经确认创建过的用户目录，避免每次请求都mkdir一次
+# 只是个缓存，进程重启后会重新mkdir一遍，问题不大
+# mkdir本身是幂等的（exist_ok=True），所以并发情况下多mkdir一次也无所谓，不用加锁
+_CREATED_UUID_DIRS: set = set()
+_CREATED_UUID_DIRS_MAX = 100000  # 上限，超过就清空重来，防止无限增长
+
+
 def get_user_storage_dir(user_uuid: Optional[str] = None) -> Path:
     """获取用户的存储目录
     
@@ -84,15 +132,19 @@ def get_user_storage_dir(user_uuid: Optional[str] = None) -> Path:
     if user_uuid:
         # 用户隔离存储
         user_dir = STORAGE_DIR / user_uuid
-        # 确保目录存在
-        user_dir.mkdir(exist_ok=True)
+        # 确保目录存在（只在第一次访问时mkdir）
+        if user_uuid not in _CREATED_UUID_DIRS:
+            user_dir.mkdir(exist_ok=True)
+            if len(_CREATED_UUID_DIRS) >= _CREATED_UUID_DIRS_MAX:
+                _CREATED_UUID_DIRS.clear()
+            _CREATED_UUID_DIRS.add(user_uuid)
         return user_dir
     else:
         # 没提供UUID，返回根目录（可能用于一些不需要用户隔离的操作）
         return STORAGE_DIR
 
 
-def get_user_file_path(user_uuid: str, file_id: str) -> Optional[Path]:
+def get_user_file_path(user_uuid: str, file_id: str) -> Optional[Tuple[Path, os.stat_result]]:
     """根据用户UUID和文件ID获取存储路径
     
     新版的get_file_path，考虑了用户隔离
@@ -102,17 +154,19 @@ def get_user_file_path(user_uuid: str, file_id: str) -> Optional[Path]:
         file_id: 文件ID（文件名或哈希）
     
     Returns:
-        Optional[Path]: 文件路径，如果找不到返回None
+        Optional[Tuple[Path, os.stat_result]]: (文件路径, stat结果)，如果找不到返回None
     """
-    user_dir = get_user_storage_dir(user_uuid)
-    file_path = user_dir / file_id
+    get_user_storage_dir(user_uuid)  # 确保用户目录存在
+    path_str = f"{STORAGE_DIR_STR}{user_uuid}{os.sep}{file_id}"
     
-    if file_path.exists():
-        return file_path
+    try:
+        return Path(path_str), os.stat(path_str)
+    except FileNotFoundError:
+        pass
     
     logging.warning(f"用户文件未找到: user={user_uuid}, file={file_id}")
     return None
 
 
 # TODO: 需要修改ensure_dirs函数，确保用户目录也会被创建
-# 不过get_user_storage_dir里已经mkdir了，应该够用了
+# 不过get_user_storage_dir里第一次访问时已经mkdir了，应该够用了
@@ -27,40 +27,327 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
 import mimetypes
+import os
+import re
+import stat as stat_lib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
 from urllib.parse import quote
 
 from fastapi import APIRouter, HTTPException, status, Header, Request
-from fastapi.responses import FileResponse, StreamingResponse, Response
+from fastapi.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
 
 from config import STORAGE_DIR
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=4096)
 def safe_content_disposition(filename: str) -> str:
     """安全构建 Content-Disposition header，处理非ASCII文件名
     
+    结果只取决于文件名，按文件名缓存
+    
     Args:
         filename: 原始文件名
         
     Returns:
         安全的 Content-Disposition header 值
     """
-    # 检查文件名是否只包含ASCII字符
-    try:
-        filename.encode('ascii')
+    # 检查文件名是否只包含ASCII字符（str.isascii是C实现的，不用靠异常判断）
+    if filename.isascii():
         # 纯ASCII，直接使用
         return f'attachment; filename="{filename}"'
-    except UnicodeEncodeError:
-        # 包含非ASCII字符，使用RFC 5987编码
-        # UTF-8编码 + 百分号编码
-        encoded = quote(filename, encoding='utf-8')
-        return f"attachment; filename*=UTF-8''{encoded}"
+    
+    # 包含非ASCII字符，使用RFC 5987编码
+    # UTF-8编码 + 百分号编码
+    encoded = quote(filename, encoding='utf-8')
+    return f"attachment; filename*=UTF-8''{encoded}"
+
+
+@lru_cache(maxsize=1024)
+def _guess_mime_by_suffix(suffix: str) -> str:
+    """按扩展名缓存MIME类型猜测结果
+    
+    suffix是文件名第一个点之后的全部后缀（比如".tar.gz"），
+    这样和直接对完整文件名调用mimetypes.guess_type结果一致
+    """
+    mime_type, _ = mimetypes.guess_type("f" + suffix)
+    return mime_type or "application/octet-stream"
+
+
+def guess_mime_type(filename: str) -> str:
+    """猜测文件的MIME类型，猜不出来返回application/octet-stream"""
+    dot = filename.find(".", 1)  # 跳过开头的点（.bashrc这种没有扩展名）
+    return _guess_mime_by_suffix(filename[dot:] if dot != -1 else "")
 
 router = APIRouter(prefix="/download", tags=["download"])
 
 
+class _FdEntry:
+    """_FdCache里的一项：文件描述符 + 引用计数"""
+    
+    __slots__ = ("fd", "refs", "retired")
+    
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.refs = 0
+        self.retired = False  # 已被LRU淘汰，等最后一个使用者释放时关闭
+
+
+class _FdCache:
+    """Range下载用的只读文件描述符LRU缓存
+    
+    热门文件的分片下载不用每次都open()，配合os.pread也省掉了seek
+    key里带上inode和mtime，文件被替换或修改后自然会打开新的fd，不会读到旧内容
+    淘汰时如果fd还在被某个下载使用，就等它用完再关，避免读到被复用的fd
+    """
+    
+    def __init__(self, maxsize: int = 128):
+        self._maxsize = maxsize
+        self._entries: "OrderedDict[tuple, _FdEntry]" = OrderedDict()
+        # 路径 -> 当前key，文件被替换/修改后用来找到旧fd并尽早关掉
+        self._keys_by_path: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+    
+    def _retire(self, key: tuple) -> None:
+        """把一项移出缓存，没人在用就立刻关闭fd，调用方需持有锁"""
+        old = self._entries.pop(key)
+        if self._keys_by_path.get(key[0]) == key:
+            del self._keys_by_path[key[0]]
+        old.retired = True
+        if old.refs == 0:
+            os.close(old.fd)
+    
+    def acquire(self, path: Path, file_stat: os.stat_result) -> _FdEntry:
+        """获取（必要时打开）文件的fd，用完必须调用release"""
+        key = (str(path), file_stat.st_dev, file_stat.st_ino, file_stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.refs += 1
+                return entry
+        
+        # 在锁外open，避免慢盘阻塞其他请求拿缓存
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+        new_entry = _FdEntry(fd)
+        new_entry.refs = 1
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # 别的请求抢先打开了，用它的，关掉自己的
+                entry.refs += 1
+                os.close(fd)
+                return entry
+            # 同一路径的旧fd（文件已被替换或修改）不再有用，不等LRU淘汰，
+            # 否则被删掉的旧文件会一直占着磁盘空间
+            old_key = self._keys_by_path.get(key[0])
+            if old_key is not None and old_key in self._entries:
+                self._retire(old_key)
+            self._entries[key] = new_entry
+            self._keys_by_path[key[0]] = key
+            while len(self._entries) > self._maxsize:
+                self._retire(next(iter(self._entries)))
+        return new_entry
+    
+    def release(self, entry: _FdEntry) -> None:
+        """归还fd，如果已经被淘汰且没人用了就关闭"""
+        with self._lock:
+            entry.refs -= 1
+            if entry.retired and entry.refs == 0:
+                os.close(entry.fd)
+
+
+def _fd_cache_size(default: int = 128) -> int:
+    """根据进程的文件描述符上限决定fd缓存大小
+    
+    缓存最多占软上限的1/8，给socket、上传的临时文件等留足余量
+    """
+    try:
+        import resource
+        soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, OSError, ValueError):
+        # Windows没有resource模块
+        return default
+    if soft_limit == resource.RLIM_INFINITY:
+        return default
+    return max(8, min(default, soft_limit // 8))
+
+
+_fd_cache = _FdCache(_fd_cache_size())
+
+# Range区间不用mmap发送：下载期间文件被截断（覆盖上传、删除后重建），
+# 访问映射里已经不存在的页会收到SIGBUS直接把进程打死，os.preadv只会读到EOF
+# POSIX_FADV_WILLNEED只对区间开头这一段提前预读，避免一次把大区间全拉进页缓存
+RANGE_WILLNEED_SIZE = 64 << 20  # 64MB
+
+
+class RangeFileResponse(FileResponse):
+    """206 Partial Content响应，只发送文件的[start, end]区间
+    
+    继承FileResponse，和200分支共用同一套头部逻辑（Last-Modified/ETag等），
+    客户端续传时可以拿ETag做If-Range
+    如果ASGI服务器声明了zero-copy send扩展（http.response.zerocopysend），
+    直接把文件交给服务器用sendfile发送，数据不经过Python用户态
+    否则退回到缓存fd分块发送：os.preadv读进复用的缓冲区，并提示内核顺序预读
+    """
+    
+    chunk_size = 1 << 20  # 1MB 块，大文件时await和系统调用次数都少很多
+    
+    def __init__(
+        self,
+        path: Path,
+        file_stat: os.stat_result,
+        start: int,
+        end: int,
+        headers: Optional[Dict[str, str]] = None,
+        media_type: Optional[str] = None,
+    ):
+        self.file_stat = file_stat
+        self.start = start
+        self.count = end - start + 1
+        # headers里已经带了区间的Content-Length，set_stat_headers只会补上缺的头
+        super().__init__(
+            path,
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            headers=headers,
+            media_type=media_type,
+            stat_result=file_stat,
+        )
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # FileResponse自己的__call__会重新解析Range头，这里区间已经算好了，直接发
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in scope.get("extensions", {}):
+            # 零拷贝：让服务器对fd直接sendfile(offset, count)
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.start,
+                    "count": self.count,
+                    "more_body": False,
+                })
+        else:
+            chunks = self._iter_range()
+            try:
+                async for chunk in chunks:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            finally:
+                # 客户端断开时send会抛异常，确保生成器里的fd及时释放
+                await chunks.aclose()
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        
+        if self.background is not None:
+            await self.background()
+    
+    async def _iter_range(self):
+        """生成指定范围的文件内容"""
+        chunk_size = self.chunk_size
+        remaining = self.count
+        
+        if not hasattr(os, "preadv"):
+            # Windows没有os.preadv，走open/seek，同样读进复用的缓冲区
+            buf = bytearray(min(chunk_size, remaining))
+            mv = memoryview(buf)
+            with open(self.path, "rb", buffering=0) as f:
+                f.seek(self.start)
+                while remaining > 0:
+                    n = f.readinto(mv[:min(len(buf), remaining)])
+                    if not n:
+                        break
+                    yield mv[:n].tobytes()
+                    remaining -= n
+            return
+        
+        entry = _fd_cache.acquire(self.path, self.file_stat)
+        try:
+            # 告诉内核是顺序读，并提前预读区间开头一段
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(entry.fd, self.start, self.count, os.POSIX_FADV_SEQUENTIAL)
+                os.posix_fadvise(entry.fd, self.start, min(self.count, RANGE_WILLNEED_SIZE), os.POSIX_FADV_WILLNEED)
+            
+            # 复用缓存的fd，os.preadv一次系统调用完成定位+读取
+            # 读进预先分配好的缓冲区，不用每块都新分配一次读缓冲
+            buf = bytearray(min(chunk_size, remaining))
+            mv = memoryview(buf)
+            pos = self.start
+            while remaining > 0:
+                n = os.preadv(entry.fd, [mv[:min(len(buf), remaining)]], pos)
+                if n == 0:
+                    break
+                # 发出去的块要是独立的bytes，缓冲区下一轮还要复用
+                yield mv[:n].tobytes()
+                pos += n
+                remaining -= n
+        finally:
+            _fd_cache.release(entry)
+
+
+@lru_cache(maxsize=4096)
+def _file_static_headers(filename: str) -> Tuple[str, Dict[str, str]]:
+    """按文件名缓存MIME类型和不随请求变化的响应头
+    
+    MIME类型和Content-Disposition只取决于文件名，没必要每次请求都重新算
+    返回的字典是缓存里共享的，调用方需要先dict()复制一份再往里加头
+    
+    Args:
+        filename: 文件名（不含路径）
+        
+    Returns:
+        Tuple[str, Dict[str, str]]: (MIME类型, 静态响应头)
+    """
+    mime_type = guess_mime_type(filename)
+    
+    return mime_type, {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": safe_content_disposition(filename),
+    }
+
+
+def _stat_regular_file(target_path: Path) -> os.stat_result:
+    """对目标文件做一次os.stat，同时完成存在性、类型检查
+    
+    以前是exists()、is_file()、stat()各调一次，就是三次stat系统调用
+    这里合成一次，ENOENT当作文件不存在
+    
+    Args:
+        target_path: 已经过路径校验的文件路径
+        
+    Returns:
+        os.stat_result: 文件的stat结果
+        
+    Raises:
+        HTTPException: 文件不存在(404)或不是普通文件(400)
+    """
+    try:
+        file_stat = os.stat(target_path)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+    
+    if not stat_lib.S_ISREG(file_stat.st_mode):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Path is not a file"
+        )
+    
+    return file_stat
+
+
+# Range头"bytes="后面的单区间部分：起始、结束都可以为空（后缀/开放区间）
+_RANGE_SPEC_RE = re.compile(r"\s*(\d*)\s*-\s*(\d*)\s*")
+
+
 def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
     """解析Range头，返回起始和结束位置（包含）
     
@@ -87,11 +374,8 @@ def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[
             detail="Invalid range format, must start with 'bytes='"
         )
     
-    range_spec = range_header[6:]  # 去掉 "bytes="
-    
     # 简化：只处理单区间
-    ranges = range_spec.split(",")
-    if len(ranges) > 1:
+    if "," in range_header:
         # v2: 可支持多区间（返回multipart/byteranges）
         # 为简化，暂时不支持多区间
         raise HTTPException(
@@ -99,43 +383,32 @@ def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[
             detail="Multiple ranges not supported (yet)"
         )
     
-    range_str = ranges[0].strip()
-    
-    try:
-        # 解析区间
-        if range_str.startswith("-"):
+    # 一次正则匹配拿到起止两段数字，从"bytes="后面开始匹配
+    m = _RANGE_SPEC_RE.fullmatch(range_header, 6)
+    if m is not None:
+        start_str, end_str = m.groups()
+        if not start_str:
             # 格式：-500（最后500字节）
-            suffix_length = int(range_str[1:])
-            if suffix_length <= 0 or suffix_length > file_size:
-                raise ValueError()
-            
-            start = file_size - suffix_length
-            end = file_size - 1
-            
-        elif range_str.endswith("-"):
-            # 格式：500-（从500字节到文件末尾）
-            start = int(range_str[:-1])
-            if start < 0 or start >= file_size:
-                raise ValueError()
-            
-            end = file_size - 1
-            
+            if end_str:
+                suffix_length = int(end_str)
+                if 0 < suffix_length <= file_size:
+                    return (file_size - suffix_length, file_size - 1)
         else:
-            # 格式：0-499
-            start_str, end_str = range_str.split("-", 1)
             start = int(start_str)
-            end = int(end_str)
-            
-            if start < 0 or end >= file_size or start > end:
-                raise ValueError()
-        
-        return (start, end)
-        
-    except (ValueError, IndexError):
-        raise HTTPException(
-            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
-            detail=f"Invalid range: {range_str} for file size {file_size}"
-        )
+            if not end_str:
+                # 格式：500-（从500字节到文件末尾）
+                if start < file_size:
+                    return (start, file_size - 1)
+            else:
+                # 格式：0-499
+                end = int(end_str)
+                if start <= end < file_size:
+                    return (start, end)
+    
+    raise HTTPException(
+        status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+        detail=f"Invalid range: {range_header[6:].strip()} for file size {file_size}"
+    )
 
 
 @router.get("/{file_path:path}")
@@ -156,7 +429,7 @@ async def download_file(
         range_header: Range请求头
         
     Returns:
-        FileResponse | StreamingResponse: 文件响应（完整或部分内容）
+        FileResponse | RangeFileResponse: 文件响应（完整或部分内容）
     """
     # 从请求状态获取用户UUID（认证中间件应该已经设置好了）
     user_uuid = getattr(request.state, 'user_uuid', None)
@@ -180,44 +453,35 @@ async def download_file(
         logger.warning(f"用户文件路径验证失败: user={user_uuid}, path={file_path}, error={e.detail}")
         raise
     
-    if not target_path.exists():
-        logger.warning(f"用户文件不存在: user={user_uuid}, path={file_path}")
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="File not found"
-        )
-    
-    if not target_path.is_file():
-        logger.warning(f"路径不是文件: user={user_uuid}, path={file_path}")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Path is not a file"
-        )
-    
-    # 获取文件信息
-    file_size = target_path.stat().st_size
+    # 获取文件信息（一次stat搞定存在性、类型和大小）
+    try:
+        file_stat = _stat_regular_file(target_path)
+    except HTTPException as e:
+        logger.warning(f"用户文件不可下载: user={user_uuid}, path={file_path}, error={e.detail}")
+        raise
+    file_size = file_stat.st_size
     
     # 解析Range头
     range_tuple = parse_range_header(range_header, file_size)
     
+    # MIME类型和静态头（按文件名缓存）
+    mime_type, static_headers = _file_static_headers(target_path.name)
+    headers = dict(static_headers)
+    
     if range_tuple is None:
         # 无Range头，返回完整文件
         logger.info(f"完整下载: {file_path}, size={file_size}")
         
-        # 猜测MIME类型
-        mime_type, _ = mimetypes.guess_type(target_path.name)
-        if not mime_type:
-            mime_type = "application/octet-stream"
+        headers["Content-Length"] = str(file_size)
         
+        # 把已有的stat结果传进去，FileResponse就不用再stat一次
+        # （Uvicorn等支持pathsend扩展时FileResponse会自己走零拷贝）
         return FileResponse(
             path=target_path,
             filename=target_path.name,
             media_type=mime_type,
-            headers={
-                "Content-Length": str(file_size),
-                "Accept-Ranges": "bytes",
-                "Content-Disposition": safe_content_disposition(target_path.name),
-            }
+            headers=headers,
+            stat_result=file_stat,
         )
     
     else:
@@ -227,37 +491,14 @@ async def download_file(
         
         logger.info(f"部分下载: {file_path}, range={start}-{end}, size={content_length}")
         
-        # 构建部分内容响应
-        async def range_content():
-            """生成指定范围的文件内容"""
-            with open(target_path, "rb") as f:
-                f.seek(start)
-                remaining = content_length
-                chunk_size = 8192  # 8KB 块
-                
-                while remaining > 0:
-                    read_size = min(chunk_size, remaining)
-                    chunk = f.read(read_size)
-                    if not chunk:
-                        break
-                    yield chunk
-                    remaining -= len(chunk)
-        
-        # 猜测MIME类型
-        mime_type, _ = mimetypes.guess_type(target_path.name)
-        if not mime_type:
-            mime_type = "application/octet-stream"
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+        headers["Content-Length"] = str(content_length)
         
-        headers = {
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
-            "Content-Length": str(content_length),
-            "Accept-Ranges": "bytes",
-            "Content-Disposition": safe_content_disposition(target_path.name),
-        }
-        
-        return StreamingResponse(
-            content=range_content(),
-            status_code=status.HTTP_206_PARTIAL_CONTENT,
+        return RangeFileResponse(
+            path=target_path,
+            file_stat=file_stat,
+            start=start,
+            end=end,
             media_type=mime_type,
             headers=headers,
         )
@@ -302,36 +543,20 @@ async def get_file_metadata(
         logger.warning(f"用户文件路径验证失败(HEAD): user={user_uuid}, path={file_path}, error={e.detail}")
         raise
     
-    if not target_path.exists():
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="File not found"
-        )
-    
-    if not target_path.is_file():
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Path is not a file"
-        )
-    
-    # 获取文件信息
-    file_size = target_path.stat().st_size
+    # 获取文件信息（一次stat搞定存在性、类型和大小）
+    file_size = _stat_regular_file(target_path).st_size
     
-    # 猜测MIME类型
-    mime_type, _ = mimetypes.guess_type(target_path.name)
-    if not mime_type:
-        mime_type = "application/octet-stream"
+    # MIME类型和静态头（按文件名缓存）
+    mime_type, static_headers = _file_static_headers(target_path.name)
+    headers = dict(static_headers)
+    headers["Content-Length"] = str(file_size)
+    headers["Content-Type"] = mime_type
     
     logger.info(f"文件元数据查询: {file_path}, size={file_size}")
     
     return Response(
         status_code=status.HTTP_200_OK,
-        headers={
-            "Content-Length": str(file_size),
-            "Accept-Ranges": "bytes",
-            "Content-Type": mime_type,
-            "Content-Disposition": safe_content_disposition(target_path.name),
-        }
+        headers=headers,
     )
 
 
@@ -25,11 +25,13 @@ along with this program.  If not, see <https://www.gnu.org/licenses/  >.
 FastAPI应用初始化、中间件设置、路由注册
 """
 
+import asyncio
 import logging
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
-from config import ensure_dirs, LOG_LEVEL, LOG_FORMAT
+from config import ensure_dirs, LOG_LEVEL, LOG_FORMAT, USERS_REDIS_URL, UPLOAD_REDIS_URL
+from api.utils.redis_client import get_redis
 from auth import AuthMiddleware
 from upload import router as upload_router
 from download import router as download_router
@@ -57,6 +59,10 @@ app = FastAPI(
 ensure_dirs()
 logger.info("初始化目录结构完成")
 
+# 配置了Redis的话启动时就创建客户端，没装redis库直接启动失败，不要悄悄用本地存储
+get_redis(USERS_REDIS_URL)
+get_redis(UPLOAD_REDIS_URL)
+
 # 添加CORS中间件（允许前端跨域访问）
 # 修改：明确指定允许的源，并添加预检请求处理
 app.add_middleware(
@@ -162,8 +168,8 @@ async def test_token(request: Request):
             "message": "Missing authentication headers. Use format: {\"Id\": uuid, \"Totp\": totp} or headers: Id, Totp"
         }
     
-    # 使用新的TOTP验证函数
-    is_valid = verify_totp(uuid_str, totp_code)
+    # 使用新的TOTP验证函数（可能要查Redis，放到线程池里跑）
+    is_valid = await asyncio.to_thread(verify_totp, uuid_str, totp_code)
     
     if is_valid:
         return {
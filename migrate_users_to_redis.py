@@ -0,0 +1,23 @@
+"""
+把 storage/users.json 里的用户导入Redis
+
+用法：
+    CAMFC_USERS_REDIS_URL=redis://localhost:6379/0 python migrate_users_to_redis.py
+
+导入之后服务端用同样的环境变量启动，就会从Redis读用户数据
+users.json不会被删除，可以留着当备份
+"""
+
+import logging
+import sys
+
+from user_auth import migrate_users_to_redis
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        count = migrate_users_to_redis()
+    except Exception as e:
+        print(f"导入失败: {e}")
+        sys.exit(1)
+    print(f"导入完成，共 {count} 个用户")
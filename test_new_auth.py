@@ -77,6 +77,18 @@ def test_authentication():
         except Exception as e:
             print(f"   请求失败: {e}")
         
+        # 测试非ASCII的TOTP码（应该是401，不能变成500）
+        print("\n5. 测试非ASCII的TOTP码...")
+        for headers_non_ascii in (
+            {"Id": uuid, "Totp": "12345\xe9"},
+            {"Authorization": json.dumps({"Id": uuid, "Totp": "中文"})},
+        ):
+            try:
+                response = requests.get("http://localhost:8005/files/", headers=headers_non_ascii)
+                print(f"   非ASCII TOTP码: {'通过' if response.status_code == 401 else '失败'} (状态码 {response.status_code})")
+            except Exception as e:
+                print(f"   请求失败: {e}")
+        
         return uuid, totp_key
         
     except Exception as e:
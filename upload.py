@@ -25,27 +25,217 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 实现分片上传、断点续传功能
 """
 
+import asyncio
+import errno
 import logging
 import hashlib
+import mmap
+import os
 import shutil
 import uuid
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, status, Query, Request
 from fastapi.responses import JSONResponse
 
-from config import UPLOAD_DIR, STORAGE_DIR, CHUNK_SIZE, ensure_dirs, get_user_storage_dir
+from config import UPLOAD_DIR, STORAGE_DIR, CHUNK_SIZE, UPLOAD_REDIS_URL, UPLOAD_SESSION_TTL, ensure_dirs, get_user_storage_dir
 from api.utils.path_utils import validate_user_path
+from api.utils.hash_index import hash_index
+from api.utils.name_index import name_index
+from api.utils.redis_client import get_redis
+from api.file_operations.browse import invalidate_storage_stats
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/upload", tags=["upload"])
 
 # 内存中的上传状态跟踪（v1: 简单实现，重启后状态丢失）
-# v2: 可考虑使用Redis或数据库持久化上传状态
+# 配置了UPLOAD_REDIS_URL时改存到Redis里（多个worker进程共享），这个字典就不用了
 upload_status: Dict[str, Dict] = {}
 
+# Redis里的上传会话：<前缀><upload_id> 是存元数据的hash，<前缀><upload_id>:bits 是已上传分片的位图
+UPLOAD_REDIS_KEY_PREFIX = "camfc:upload:"
+
+# 分片索引上限（位图按最大索引分配，限制住免得一个离谱的索引分配出巨大的位图；4MB分片时约4TB）
+UPLOAD_MAX_CHUNKS = 1 << 20
+
+# 保存/合并分片时每次读多少（1MB，比默认的小缓冲区系统调用少得多）
+MERGE_READ_SIZE = 1024 * 1024
+# 合并分片时尽量在内核里拷数据（copy_file_range是Linux的，sendfile大部分Unix都有）
+_HAS_COPY_FILE_RANGE = hasattr(os, "copy_file_range")
+_HAS_SENDFILE = hasattr(os, "sendfile")
+
+
+def _upload_redis():
+    """上传会话用的Redis客户端，没启用时返回None（存在upload_status字典里）"""
+    return get_redis(UPLOAD_REDIS_URL)
+
+
+def _bitmap_set(bitmap: bytearray, index: int) -> None:
+    """位图里把第index位置1，不够长就在后面补0
+    
+    位序和Redis的SETBIT一样：第0位是第0个字节的最高位
+    """
+    byte = index >> 3
+    if byte >= len(bitmap):
+        bitmap.extend(bytes(byte + 1 - len(bitmap)))
+    bitmap[byte] |= 0x80 >> (index & 7)
+
+
+def _bitmap_get(bitmap: bytes, index: int) -> bool:
+    """位图里第index位是不是1"""
+    byte = index >> 3
+    return byte < len(bitmap) and bool(bitmap[byte] & (0x80 >> (index & 7)))
+
+
+def _bitmap_indices(bitmap: bytes) -> List[int]:
+    """位图里所有为1的位的编号（从小到大）"""
+    return [
+        (byte << 3) + bit
+        for byte, value in enumerate(bitmap) if value
+        for bit in range(8) if value & (0x80 >> bit)
+    ]
+
+
+def _bitmap_complete(bitmap: bytes, total_chunks: int) -> bool:
+    """位图是不是正好第0到total_chunks-1位都是1、其余都是0"""
+    nbits = len(bitmap) * 8
+    if total_chunks > nbits:
+        return False
+    value = int.from_bytes(bitmap, "big")
+    # 总共total_chunks个1，而且都在前total_chunks位里
+    return (value.bit_count() == total_chunks
+            and (value >> (nbits - total_chunks)).bit_count() == total_chunks)
+
+
+def _create_session(upload_id: str, upload_path: Path) -> Dict:
+    """新建上传会话
+    
+    Args:
+        upload_id: 上传会话ID
+        upload_path: 分片存放目录
+        
+    Returns:
+        Dict: 会话状态（upload_path, created_at, total_chunks，本地存储时还有chunk_bitmap）
+    """
+    session = {
+        "upload_path": upload_path,
+        "created_at": datetime.now().isoformat(),
+        "total_chunks": None,
+    }
+    
+    client = _upload_redis()
+    if client is None:
+        session["chunk_bitmap"] = bytearray()  # 已上传分片的位图，每个分片1位
+        upload_status[upload_id] = session
+        return session
+    
+    key = UPLOAD_REDIS_KEY_PREFIX + upload_id
+    pipe = client.pipeline()
+    pipe.hset(key, mapping={
+        "upload_path": str(upload_path),
+        "created_at": session["created_at"],
+        "total_chunks": "",
+    })
+    pipe.expire(key, UPLOAD_SESSION_TTL)
+    pipe.execute()
+    return session
+
+
+def _get_session(upload_id: str) -> Optional[Dict]:
+    """取上传会话，不存在（或已过期）返回None
+    
+    Args:
+        upload_id: 上传会话ID
+        
+    Returns:
+        Optional[Dict]: 会话状态
+    """
+    client = _upload_redis()
+    if client is None:
+        return upload_status.get(upload_id)
+    
+    key = UPLOAD_REDIS_KEY_PREFIX + upload_id
+    meta = client.hgetall(key)
+    if not meta:
+        return None
+    total_chunks = meta.get("total_chunks")
+    return {
+        "upload_path": Path(meta["upload_path"]),
+        "created_at": meta.get("created_at"),
+        "total_chunks": int(total_chunks) if total_chunks else None,
+    }
+
+
+def _is_chunk_uploaded(upload_id: str, session: Dict, index: int) -> bool:
+    """某个分片是否已经上传过"""
+    client = _upload_redis()
+    if client is None:
+        return _bitmap_get(session["chunk_bitmap"], index)
+    return bool(client.getbit(UPLOAD_REDIS_KEY_PREFIX + upload_id + ":bits", index))
+
+
+def _mark_chunk_uploaded(upload_id: str, session: Dict, index: int) -> None:
+    """记录分片已上传（Redis里顺便续一下会话的过期时间）"""
+    client = _upload_redis()
+    if client is None:
+        _bitmap_set(session["chunk_bitmap"], index)
+        return
+    
+    key = UPLOAD_REDIS_KEY_PREFIX + upload_id
+    pipe = client.pipeline()
+    pipe.setbit(key + ":bits", index, 1)
+    pipe.expire(key + ":bits", UPLOAD_SESSION_TTL)
+    pipe.expire(key, UPLOAD_SESSION_TTL)
+    pipe.execute()
+
+
+def _uploaded_chunks(upload_id: str, session: Dict) -> List[int]:
+    """已上传的分片索引列表（从小到大）"""
+    client = _upload_redis()
+    if client is None:
+        return _bitmap_indices(session["chunk_bitmap"])
+    # 位图是二进制值，要用不解码的客户端取（和解码的客户端一起创建，能用就都能用）
+    raw_client = get_redis(UPLOAD_REDIS_URL, decode_responses=False)
+    return _bitmap_indices(raw_client.get(UPLOAD_REDIS_KEY_PREFIX + upload_id + ":bits") or b"")
+
+
+def _chunks_complete(upload_id: str, session: Dict, total_chunks: int) -> bool:
+    """是不是正好0到total_chunks-1这些分片都传了（没有缺的也没有多的）"""
+    client = _upload_redis()
+    if client is None:
+        return _bitmap_complete(session["chunk_bitmap"], total_chunks)
+    
+    # BITCOUNT数1的个数，BITPOS找第一个0：个数对、而且前total_chunks位没有0，就是齐了
+    bits_key = UPLOAD_REDIS_KEY_PREFIX + upload_id + ":bits"
+    pipe = client.pipeline()
+    pipe.bitcount(bits_key)
+    pipe.bitpos(bits_key, 0)
+    count, first_zero = pipe.execute()
+    return count == total_chunks and (total_chunks == 0 or first_zero >= total_chunks)
+
+
+async def _session_call(func, *args):
+    """在请求处理函数里调用上面这些会话函数
+    
+    用Redis时它们是阻塞的网络请求，放到线程池里跑，不卡事件循环；
+    用本地字典时直接在事件循环里调用（很快，而且位图只在事件循环线程里改，不用加锁）
+    """
+    if _upload_redis() is None:
+        return func(*args)
+    return await asyncio.to_thread(func, *args)
+
+
+def _delete_session(upload_id: str) -> None:
+    """删除上传会话"""
+    client = _upload_redis()
+    if client is None:
+        upload_status.pop(upload_id, None)
+        return
+    key = UPLOAD_REDIS_KEY_PREFIX + upload_id
+    client.delete(key, key + ":bits")
+
 
 @router.post("/init")
 async def init_upload() -> JSONResponse:
@@ -65,12 +255,7 @@ async def init_upload() -> JSONResponse:
     upload_path.mkdir(parents=True, exist_ok=True)
     
     # 初始化状态
-    upload_status[upload_id] = {
-        "upload_path": upload_path,
-        "uploaded_chunks": set(),  # 已上传的分片索引
-        "created_at": datetime.now().isoformat(),
-        "total_chunks": None,
-    }
+    await _session_call(_create_session, upload_id, upload_path)
     
     logger.info(f"上传初始化: upload_id={upload_id}")
     
@@ -78,16 +263,34 @@ async def init_upload() -> JSONResponse:
         status_code=status.HTTP_200_OK,
         content={
             "upload_id": upload_id,
-            "uploaded_chunks": list(upload_status[upload_id]["uploaded_chunks"]),
+            "uploaded_chunks": [],
             "message": "Upload initialized successfully"
         }
     )
 
 
+def _write_chunk(src, chunk_path: Path) -> int:
+    """把上传的分片从临时文件拷到磁盘
+    
+    UploadFile底层是SpooledTemporaryFile，按1MB一块拷过去，
+    不用先await file.read()把整个分片读成bytes，并发上传时内存占用小很多
+    
+    Args:
+        src: 上传文件的底层文件对象（UploadFile.file）
+        chunk_path: 分片保存路径
+        
+    Returns:
+        int: 写入的字节数
+    """
+    with open(chunk_path, "wb") as f:
+        shutil.copyfileobj(src, f, MERGE_READ_SIZE)
+        return f.tell()
+
+
 @router.post("/chunk")
 async def upload_chunk(
     upload_id: str = Query(..., description="上传会话ID"),
-    index: int = Query(..., description="分片索引，从0开始"),
+    index: int = Query(..., ge=0, lt=UPLOAD_MAX_CHUNKS, description="分片索引，从0开始"),
     file: UploadFile = File(...),
 ) -> JSONResponse:
     """上传单个分片
@@ -104,17 +307,17 @@ async def upload_chunk(
         JSONResponse: 上传结果
     """
     # 验证upload_id
-    if upload_id not in upload_status:
+    status_info = await _session_call(_get_session, upload_id)
+    if status_info is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Upload session not found or expired"
         )
     
-    status_info = upload_status[upload_id]
     upload_path: Path = status_info["upload_path"]
     
     # 检查是否已上传（断点续传支持）
-    if index in status_info["uploaded_chunks"]:
+    if await _session_call(_is_chunk_uploaded, upload_id, status_info, index):
         logger.info(f"分片已存在，跳过: upload_id={upload_id}, chunk={index}")
         return JSONResponse(
             status_code=status.HTTP_200_OK,
@@ -130,35 +333,35 @@ async def upload_chunk(
     chunk_path = upload_path / chunk_filename
     
     try:
-        # 读取分片数据
-        content = await file.read()
+        # 分片数据直接从上传的临时文件拷到磁盘，不先整个读进内存
+        # 在线程池里写，大分片写盘时不阻塞事件循环（其他请求照常处理）
+        chunk_size = await asyncio.to_thread(_write_chunk, file.file, chunk_path)
         
         # 验证分片大小（不超过CHUNK_SIZE）
-        if len(content) > CHUNK_SIZE:
+        if chunk_size > CHUNK_SIZE:
+            chunk_path.unlink(missing_ok=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Chunk size exceeds limit ({CHUNK_SIZE} bytes)"
             )
         
-        # 保存分片到磁盘
-        with open(chunk_path, "wb") as f:
-            f.write(content)
-        
         # 更新状态
-        status_info["uploaded_chunks"].add(index)
+        await _session_call(_mark_chunk_uploaded, upload_id, status_info, index)
         
-        logger.info(f"分片上传成功: upload_id={upload_id}, chunk={index}/{len(content)} bytes")
+        logger.info(f"分片上传成功: upload_id={upload_id}, chunk={index}/{chunk_size} bytes")
         
         return JSONResponse(
             status_code=status.HTTP_200_OK,
             content={
                 "upload_id": upload_id,
                 "chunk": index,
-                "size": len(content),
+                "size": chunk_size,
                 "message": "Chunk uploaded successfully"
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"分片上传失败: upload_id={upload_id}, chunk={index}, error={e}")
         raise HTTPException(
@@ -167,6 +370,154 @@ async def upload_chunk(
         )
 
 
+def _copy_fd_range(src_fd: int, dst_fd: int, size: int) -> None:
+    """从src_fd当前位置拷size字节到dst_fd当前位置
+    
+    优先用copy_file_range（数据不经过用户态，支持reflink的文件系统上直接共享数据块），
+    不支持时退回sendfile（同样在内核里拷），再不行才用read/write循环
+    两个fd的文件位置都会跟着往后移
+    """
+    remaining = size
+    
+    if _HAS_COPY_FILE_RANGE:
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError as e:
+            # 跨文件系统(EXDEV)、内核/文件系统不支持等，换下一种方式接着拷
+            logger.debug(f"copy_file_range不可用，改用其他方式: {e}")
+        if remaining == 0:
+            return
+    
+    if _HAS_SENDFILE:
+        try:
+            while remaining > 0:
+                copied = os.sendfile(dst_fd, src_fd, None, remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError as e:
+            # 有些平台sendfile的目标只能是socket
+            logger.debug(f"sendfile不可用，改用read/write: {e}")
+        if remaining == 0:
+            return
+    
+    while remaining > 0:
+        buf = os.read(src_fd, min(MERGE_READ_SIZE, remaining))
+        if not buf:
+            break
+        view = memoryview(buf)
+        while view:
+            written = os.write(dst_fd, view)
+            view = view[written:]
+        remaining -= len(buf)
+
+
+def _merge_chunks(upload_path: Path, total_chunks: int, final_path: Path) -> str:
+    """按顺序把分片合并成最终文件，同时算SHA256
+    
+    每个分片mmap之后直接喂给hashlib（读页缓存，不拷到用户态缓冲区），
+    再用_copy_fd_range在内核里拷到最终文件，数据不在Python里来回搬
+    整个文件只算一遍哈希，不用合并完再重新读一遍
+    只有一个分片时不拷贝，算完哈希直接把分片rename成final_path
+    
+    Args:
+        upload_path: 分片所在的临时目录
+        total_chunks: 总分片数
+        final_path: 合并后的文件路径（在分片目录里，和分片在同一个文件系统上）
+        
+    Returns:
+        str: 合并后文件的SHA256（十六进制）
+    """
+    sha256_hash = hashlib.sha256()
+    
+    if total_chunks == 1:
+        # 只有一个分片（小文件最常见）：算完哈希直接把分片rename过去，不用再拷一遍
+        chunk_path = upload_path / "chunk_0000"
+        with open(chunk_path, "rb") as chunk_file:
+            chunk_fd = chunk_file.fileno()
+            if os.fstat(chunk_fd).st_size:
+                with mmap.mmap(chunk_fd, 0, access=mmap.ACCESS_READ) as mm:
+                    sha256_hash.update(mm)
+        # 合并目标就在分片目录里，rename一定在同一个文件系统上
+        os.replace(chunk_path, final_path)
+        return sha256_hash.hexdigest()
+    
+    with open(final_path, "wb") as output_file:
+        # 只通过fd写，不经过output_file的缓冲区
+        output_fd = output_file.fileno()
+        for i in range(total_chunks):
+            chunk_filename = f"chunk_{i:04d}"
+            chunk_path = upload_path / chunk_filename
+            
+            with open(chunk_path, "rb") as chunk_file:
+                chunk_fd = chunk_file.fileno()
+                size = os.fstat(chunk_fd).st_size
+                if size:
+                    # 空文件没法mmap
+                    with mmap.mmap(chunk_fd, 0, access=mmap.ACCESS_READ) as mm:
+                        sha256_hash.update(mm)
+                    _copy_fd_range(chunk_fd, output_fd, size)
+            
+            logger.debug(f"合并分片: {i+1}/{total_chunks}")
+    
+    return sha256_hash.hexdigest()
+
+
+def _final_filename(filename: str, attempt: int) -> str:
+    """第attempt次尝试用的文件名：第0次就是原名，之后加时间戳和序号后缀（防覆盖）"""
+    if attempt == 0:
+        return filename
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    name_parts = filename.rsplit(".", 1)
+    if len(name_parts) == 2:
+        name, ext = name_parts
+        return f"{name}_{timestamp}_{attempt}.{ext}"
+    return f"{filename}_{timestamp}_{attempt}"
+
+
+def _place_merged_file(tmp_path: Path, dest_dir: Path, filename: str) -> Path:
+    """把合并好的临时文件放到目标目录下，重名时换成带时间戳的名字
+    
+    不先exists()挨个探测，而是用O_EXCL直接占住文件名（检查和创建是一步原子操作），
+    占到了再os.replace过去；同名文件同时完成上传也不会互相覆盖，
+    不重名时只要一次open加一次rename
+    上传目录和存储目录不在同一个文件系统上时rename不了，退回到拷贝
+    
+    Args:
+        tmp_path: 合并好的临时文件（在上传会话的分片目录里）
+        dest_dir: 目标目录
+        filename: 原始文件名
+        
+    Returns:
+        Path: 文件最终的路径
+    """
+    attempt = 0
+    while True:
+        final_path = dest_dir / _final_filename(filename, attempt)
+        try:
+            fd = os.open(final_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            attempt += 1
+            continue
+        os.close(fd)
+        try:
+            try:
+                os.replace(tmp_path, final_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.move(str(tmp_path), str(final_path))
+        except BaseException:
+            # 放不过去的话把占位的空文件删掉
+            final_path.unlink(missing_ok=True)
+            raise
+        return final_path
+
+
 @router.post("/finish")
 async def finish_upload(
     request: Request,
@@ -193,7 +544,8 @@ async def finish_upload(
         JSONResponse: 包含文件ID和存储路径
     """
     # 验证upload_id
-    if upload_id not in upload_status:
+    status_info = await _session_call(_get_session, upload_id)
+    if status_info is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Upload session not found or expired"
@@ -211,15 +563,12 @@ async def finish_upload(
             detail="User authentication missing"
         )
     
-    status_info = upload_status[upload_id]
     upload_path: Path = status_info["upload_path"]
     
-    # 验证是否所有分片都已上传
-    uploaded_chunks = status_info["uploaded_chunks"]
-    expected_chunks = set(range(total_chunks))
-    
-    if uploaded_chunks != expected_chunks:
-        missing = expected_chunks - uploaded_chunks
+    # 验证是否所有分片都已上传（位图计数，齐了就不用把索引一个个取出来）
+    if not await _session_call(_chunks_complete, upload_id, status_info, total_chunks):
+        uploaded = await _session_call(_uploaded_chunks, upload_id, status_info)
+        missing = set(range(total_chunks)) - set(uploaded)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Missing chunks: {sorted(missing)}"
@@ -241,51 +590,31 @@ async def finish_upload(
         else:
             dest_dir = user_storage_dir
         
-        # 确定最终文件名（防覆盖）
-        final_filename = filename
-        final_path = dest_dir / final_filename
-        
-        # 如果文件已存在，添加时间戳后缀
-        counter = 1
-        while final_path.exists():
-            name_parts = filename.rsplit(".", 1)
-            if len(name_parts) == 2:
-                name, ext = name_parts
-                final_filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{counter}.{ext}"
-            else:
-                final_filename = f"{filename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{counter}"
-            
-            final_path = dest_dir / final_filename
-            counter += 1
-        
-        # 合并分片
-        with open(final_path, "wb") as output_file:
-            for i in range(total_chunks):
-                chunk_filename = f"chunk_{i:04d}"
-                chunk_path = upload_path / chunk_filename
-                
-                with open(chunk_path, "rb") as chunk_file:
-                    shutil.copyfileobj(chunk_file, output_file)
-                
-                logger.debug(f"合并分片: {i+1}/{total_chunks}")
+        # 先合并到上传会话自己的分片目录里，合并完再原子地放到最终文件名上（重名时加时间戳后缀）
+        # 合并过程中目标目录里看不到半截文件（列表、搜索、打包下载都不会碰到），
+        # 中途崩溃留下的也只是上传目录里的临时文件
+        tmp_path = upload_path / "merged"
         
-        # 计算文件SHA256哈希作为文件ID
-        sha256_hash = hashlib.sha256()
-        with open(final_path, "rb") as f:
-            # 分块读取大文件
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(chunk)
+        # 合并分片，同时算SHA256作为文件ID
+        # 合并要把整个文件读写一遍，放到线程池里跑，不阻塞事件循环
+        file_id = await asyncio.to_thread(_merge_chunks, upload_path, total_chunks, tmp_path)
+        final_path = await asyncio.to_thread(_place_merged_file, tmp_path, dest_dir, filename)
+        final_filename = final_path.name
+        final_stat = final_path.stat()
         
-        file_id = sha256_hash.hexdigest()
+        # 记到哈希索引里，之后按文件ID查找时不用再扫描整个目录
+        hash_index.record(final_path, file_id, final_stat)
+        name_index.add(user_storage_dir, final_path)
+        invalidate_storage_stats(user_storage_dir)
         
         # 清理临时文件
         try:
-            shutil.rmtree(upload_path)
-            del upload_status[upload_id]  # 移除状态
+            await asyncio.to_thread(shutil.rmtree, upload_path)
+            await _session_call(_delete_session, upload_id)  # 移除状态
         except Exception as e:
             logger.warning(f"清理临时文件失败: {upload_path}, error={e}")
         
-        logger.info(f"上传完成: user={user_uuid}, upload_id={upload_id}, file_id={file_id}, size={final_path.stat().st_size}")
+        logger.info(f"上传完成: user={user_uuid}, upload_id={upload_id}, file_id={file_id}, size={final_stat.st_size}")
         
         return JSONResponse(
             status_code=status.HTTP_200_OK,
@@ -293,7 +622,7 @@ async def finish_upload(
                 "file_id": file_id,
                 "filename": final_filename,
                 "original_filename": filename,
-                "size": final_path.stat().st_size,
+                "size": final_stat.st_size,
                 "sha256": file_id,
                 "user_uuid": user_uuid,  # 返回用户UUID，客户端可能需要知道
                 "message": "File uploaded and merged successfully"
@@ -320,19 +649,20 @@ async def get_upload_status(upload_id: str) -> JSONResponse:
     Returns:
         JSONResponse: 上传状态信息
     """
-    if upload_id not in upload_status:
+    status_info = await _session_call(_get_session, upload_id)
+    if status_info is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Upload session not found or expired"
         )
     
-    status_info = upload_status[upload_id]
+    uploaded_chunks = await _session_call(_uploaded_chunks, upload_id, status_info)
     
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content={
             "upload_id": upload_id,
-            "uploaded_chunks": sorted(status_info["uploaded_chunks"]),
+            "uploaded_chunks": uploaded_chunks,
             "created_at": status_info["created_at"],
             "total_chunks": status_info["total_chunks"],
         }
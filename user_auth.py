@@ -2,21 +2,81 @@
 用户认证管理模块
 用于管理UUID和TOTP密钥的对应关系
 存储格式：{uuid: totp_raw_key} 的JSON文件
+配置了CAMFC_USERS_REDIS_URL时改存到Redis的hash里（见config.USERS_REDIS_URL）
 """
 
+import atexit
+import hmac
 import json,time
 import os
 import logging
+import threading
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 import uuid as uuid_lib
 
+from config import USERS_REDIS_URL, USERS_REDIS_KEY
+from api.utils.redis_client import get_redis
+
+# 用户多的时候读写users.json主要花在JSON编解码上，有orjson就用它（可选依赖，没装用标准库json）
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 # 存储用户认证数据的文件路径
 # 放在storage目录下，这样备份的时候能一起备份
 USERS_FILE = Path(__file__).parent.absolute() / "storage" / "users.json"
 
+# 用户数据的内存缓存，每个鉴权请求都要查，不能每次都重新读文件解析JSON
+# 缓存对应文件的(mtime_ns, size)，文件被外部改了（比如手动编辑）就重新加载
+_users_cache: Optional[Dict[str, str]] = None
+_users_file_sig: Optional[Tuple[int, int]] = None
+# 保护缓存和"读-改-写"用户文件的过程，FastAPI会在多个线程里并发调用
+_users_lock = threading.RLock()
+
+# 用户文件的写入合并：add_user/delete_user先改内存缓存，
+# 两次写文件至少间隔USERS_FLUSH_INTERVAL秒，间隔内的修改攒起来一起写
+# （一大批用户同时注册时不用每个都把整个文件重写一遍；离上次写入够久的修改还是立即写）
+USERS_FLUSH_INTERVAL = 0.5
+_users_dirty = False  # 缓存里有还没写进文件的修改
+_users_last_flush = 0.0  # 上次写文件的时间（time.monotonic）
+_users_flush_timer: Optional[threading.Timer] = None
+
+# 用户数据的版本号（文件存储时用）：本进程增删改了用户、或者重新读到了被外部改过的users.json就加1
+# 鉴权结果的缓存把它放进key里，用户被删除或者换了密钥之后，之前缓存的验证结果马上作废
+_users_generation = 0
+
+# Redis里用户数据的版本号计数器，所有worker共用（增删改用户时INCR）
+USERS_GENERATION_REDIS_KEY = USERS_REDIS_KEY + ":generation"
+
+# TOTP时间步长（秒），和utotp.generate_totp默认值一致
+TOTP_TIME_STEP = 30
+# TOTP码位数，和utotp.generate_totp默认值一致
+TOTP_DIGITS = 6
+# 用户ID最长多少（create_new_user生成的是36位UUID），超长的直接当验证失败
+USER_ID_MAX_LENGTH = 128
+# Redis里缓存TOTP验证结果的key前缀，完整key是 前缀+uuid:totp码
+TOTP_CACHE_KEY_PREFIX = "camfc:totp:"
+# 验证失败的结果缓存几秒
+TOTP_NEGATIVE_CACHE_TTL = 5
+
+
+def _get_redis():
+    """取用户数据用的Redis客户端，没启用Redis存储时返回None
+    
+    配置了USERS_REDIS_URL就一直用Redis，否则一直用users.json，运行中不会切换（免得两边数据不一致）
+    Redis暂时连不上时各个操作按失败处理（查不到用户、保存失败），恢复后自动重连
+    """
+    return get_redis(USERS_REDIS_URL)
+
+
+def users_use_redis() -> bool:
+    """用户数据是不是存在Redis里（是的话查用户要走网络，异步代码里应该放到线程池调用）"""
+    return bool(USERS_REDIS_URL)
+
 
 def ensure_users_file() -> None:
     """确保用户数据文件存在，如果不存在就创建个空的"""
@@ -31,15 +91,24 @@ def ensure_users_file() -> None:
         logger.info(f"创建空的用户数据文件: {USERS_FILE}")
 
 
-def load_users() -> Dict[str, str]:
-    """加载用户数据
-    返回字典：{uuid: totp_raw_key}
-    """
-    ensure_users_file()
-    
+def _users_file_signature() -> Optional[Tuple[int, int]]:
+    """用户数据文件的(mtime_ns, size)，文件不存在返回None"""
     try:
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        st = os.stat(USERS_FILE)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _read_users_file() -> Dict[str, str]:
+    """真正读取并解析用户数据文件"""
+    try:
+        if orjson is not None:
+            with open(USERS_FILE, 'rb') as f:
+                data = orjson.loads(f.read())
+        else:
+            with open(USERS_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
         
         # 做个类型检查，确保是字典格式
         if not isinstance(data, dict):
@@ -47,7 +116,7 @@ def load_users() -> Dict[str, str]:
             return {}
         
         return data
-    except json.JSONDecodeError as e:
+    except json.JSONDecodeError as e:  # orjson.JSONDecodeError是它的子类
         logger.error(f"解析用户数据JSON失败: {e}")
         return {}
     except Exception as e:
@@ -55,57 +124,258 @@ def load_users() -> Dict[str, str]:
         return {}
 
 
+def load_users() -> Dict[str, str]:
+    """加载用户数据
+    返回字典：{uuid: totp_raw_key}
+    
+    启用了Redis存储时直接HGETALL
+    用文件存储时走内存缓存，只有文件的修改时间或大小变了才重新读，平时只多一次stat
+    注意返回的可能是缓存本身，调用方不要直接改它（要改用add_user/delete_user）
+    """
+    global _users_cache, _users_file_sig, _users_generation
+    
+    client = _get_redis()
+    if client is not None:
+        try:
+            return client.hgetall(USERS_REDIS_KEY)
+        except Exception as e:
+            logger.error(f"从Redis读取用户数据失败: {e}")
+            return {}
+    
+    if _users_dirty:
+        # 有修改还没写进文件，缓存比文件新
+        return _users_cache
+    
+    sig = _users_file_signature()
+    if sig is not None and sig == _users_file_sig and _users_cache is not None:
+        return _users_cache
+    
+    with _users_lock:
+        if _users_dirty:
+            return _users_cache
+        if sig is None:
+            ensure_users_file()
+        # 先取签名再读，读的过程中文件又被改了的话，下次签名对不上会再读一遍
+        sig = _users_file_signature()
+        if sig == _users_file_sig and _users_cache is not None:
+            return _users_cache
+        _users_cache = _read_users_file()
+        _users_generation += 1
+        _users_file_sig = sig
+        return _users_cache
+
+
 def save_users(users: Dict[str, str]) -> bool:
     """保存用户数据到文件
     返回是否成功
+    
+    保存成功后内存缓存直接换成这份数据，不用下次再读文件
     """
-    try:
-        # 先确保文件存在
-        ensure_users_file()
-        
-        # 写文件
-        with open(USERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(users, f, indent=2, ensure_ascii=False)
-        
-        logger.debug(f"用户数据已保存，共 {len(users)} 个用户")
+    global _users_cache, _users_file_sig, _users_dirty, _users_last_flush, _users_generation
+    
+    with _users_lock:
+        try:
+            USERS_FILE.parent.mkdir(parents=True, exist_ok=True)
+            
+            # 先写临时文件并落盘，再原子替换：中途崩溃或者写失败时原文件不受影响，
+            # 别的进程读到的要么是旧文件要么是新文件，不会读到写了一半的JSON
+            tmp_path = USERS_FILE.with_suffix('.json.tmp')
+            with open(tmp_path, 'wb') as f:
+                if orjson is not None:
+                    # 格式和json.dump(indent=2, ensure_ascii=False)一样
+                    f.write(orjson.dumps(users, option=orjson.OPT_INDENT_2))
+                else:
+                    f.write(json.dumps(users, indent=2, ensure_ascii=False).encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, USERS_FILE)
+            
+            _users_cache = dict(users)
+            _users_generation += 1
+            _users_file_sig = _users_file_signature()
+            _users_dirty = False
+            _users_last_flush = time.monotonic()
+            logger.debug(f"用户数据已保存，共 {len(users)} 个用户")
+            return True
+        except Exception as e:
+            # 原文件没动过，缓存也不用作废（有没写进去的修改时留在缓存里，之后再重试写）
+            logger.error(f"保存用户数据失败: {e}")
+            return False
+
+
+def flush_users() -> bool:
+    """把缓存里还没写进文件的用户修改写进去
+    
+    Returns:
+        bool: 是否成功（没有要写的也算成功）
+    """
+    global _users_flush_timer
+    
+    with _users_lock:
+        if _users_flush_timer is not None:
+            _users_flush_timer.cancel()
+            _users_flush_timer = None
+        if not _users_dirty:
+            return True
+        if save_users(_users_cache):
+            return True
+        # 写失败了，过一会儿再试
+        _schedule_flush(USERS_FLUSH_INTERVAL)
+        return False
+
+
+def _schedule_flush(delay: float) -> None:
+    """delay秒后写一次文件，已经排过了就不重复排（调用方要持有_users_lock）"""
+    global _users_flush_timer
+    
+    if _users_flush_timer is not None:
+        return
+    _users_flush_timer = threading.Timer(delay, flush_users)
+    _users_flush_timer.daemon = True
+    _users_flush_timer.start()
+
+
+def _update_users(users: Dict[str, str]) -> bool:
+    """用修改后的用户数据替换缓存，按写入间隔决定马上写文件还是稍后合并写（调用方要持有_users_lock）
+    
+    Returns:
+        bool: 马上写的返回是否写成功，排到稍后写的返回True
+    """
+    global _users_cache, _users_dirty, _users_generation
+    
+    _users_cache = users
+    _users_generation += 1
+    _users_dirty = True
+    if _users_flush_timer is not None:
+        # 已经排了一次写入，这次修改跟着一起写
         return True
+    
+    wait = _users_last_flush + USERS_FLUSH_INTERVAL - time.monotonic()
+    if wait <= 0:
+        return flush_users()
+    _schedule_flush(wait)
+    return True
+
+
+# 进程退出前把攒着的修改写进去
+atexit.register(flush_users)
+
+
+def users_generation() -> int:
+    """当前用户数据的版本号，用户有变化时会变
+    
+    用文件存储时顺便检查一下users.json有没有被外部改过（和load_users一样只多一次stat）
+    启用Redis存储时读Redis里的共享计数器（一次GET），别的worker增删改了用户这里也能马上看到；
+    读不到时返回-1，和正常的版本号都不一样，不会用上之前缓存的验证结果
+    调用时要放在线程池里（启用Redis存储时会走网络）
+    """
+    client = _get_redis()
+    if client is None:
+        load_users()
+        return _users_generation
+    try:
+        return int(client.get(USERS_GENERATION_REDIS_KEY) or 0)
     except Exception as e:
-        logger.error(f"保存用户数据失败: {e}")
-        return False
+        logger.error(f"从Redis读取用户数据版本号失败: {e}")
+        return -1
+
+
+def _forget_totp_results(client, uuid_str: str) -> None:
+    """用户被删除或者换了密钥时调用：共享版本号加1，删掉Redis里这个用户的TOTP验证结果缓存"""
+    try:
+        client.incr(USERS_GENERATION_REDIS_KEY)
+        keys = list(client.scan_iter(match=f"{TOTP_CACHE_KEY_PREFIX}{uuid_str}:*"))
+        if keys:
+            client.delete(*keys)
+    except Exception as e:
+        logger.warning(f"清理TOTP验证缓存失败: uuid={uuid_str}, error={e}")
 
 
 def get_user_key(uuid_str: str) -> Optional[str]:
     """根据UUID获取对应的TOTP密钥
     找不到就返回None
     """
-    users = load_users()
-    return users.get(uuid_str)
+    client = _get_redis()
+    if client is not None:
+        # 只取这一个用户，一次HGET
+        try:
+            return client.hget(USERS_REDIS_KEY, uuid_str)
+        except Exception as e:
+            logger.error(f"从Redis读取用户密钥失败: uuid={uuid_str}, error={e}")
+            return None
+    
+    return load_users().get(uuid_str)
 
 
 def add_user(uuid_str: str, totp_key: str) -> bool:
     """添加新用户
     如果UUID已存在会覆盖（可能不太安全，但先这样）
     """
-    users = load_users()
-    users[uuid_str] = totp_key
-    return save_users(users)
+    client = _get_redis()
+    if client is not None:
+        try:
+            client.hset(USERS_REDIS_KEY, uuid_str, totp_key)
+            _forget_totp_results(client, uuid_str)
+            return True
+        except Exception as e:
+            logger.error(f"保存用户到Redis失败: uuid={uuid_str}, error={e}")
+            return False
+    
+    with _users_lock:
+        # 拷一份再改，不影响别人手里拿着的旧缓存
+        users = dict(load_users())
+        users[uuid_str] = totp_key
+        return _update_users(users)
 
 
 def delete_user(uuid_str: str) -> bool:
     """删除用户
     返回是否成功删除了
     """
-    users = load_users()
+    client = _get_redis()
+    if client is not None:
+        try:
+            if client.hdel(USERS_REDIS_KEY, uuid_str):
+                _forget_totp_results(client, uuid_str)
+                logger.info(f"已删除用户: {uuid_str}")
+                return True
+        except Exception as e:
+            logger.error(f"从Redis删除用户失败: uuid={uuid_str}, error={e}")
+        return False
     
-    if uuid_str in users:
-        del users[uuid_str]
-        if save_users(users):
-            logger.info(f"已删除用户: {uuid_str}")
-            return True
+    with _users_lock:
+        users = dict(load_users())
+        
+        if uuid_str in users:
+            del users[uuid_str]
+            if _update_users(users):
+                logger.info(f"已删除用户: {uuid_str}")
+                return True
     
     return False
 
 
+def migrate_users_to_redis() -> int:
+    """把users.json里的用户全部导入Redis（已存在的UUID会被覆盖）
+    
+    Returns:
+        int: 导入的用户数
+        
+    Raises:
+        RuntimeError: 没有启用Redis存储
+    """
+    client = _get_redis()
+    if client is None:
+        raise RuntimeError("没有启用Redis存储，请先设置CAMFC_USERS_REDIS_URL并安装redis库")
+    
+    ensure_users_file()
+    users = _read_users_file()
+    if users:
+        client.hset(USERS_REDIS_KEY, mapping=users)
+    logger.info(f"已把 {len(users)} 个用户从 {USERS_FILE} 导入Redis")
+    return len(users)
+
+
 def create_new_user() -> tuple[str, str]:
     """创建新用户
     返回 (uuid, totp_key) 对
@@ -130,8 +400,50 @@ def create_new_user() -> tuple[str, str]:
 
 def verify_totp(uuid_str: str, totp_code: str) -> bool:
     """验证TOTP码是否正确
+    
+    启用了Redis存储时，验证结果也缓存在Redis里，所有worker共享：
+    同一个(uuid, totp码)在当前时间步内只算一次HMAC，之后都是一次GET
+    验证失败的结果也缓存几秒，挡一下暴力重试
+    缓存最多留到当前时间步结束，不会让一个码比原来多有效一段时间
+    格式不对的输入（不是TOTP_DIGITS位ASCII数字、用户ID超长）直接返回False，
+    不去算也不进缓存，客户端没法拿任意内容往Redis里写key
+    
+    调用时要放在线程池里（用户数据在Redis里时这里会走网络）
+    """
+    if (len(totp_code) != TOTP_DIGITS or not (totp_code.isascii() and totp_code.isdigit())
+            or len(uuid_str) > USER_ID_MAX_LENGTH):
+        logger.warning(f"TOTP验证失败：格式不对: uuid={uuid_str[:USER_ID_MAX_LENGTH]}")
+        return False
+    
+    client = _get_redis()
+    if client is None:
+        return _check_totp(uuid_str, totp_code)
+    
+    cache_key = f"{TOTP_CACHE_KEY_PREFIX}{uuid_str}:{totp_code}"
+    try:
+        cached = client.get(cache_key)
+    except Exception as e:
+        logger.warning(f"读取TOTP验证缓存失败: {e}")
+        cached = None
+    if cached is not None:
+        return cached == "1"
+    
+    is_valid = _check_totp(uuid_str, totp_code)
+    
+    # 到当前时间步结束还剩几秒（至少1秒，Redis的过期时间不能是0）
+    step_left = TOTP_TIME_STEP - int(time.time()) % TOTP_TIME_STEP
+    ttl = step_left if is_valid else min(TOTP_NEGATIVE_CACHE_TTL, step_left)
+    try:
+        client.set(cache_key, "1" if is_valid else "0", ex=max(ttl, 1))
+    except Exception as e:
+        logger.warning(f"写入TOTP验证缓存失败: {e}")
+    return is_valid
+
+
+def _check_totp(uuid_str: str, totp_code: str) -> bool:
+    """实际验证TOTP码（不走缓存）
     根据UUID找到对应的密钥，然后验证TOTP码
-    同时打印当前正确的TOTP码（仅用于调试！）
+    只比对验证码，正确的验证码（以及前后窗口的）任何日志级别下都不输出
     """
     import utotp
 
@@ -141,36 +453,34 @@ def verify_totp(uuid_str: str, totp_code: str) -> bool:
         logger.warning(f"验证失败：找不到UUID对应的用户: {uuid_str}")
         return False
 
-    # 创建TOTP对象
-    correct_code=utotp.generate_totp(totp_key,custume_time=time.time())
-    
-    last_code = utotp.generate_totp(totp_key,time_move=-30,custume_time=time.time())
-    
-    next_code = utotp.generate_totp(totp_key,time_move=30,custume_time=time.time())
+    # 上一个、当前、下一个时间步的验证码一次算出来（密钥只解码一次）
+    last_code, correct_code, next_code = utotp.generate_totp_window(totp_key, window=1)
 
     # 验证输入的TOTP码
-    is_valid = (correct_code == totp_code)or (last_code == totp_code) or (next_code == totp_code)
+    # 用compare_digest做常数时间比较，三个窗口都比一遍（不短路），
+    # 响应时间不会泄露输入码和正确码有几位相同、或者匹配的是哪个窗口
+    # 比较字节而不是str：compare_digest遇到非ASCII的str会抛TypeError，
+    # 请求头里带个中文就变成500了，转成字节后这种输入只是比不上
+    totp_bytes = totp_code.encode("utf-8", "surrogatepass")
+    matches = [hmac.compare_digest(code.encode(), totp_bytes) for code in (correct_code, last_code, next_code)]
+    is_valid = any(matches)
     
-    if correct_code == totp_code:
-        logger.info(f"刚好")
-    elif last_code == totp_code:
-        logger.info(f"慢了一点点")
-    elif next_code == totp_code:
-        logger.info(f"快了一点点")
-
     if is_valid:
         logger.debug(f"TOTP验证通过: uuid={uuid_str}")
     else:
-        logger.warning(f"TOTP验证失败: uuid={uuid_str}, 输入码={totp_code}, 正确码={correct_code}")
-    logger.info('匹配的uuid : '+uuid_str)
-    logger.info('收到的totp : '+str(totp_code))
-    logger.info('正确的totp : '+str(correct_code))
-    logger.info('\n')
+        logger.warning(f"TOTP验证失败: uuid={uuid_str}, 输入码={totp_code}")
     
-    logger.info('上一个totp : '+str(last_code))
-    logger.info('下一个totp : '+str(next_code))
-
-    logger.warning(f"time:{time.time()}\ttotp:{correct_code}")
+    # 下面这些调试信息每次鉴权都打太费了，只在DEBUG级别输出
+    if logger.isEnabledFor(logging.DEBUG):
+        if matches[0]:
+            logger.debug(f"刚好")
+        elif matches[1]:
+            logger.debug(f"慢了一点点")
+        elif matches[2]:
+            logger.debug(f"快了一点点")
+        logger.debug('匹配的uuid : '+uuid_str)
+        logger.debug('收到的totp : '+str(totp_code))
+        # 当前有效的验证码不写日志，日志泄露了就能直接拿来登录
     
     return is_valid
 
@@ -4,9 +4,18 @@ try:
     import ustruct as struct
     from uhashlib import sha1
     from utime import time
+    # MicroPython没有hmac模块，用下面纯Python实现的Sha1HMAC和b32decode
+    hmac = None
+    _std_b32decode = None
+    lru_cache = None
 except ImportError:
     # 非MicroPython环境（标准Python）
+    # 标准库hmac走OpenSSL的C实现，比纯Python的Sha1HMAC快得多
+    # base64.b32decode也是C实现的，不用逐字符循环再格式化成十六进制字符串
+    import hmac
     import struct
+    from base64 import b32decode as _std_b32decode
+    from functools import lru_cache
     from hashlib import sha1
     from time import time
 
@@ -15,6 +24,8 @@ bytes_types = (bytes, bytearray)
 
 
 class Sha1HMAC:
+    """纯Python的HMAC-SHA1，只在MicroPython上用（标准Python直接用hmac模块）"""
+
     def __init__(self, key, msg=None):
         def translate(d, t):
             return bytes(t[x] for x in d)
@@ -69,7 +80,10 @@ def get_epoch(test_mode=False,time_move=0,custume_time=0):
 def hotp(key, counter, digits=6):
     """生成HOTP验证码"""
     counter = struct.pack(">Q", counter)  # 打包为大端8字节无符号长整数
-    mac = Sha1HMAC(key, counter).digest()
+    if hmac is not None:
+        mac = hmac.digest(key, counter, "sha1")
+    else:
+        mac = Sha1HMAC(key, counter).digest()
     offset = mac[-1] & 0x0F
     binary = struct.unpack(">L", mac[offset : offset + 4])[0] & 0x7FFFFFFF
     code = str(binary)[-digits:]
@@ -172,6 +186,25 @@ def b32decode(s):
     return b"".join(parts)
 
 
+def _decode_secret(secret):
+    """把Base32密钥字符串解码成字节（自动补全=，不区分大小写）"""
+    # 自动补全Base32字符串到8的倍数长度（无需用户手动处理）
+    padding_len = (8 - len(secret) % 8) % 8
+    secret_padded = secret + '=' * padding_len
+    
+    # 解码Base32密钥为字节（casefold：和纯Python版一样接受小写）
+    if _std_b32decode is not None:
+        return _std_b32decode(secret_padded, casefold=True)
+    return b32decode(secret_padded)
+
+
+# 服务端每次验证都要解码同一个用户的密钥，解码结果缓存起来（每个密钥只占几十字节，数量有上限）
+# MicroPython没有functools，不缓存
+DECODE_CACHE_SIZE = 4096
+if lru_cache is not None:
+    _decode_secret = lru_cache(maxsize=DECODE_CACHE_SIZE)(_decode_secret)
+
+
 def generate_totp(secret, digits=6, time_step=30, test_mode=False,time_move=0,custume_time=0):
     """
     生成TOTP动态验证码（对外暴露的核心接口）
@@ -181,13 +214,8 @@ def generate_totp(secret, digits=6, time_step=30, test_mode=False,time_move=0,cu
     :param test_mode: 是否启用测试模式，默认False，使用真实时间
     :return: 字符串格式的TOTP验证码
     """
-    # 自动补全Base32字符串到8的倍数长度（无需用户手动处理）
-    padding_len = (8 - len(secret) % 8) % 8
-    secret_padded = secret + '=' * padding_len
-    
     try:
-        # 解码Base32密钥为字节
-        key_bytes = b32decode(secret_padded)
+        key_bytes = _decode_secret(secret)
         # 计算时间计数器并生成验证码
         counter = get_epoch(test_mode=test_mode,time_move=time_move,custume_time=custume_time) // time_step
         return hotp(key_bytes, counter, digits)
@@ -195,6 +223,25 @@ def generate_totp(secret, digits=6, time_step=30, test_mode=False,time_move=0,cu
         raise ValueError(f"生成TOTP失败：{str(e)}")
 
 
+def generate_totp_window(secret, window=1, digits=6, time_step=30, test_mode=False):
+    """
+    一次生成当前时间前后若干个时间步的TOTP验证码
+    密钥只解码一次、时间只取一次，比调用2*window+1次generate_totp省事
+    :param secret: Base32格式的密钥字符串（无需手动补=）
+    :param window: 前后各几个时间步（默认1，即上一个、当前、下一个）
+    :param digits: 验证码位数（默认6位）
+    :param time_step: 验证码有效期（默认30秒）
+    :param test_mode: 是否启用测试模式，默认False，使用真实时间
+    :return: 验证码列表，长度2*window+1，按时间从早到晚，中间那个是当前的
+    """
+    try:
+        key_bytes = _decode_secret(secret)
+        counter = get_epoch(test_mode=test_mode) // time_step
+        return [hotp(key_bytes, c, digits) for c in range(counter - window, counter + window + 1)]
+    except Exception as e:
+        raise ValueError(f"生成TOTP失败：{str(e)}")
+
+
 # 测试示例（直接运行库文件时执行）
 if __name__ == "__main__":
     # 示例：传入Base32密钥，获取验证码